@@ -1,3 +1,4 @@
+import importlib
 import logging
 
 logging.basicConfig()
@@ -11,22 +12,92 @@ except ImportError:
         'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
     cmd = None
 
-from . import setbetahelix, utils, savegro, hbond, betafab2, betafabgui2, gmxselections
+# the submodules, imported on first use (see __getattr__)
+SUBMODULES = ['setbetahelix', 'utils', 'savegro', 'hbond', 'betafab2', 'gmxselections', 'batch', 'combinatorial',
+              'clashes', 'minimize', 'rotamers', 'profiling', 'secstructdb', 'fragments', 'enantiomer', 'nerf',
+              'geometry', 'topology', 'peptidearrays', 'templatecache', 'residuelibrary', 'sequencetrie',
+              'betafabgui2']
+
+# PyMOL commands: command name -> (submodule, function)
+COMMANDS = {
+    'fold_bp': ('setbetahelix', 'fold_bp'),
+    'select_bbb': ('utils', 'select_bbb'),
+    'save_gro': ('savegro', 'save_gro'),
+    'save_g96': ('savegro', 'save_g96'),
+    'save_crd': ('savegro', 'save_crd'),
+    'restrain_hbonds_gmx': ('hbond', 'restrain_hbonds_gmx'),
+    'gmx_beta_backbone_dihedrals_selection': ('gmxselections', 'gmx_beta_backbone_dihedrals_selection'),
+    'label_chains': ('utils', 'label_chains'),
+    'restrain_beta_backbone_dihedrals': ('utils', 'restrain_beta_backbone_dihedrals'),
+    'betafab2': ('betafab2', 'betafab2cmd'),
+    'betafab2_cache': ('betafab2', 'betafab2_cache'),
+    'betafab2_batch': ('batch', 'betafab2_batchcmd'),
+    'betafab2_enumerate': ('combinatorial', 'betafab2_enumerate'),
+    'check_clashes': ('clashes', 'check_clashes'),
+    'clean_bp': ('minimize', 'clean_bp'),
+    'pack_sidechains': ('rotamers', 'pack_sidechains'),
+    'ssdb_add': ('secstructdb', 'ssdb_add'),
+    'ssdb_del': ('secstructdb', 'ssdb_del'),
+    'ssdb_list': ('secstructdb', 'ssdb_list'),
+    'ssdb_dihedrals': ('secstructdb', 'ssdb_dihedrals'),
+    'ssdb_resetdefaults': ('secstructdb', 'ssdb_resetdefaults'),
+    'enantiomer': ('enantiomer', 'enantiomer'),
+}
+
+
+class LazyCommand:
+    """A PyMOL command stub, importing the submodule implementing the command on first use
+
+    The stub can be registered with :func:`pymol.cmd.extend` in place of the real function. On importing, the submodule
+    registers the real function itself, replacing the stub. PyMOL finds the arguments and the help text of the real
+    function through the `__wrapped__` and `__doc__` attributes.
+    """
+
+    def __init__(self, module: str, function: str):
+        self._module = module
+        self._function = function
+        self.__name__ = function
+
+    @property
+    def __wrapped__(self):
+        return getattr(importlib.import_module('.' + self._module, __name__), self._function)
+
+    @property
+    def __doc__(self):
+        return self.__wrapped__.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.__wrapped__(*args, **kwargs)
+
+
+def __getattr__(name: str):
+    # import the submodules on first access, e.g. pmlbeta.betafab2
+    if name in SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def _guiWindow(module: str):
+    """Create a menu item callback, importing a window of the graphical user interface when first opened"""
+
+    def run():
+        try:
+            window = importlib.import_module('.betafabgui2.' + module, __name__)
+        except ImportError as ie:
+            warnings.warn('GUI is not supported due to an import error: {}'.format(ie.args))
+            return
+        return window.run()
+
+    return run
 
 
 def __init_plugin__(self):
     if cmd is not None:
-        addmenuitemqt('BetaFab2', command=betafabgui2.betafab2.run)
-        addmenuitemqt('BetaFab2 dihedral editor', command=betafabgui2.dihedraleditor.run)
+        # the GUI (Qt and the icon resources) is only imported when a window is opened
+        addmenuitemqt('BetaFab2', command=_guiWindow('betafab2'))
+        addmenuitemqt('BetaFab2 dihedral editor', command=_guiWindow('dihedraleditor'))
 
 
 if cmd is not None:
-    cmd.extend('fold_bp', setbetahelix.fold_bp)
-    cmd.extend('select_bbb', utils.select_bbb)
-    cmd.extend('save_gro', savegro.save_gro)
-    cmd.extend('save_g96', savegro.save_g96)
-    cmd.extend('save_crd', savegro.save_crd)
-    cmd.extend('restrain_hbonds_gmx', hbond.restrain_hbonds_gmx)
-    cmd.extend('gmx_beta_backbone_dihedrals_selection', gmxselections.gmx_beta_backbone_dihedrals_selection)
-    cmd.extend('label_chains', utils.label_chains)
-    cmd.extend('restrain_beta_backbone_dihedrals', utils.restrain_beta_backbone_dihedrals)
+    for _name, (_module, _function) in COMMANDS.items():
+        cmd.extend(_name, LazyCommand(_module, _function))
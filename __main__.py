@@ -0,0 +1,152 @@
+"""Command-line interface for building, folding and exporting peptides without a PyMOL session
+
+Usage examples::
+
+    python -m pmlbeta build -s "ACE, (S)B3hV{H14M}, (S)B3hA{H14M}, (S)B3hL{H14M}, NME" -o peptide.gro
+    python -m pmlbeta build -s "(S)B3hV, (S)B3hA, (S)B3hL" -o peptide.pdb --profile profile.json
+    python -m pmlbeta build -f library.txt -d structures --format g96 -j 8
+    python -m pmlbeta fold peptide.pdb H12P -o folded.pdb
+    python -m pmlbeta export folded.pdb folded.crd
+    python -m pmlbeta restraints folded.pdb hbonds.itp --kind hbonds
+
+The output format is given by the extension of the output file: .gro, .g96 and .crd are written by this plugin, all
+other formats (e.g. .pdb) by PyMOL. Sequence files contain one peptide per line, see :mod:`pmlbeta.batch`.
+
+A headless PyMOL instance is started in the process, the graphical user interface is never imported.
+"""
+import argparse
+import logging
+import os
+import sys
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def _startPyMOL():
+    import pymol2
+    instance = pymol2.SingletonPyMOL()
+    instance.start()
+    return instance
+
+
+def _load(filename: str) -> str:
+    from pymol import cmd
+    objname = os.path.splitext(os.path.basename(filename))[0]
+    cmd.load(filename, objname)
+    return objname
+
+
+def build(args: argparse.Namespace) -> int:
+    from .betafab2 import BetaPeptide, PeptideBuilder
+    from .batch import betafab2_batch, read_sequences, save_peptide
+    from .profiling import profiled
+    if args.sequence is not None:
+        if args.output is None:
+            raise ValueError('An output file must be given for a single sequence')
+        with profiled(args.profile):
+            PeptideBuilder().build(args.name, BetaPeptide.parseBetaPeptideSequence(args.sequence))
+        save_peptide(args.output, args.name)
+        return 0
+    results = betafab2_batch(list(read_sequences(args.file)), args.outdir, args.format, args.jobs, args.chunksize)
+    failed = [r for r in results if r[2] is not None]
+    for name, filename, error in failed:
+        print('{}: {}'.format(name, error), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def fold(args: argparse.Namespace) -> int:
+    from .setbetahelix import fold_bp
+    from .batch import save_peptide
+    objname = _load(args.input)
+    fold_bp(args.sstype, 'model {} and ({})'.format(objname, args.selection), pack=args.pack)
+    save_peptide(args.output, objname)
+    return 0
+
+
+def export(args: argparse.Namespace) -> int:
+    from .batch import save_peptide
+    objname = _load(args.input)
+    save_peptide(args.output, objname)
+    return 0
+
+
+def restraints(args: argparse.Namespace) -> int:
+    from .hbond import restrain_hbonds_gmx
+    from .utils import restrain_beta_backbone_dihedrals
+    objname = _load(args.input)
+    selection = 'model {} and ({})'.format(objname, args.selection)
+    if args.kind == 'hbonds':
+        restrain_hbonds_gmx(selection, args.output, strength=args.strength if args.strength is not None else 1000)
+    else:
+        restrain_beta_backbone_dihedrals(args.output, selection, fc=args.strength if args.strength is not None else 10000)
+    return 0
+
+
+def parser() -> argparse.ArgumentParser:
+    """Create the command-line parser
+
+    :return: the parser
+    :rtype: argparse.ArgumentParser
+    """
+    p = argparse.ArgumentParser(prog='python -m pmlbeta', description='Build and manipulate alpha/beta-peptides')
+    p.add_argument('-v', '--verbose', action='store_true', help='print debugging messages')
+    subparsers = p.add_subparsers(dest='command', required=True)
+
+    pbuild = subparsers.add_parser('build', help='build peptides from sequences')
+    source = pbuild.add_mutually_exclusive_group(required=True)
+    source.add_argument('-s', '--sequence', help='a single sequence, residues separated by commas')
+    source.add_argument('-f', '--file', help='a sequence file, one "name: sequence" entry per line')
+    pbuild.add_argument('-o', '--output', help='output file for a single sequence')
+    pbuild.add_argument('-n', '--name', default='peptide', help='object name for a single sequence')
+    pbuild.add_argument('-d', '--outdir', default='.', help='output directory for a sequence file')
+    pbuild.add_argument('--format', default='pdb', help='output format for a sequence file (default: pdb)')
+    pbuild.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes for a sequence file (default: number of CPUs)')
+    pbuild.add_argument('--chunksize', type=int, default=16, help='sequences handed to a worker at once')
+    pbuild.add_argument('--profile', nargs='?', const=True, default=False, metavar='JSONFILE',
+                        help='print the time spent in each build stage and residue for a single sequence, optionally '
+                             'also writing it to a JSON file')
+    pbuild.set_defaults(function=build)
+
+    pfold = subparsers.add_parser('fold', help='fold a peptide into a secondary structure')
+    pfold.add_argument('input', help='input structure file')
+    pfold.add_argument('sstype', help='secondary structure, as understood by the fold_bp command')
+    pfold.add_argument('-o', '--output', required=True, help='output file')
+    pfold.add_argument('--selection', default='all', help='restrict folding to this selection')
+    pfold.add_argument('--pack', action='store_true', help='place the side chains in their best rotamers')
+    pfold.set_defaults(function=fold)
+
+    pexport = subparsers.add_parser('export', help='convert a structure file')
+    pexport.add_argument('input', help='input structure file')
+    pexport.add_argument('output', help='output file')
+    pexport.set_defaults(function=export)
+
+    prestraints = subparsers.add_parser('restraints', help='write GROMACS restraint files')
+    prestraints.add_argument('input', help='input structure file')
+    prestraints.add_argument('output', help='output .itp file')
+    prestraints.add_argument('--kind', choices=['hbonds', 'dihedrals'], default='hbonds',
+                             help='hydrogen bond distance or backbone dihedral restraints (default: hbonds)')
+    prestraints.add_argument('--strength', type=float, default=None, help='force constant')
+    prestraints.add_argument('--selection', default='all', help='restrict to this selection')
+    prestraints.set_defaults(function=restraints)
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parser().parse_args(argv)
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    instance = _startPyMOL()
+    try:
+        return args.function(args)
+    except Exception as exc:
+        print('Error: {}'.format(exc), file=sys.stderr)
+        return 1
+    finally:
+        instance.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""Build many peptides in parallel and write them to disk
+
+PyMOL has a single global state, thus building peptides with :func:`pmlbeta.betafab2.betafab2` in one session is
+sequential. Here the sequences are distributed over a pool of worker processes, each of which runs its own PyMOL
+instance. The workers save the finished structures directly to files, only their names travel back to the caller.
+
+Sequences are read from text files, one peptide per line in the form::
+
+    name: residue1, residue2, residue3, ...
+
+where the residues follow the markup of :meth:`pmlbeta.betafab2.BetaPeptide.parseBetaPeptideSequence`. The name and
+the colon can be omitted, then the peptide is named after the line number. Empty lines and lines starting with '#'
+are ignored. Names must be unique, as they also name the output files, and must be valid names of PyMOL objects:
+letters, digits and underscores, but no reserved word such as 'all'.
+"""
+import logging
+import multiprocessing
+import os
+import re
+import warnings
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from pymol import cmd
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    cmd = None
+
+from .betafab2 import BetaPeptide, PeptideBuilder
+from .savegro import save_gro, save_g96, save_crd
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# output formats written by this plugin, all others are delegated to cmd.save()
+WRITERS = {'gro': save_gro, 'g96': save_g96, 'crd': save_crd}
+
+_NAMEDLINE = re.compile(r'^\s*(?P<name>[A-Za-z0-9_.+-]+)\s*:(?P<sequence>.*)$')
+# characters with a meaning in selections, e.g. '+' or '.', are not allowed in object names
+_OBJECTNAME = re.compile(r'^[A-Za-z0-9_]+$')
+
+# the state of a worker process
+_pymol = None
+_builder = None
+_outdir = None
+_fmt = None
+
+
+def is_valid_name(name: str) -> bool:
+    """Decide if a peptide name can be used as the name of a PyMOL object and in selections
+
+    :param name: the name
+    :type name: str
+    :return: True if the name consists of letters, digits and underscores only and is not a reserved word
+    :rtype: bool
+    """
+    return (_OBJECTNAME.match(name) is not None) and ((cmd is None) or (cmd.get_legal_name(name) == name))
+
+
+def read_sequences(filename: str) -> Iterator[Tuple[str, str]]:
+    """Read named sequences from a file
+
+    :param filename: the name of the file
+    :type filename: str
+    :return: the names and the sequences, in the order of the file
+    :rtype: iterator of (str, str) tuples
+    :raises ValueError: if a name occurs more than once or is not a valid object name
+    """
+    seen = {}  # name -> line number
+    with open(filename, 'rt') as f:
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if (not line) or line.startswith('#'):
+                continue
+            m = _NAMEDLINE.match(line)
+            if m is None:
+                name, sequence = 'peptide{}'.format(lineno), line
+            else:
+                name, sequence = m['name'], m['sequence'].strip()
+            if not is_valid_name(name):
+                raise ValueError('Invalid peptide name {} in {}, line {}: use letters, digits and underscores, but '
+                                 'no reserved word'.format(name, filename, lineno))
+            if name in seen:
+                raise ValueError('Duplicate peptide name {} in {}, lines {} and {}'.format(
+                    name, filename, seen[name], lineno))
+            seen[name] = lineno
+            yield name, sequence
+
+
+def save_peptide(filename: str, objname: str):
+    """Save a peptide to a file, the format is given by the extension
+
+    :param filename: the name of the file
+    :type filename: str
+    :param objname: the name of the PyMOL object
+    :type objname: str
+    """
+    fmt = os.path.splitext(filename)[1][1:].lower()
+    if fmt in WRITERS:
+        WRITERS[fmt](filename, 'model {}'.format(objname))
+    else:
+        cmd.save(filename, 'model {}'.format(objname), format=fmt)
+
+
+def _initWorker(outdir: str, fmt: str):
+    global _pymol, _builder, _outdir, _fmt
+    # the routines of this plugin use the global `pymol.cmd`, which is backed by the singleton instance. In a fresh
+    # process this is our own, isolated PyMOL.
+    import pymol2
+    _pymol = pymol2.SingletonPyMOL()
+    _pymol.start()
+    _builder = PeptideBuilder()
+    _outdir = outdir
+    _fmt = fmt
+
+
+def _checkNames(sequences: Iterable[Tuple[str, str]]) -> Iterator[Tuple[str, str, Optional[str]]]:
+    # the output file is named after the peptide: a later peptide of the same name would overwrite it. Invalid names
+    # could select other objects in the worker. The error message tells _buildOne() to skip the peptide.
+    seen = set()
+    for name, sequence in sequences:
+        if not is_valid_name(name):
+            yield name, sequence, 'Invalid name, not built: use letters, digits and underscores, but no reserved word'
+        elif name in seen:
+            yield name, sequence, 'Duplicate name, not built: the output file belongs to an earlier peptide'
+        else:
+            seen.add(name)
+            yield name, sequence, None
+
+
+def _buildOne(item: Tuple[str, str, Optional[str]]) -> Tuple[str, Optional[str], Optional[str]]:
+    name, sequence, error = item
+    if error is not None:
+        return name, None, error
+    filename = os.path.join(_outdir, '{}.{}'.format(name, _fmt))
+    try:
+        # consecutive sequences of a chunk go to the same worker: their common N-terminal residues are not rebuilt
+        _builder.build(name, BetaPeptide.parseBetaPeptideSequence(sequence))
+        save_peptide(filename, name)
+    except Exception as exc:
+        return name, None, '{}: {}'.format(type(exc).__name__, exc)
+    finally:
+        cmd.delete('model {}'.format(name))
+    return name, filename, None
+
+
+def betafab2_batch(sequences: Iterable[Tuple[str, str]], outdir: str, fmt: str = 'pdb', nproc: Optional[int] = None,
+                   chunksize: int = 16) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """Build peptides in parallel processes and save them to files
+
+    Each worker process runs its own PyMOL instance, thus the PyMOL session of the caller is not touched. The
+    sequences are handed out in chunks of consecutive entries: it pays to order the sequences so that similar ones
+    are near to each other. Peptides are saved under their names, thus only the first of several sequences with the
+    same name is built, the others are reported as failed, like peptides whose names are not valid object names (see
+    :func:`is_valid_name`).
+
+    :param sequences: names and sequences, e.g. as returned by :func:`read_sequences`
+    :type sequences: iterable of (str, str) tuples
+    :param outdir: the output directory, created if needed
+    :type outdir: str
+    :param fmt: the file format, e.g. 'pdb', 'gro', 'g96', 'crd' or anything :func:`pymol.cmd.save` understands
+    :type fmt: str
+    :param nproc: the number of worker processes, by default the number of CPUs
+    :type nproc: int or None
+    :param chunksize: the number of sequences handed to a worker at once
+    :type chunksize: int
+    :return: the name, the output file name (None on failure) and the error message (None on success) for each
+        sequence, in the input order
+    :rtype: list of (str, str or None, str or None) tuples
+    """
+    os.makedirs(outdir, exist_ok=True)
+    # forking a running PyMOL is unsafe, start the workers from scratch
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(nproc, initializer=_initWorker, initargs=(outdir, fmt)) as pool:
+        results = []
+        for name, filename, error in pool.imap(_buildOne, _checkNames(sequences), chunksize=chunksize):
+            if error is not None:
+                logger.warning('Cannot build peptide {}: {}'.format(name, error))
+            results.append((name, filename, error))
+    logger.info('Built {} of {} peptides into {}'.format(
+        len([r for r in results if r[2] is None]), len(results), outdir))
+    return results
+
+
+def betafab2_batchcmd(filename, outdir, fmt='pdb', nproc=0, chunksize=16, _self=None):
+    """
+    DESCRIPTION
+
+        Build many peptides in parallel and save them to files
+
+    USAGE
+
+        betafab2_batch filename, outdir [, fmt [, nproc [, chunksize]]]
+
+    ARGUMENTS
+
+        filename = str: the sequence file. Each line holds a peptide in the
+            form "name: aa1, aa2, aa3, ...", using the same residue
+            descriptors as the betafab2 command. Empty lines and lines
+            starting with '#' are ignored. The names must be unique valid
+            object names: letters, digits and underscores.
+
+        outdir = str: the output directory. Each peptide is written to
+            <outdir>/<name>.<fmt>
+
+        fmt = str: the output format, e.g. pdb (default), gro, g96, crd or
+            anything the save command understands
+
+        nproc = int: the number of worker processes, 0 (default) for the
+            number of CPUs
+
+        chunksize = int: the number of sequences handed to a worker at once
+
+    NOTES
+
+        The peptides are built in separate processes, each running its own
+        PyMOL instance: they are not loaded into the current session.
+
+    SEE ALSO
+
+        betafab2
+    """
+    nproc = int(nproc)
+    results = betafab2_batch(list(read_sequences(filename)), outdir, fmt, nproc if nproc > 0 else None, int(chunksize))
+    for name, outfile, error in results:
+        if error is not None:
+            print('{}: FAILED ({})'.format(name, error))
+    print('Built {} of {} peptides into {}'.format(len([r for r in results if r[2] is None]), len(results), outdir))
+    return results
+
+
+if cmd is not None:
+    cmd.extend('betafab2_batch', betafab2_batchcmd)
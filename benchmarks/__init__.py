@@ -0,0 +1,42 @@
+"""Timing benchmarks for the building and analysis routines
+
+The benchmarks run headless: they only need the :mod:`pymol` Python module, no graphical PyMOL session. Each
+submodule can be run as a script, e.g.::
+
+    python -m pmlbeta.benchmarks.assembly
+
+:mod:`pmlbeta.benchmarks.suite` runs the main entry points on a range of problem sizes, saves the results as JSON and
+compares them against a stored baseline, for spotting regressions after upgrades::
+
+    python -m pmlbeta.benchmarks.suite -o results.json
+"""
+import time
+from typing import Callable, Tuple, Any
+
+
+def timed(function: Callable, *args, **kwargs) -> Tuple[float, Any]:
+    """Call a function and measure the elapsed wall-clock time
+
+    :param function: the function to call
+    :type function: callable
+    :return: the elapsed time in seconds and the return value of the function
+    :rtype: tuple of (float, object)
+    """
+    t0 = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - t0, result
+
+
+def beta_sequence(length: int, ss: str = None) -> list:
+    """Create a beta-peptide sequence of the requested length, suitable for :func:`pmlbeta.betafab2.betafab2`
+
+    :param length: the number of residues
+    :type length: int
+    :param ss: the name of a secondary structure to fold into, or None to leave the peptide unfolded
+    :type ss: str or None
+    :return: the residue designations
+    :rtype: list of str
+    """
+    residues = ['(S)B3hV', '(S)B3hA', '(S)B3hL']
+    fold = '' if ss is None else '{' + ss + '}'
+    return [residues[i % len(residues)] + fold for i in range(length)]
@@ -0,0 +1,56 @@
+"""Scaling of the peptide assembly with the chain length
+
+The copy-per-residue "fuse" engine re-serializes the growing chain at each step, hence its cost grows quadratically.
+The "append" and "nerf" engines must scale linearly: the time needed per residue should stay constant up to the
+longest chains.
+
+Run it as ``python -m pmlbeta.benchmarks.assembly``
+"""
+import logging
+from typing import Dict, List, Sequence
+
+from pymol import cmd
+
+from . import timed, beta_sequence
+from ..betafab2 import betafab2
+
+logger = logging.getLogger(__name__)
+
+
+def benchmark_assembly(lengths: Sequence[int] = (50, 100, 200, 300, 400, 500),
+                       engines: Sequence[str] = ('fuse', 'append', 'nerf'),
+                       fuse_maxlength: int = 100) -> List[Dict]:
+    """Measure the time of building unfolded beta-peptides of different lengths
+
+    :param lengths: the chain lengths to try
+    :type lengths: sequence of int
+    :param engines: the build engines to compare
+    :type engines: sequence of str
+    :param fuse_maxlength: the longest chain to build with the quadratic 'fuse' engine
+    :type fuse_maxlength: int
+    :return: the results, one dict for each (engine, length) pair
+    :rtype: list of dicts with keys 'engine', 'length', 'natoms', 'time' and 'time_per_residue'
+    """
+    results = []
+    for engine in engines:
+        for length in lengths:
+            if engine == 'fuse' and length > fuse_maxlength:
+                continue
+            objname = '_bench_assembly'
+            elapsed, peptide = timed(betafab2, objname, *beta_sequence(length), engine=engine)
+            results.append({'engine': engine, 'length': length, 'natoms': cmd.count_atoms('model ' + objname),
+                            'time': elapsed, 'time_per_residue': elapsed / length})
+            cmd.delete(objname)
+            logger.debug('{engine}: {length} residues in {time:.3f} s'.format(**results[-1]))
+    return results
+
+
+def main():
+    print('{:>8s} {:>8s} {:>8s} {:>10s} {:>14s}'.format('engine', 'length', 'atoms', 'time (s)', 'ms / residue'))
+    for r in benchmark_assembly():
+        print('{engine:>8s} {length:>8d} {natoms:>8d} {time:>10.3f} {:>14.3f}'.format(r['time_per_residue'] * 1000,
+                                                                                      **r))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Throughput of the sequence parser
+
+Sequence files of peptide libraries can hold tens of thousands of entries. Here the same sequences are parsed one by
+one with :meth:`pmlbeta.betafab2.BetaPeptide.parseBetaPeptideSequence` and in bulk with
+:func:`pmlbeta.betafab2.parse_many`.
+
+Run it as ``python -m pmlbeta.benchmarks.parsing``
+"""
+import logging
+from typing import Dict, List, Sequence
+
+from . import timed, beta_sequence
+from ..betafab2 import BetaPeptide, parse_many
+
+logger = logging.getLogger(__name__)
+
+
+def library_sequences(count: int, length: int = 12) -> List[str]:
+    """Create a library of related sequences, alternating secondary structure names and explicit torsion angles
+
+    :param count: the number of sequences
+    :type count: int
+    :param length: the number of residues in a sequence
+    :type length: int
+    :return: the sequences, residues separated by commas
+    :rtype: list of str
+    """
+    variants = ['(S)B3hV{H14M}', '(R)B3hK{H12P}', '(S)AL[-57 -47]', '(2S3S)B23h(2A3L)[-140.3 66.5 -136.8]']
+    sequences = []
+    for i in range(count):
+        residues = ['ACE'] + beta_sequence(length - 4, 'H14M') + [variants[i % len(variants)],
+                                                                  variants[(i // len(variants)) % len(variants)],
+                                                                  'NME']
+        sequences.append(', '.join(residues))
+    return sequences
+
+
+def benchmark_parsing(counts: Sequence[int] = (1000, 10000, 50000)) -> List[Dict]:
+    """Measure the parsing throughput
+
+    :param counts: the numbers of sequences to parse
+    :type counts: sequence of int
+    :return: the results, one dict for each (method, count) pair
+    :rtype: list of dicts with keys 'method', 'count', 'time' and 'rate' (sequences per second)
+    """
+    results = []
+    for count in counts:
+        sequences = library_sequences(count)
+        for method, function in [
+            ('single', lambda: [BetaPeptide.parseBetaPeptideSequence(s) for s in sequences]),
+            ('parse_many', lambda: parse_many(sequences)),
+        ]:
+            elapsed, _ = timed(function)
+            results.append({'method': method, 'count': count, 'time': elapsed, 'rate': count / elapsed})
+            logger.debug('{method}: {count} sequences parsed in {time:.3f} s'.format(**results[-1]))
+    return results
+
+
+def main():
+    print('{:>12s} {:>8s} {:>10s} {:>12s}'.format('method', 'count', 'time (s)', 'seq / s'))
+    for r in benchmark_parsing():
+        print('{method:>12s} {count:>8d} {time:>10.3f} {rate:>12.0f}'.format(**r))
+
+
+if __name__ == '__main__':
+    main()
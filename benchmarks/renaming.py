@@ -0,0 +1,54 @@
+"""Cost of renaming the atoms of a residue in a long chain
+
+:meth:`pmlbeta.betafab2.BetaPeptide.renameAtomsInResidue` works on the whole model, thus its cost depends on the
+length of the chain, not only on the size of the residue. Here all residues of a chain are renamed one after the
+other, as if they had just been attached.
+
+Run it as ``python -m pmlbeta.benchmarks.renaming``
+"""
+import logging
+from typing import Dict
+
+from pymol import cmd
+
+from . import timed, beta_sequence
+from ..betafab2 import betafab2
+from ..utils import fetchModel
+
+logger = logging.getLogger(__name__)
+
+
+def benchmark_renaming(length: int = 100) -> Dict:
+    """Measure the time of renaming the atoms in all residues of an unfolded beta-peptide
+
+    The heavy atoms are first given the backbone tag ("_sc0"), i.e. the form in which the building routines leave
+    them, which the renaming turns back into the standard names.
+
+    :param length: the chain length
+    :type length: int
+    :return: the results
+    :rtype: dict with keys 'length', 'natoms', 'time' and 'time_per_residue'
+    """
+    objname = '_bench_renaming'
+    peptide = betafab2(objname, *beta_sequence(length), engine='append')
+    with fetchModel(objname) as model:
+        for a in model.atom:
+            if a.symbol != 'H':
+                a.name = a.name + '_sc0'
+    peptide.invalidateTopology()
+    elapsed, _ = timed(lambda: [peptide.renameAtomsInResidue(r) for r in range(1, length + 1)])
+    result = {'length': length, 'natoms': cmd.count_atoms('model ' + objname), 'time': elapsed,
+              'time_per_residue': elapsed / length}
+    cmd.delete(objname)
+    logger.debug('{length} residues renamed in {time:.3f} s'.format(**result))
+    return result
+
+
+def main():
+    print('{:>8s} {:>8s} {:>10s} {:>14s}'.format('length', 'atoms', 'time (s)', 'ms / residue'))
+    r = benchmark_renaming()
+    print('{length:>8d} {natoms:>8d} {time:>10.3f} {:>14.3f}'.format(r['time_per_residue'] * 1000, **r))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+"""Regression benchmarks of the building, folding, export and analysis entry points
+
+The suite drives :func:`pmlbeta.betafab2.betafab2`, :func:`pmlbeta.setbetahelix.fold_bp`, the side chain packer, the
+GROMACS/CHARMM writers and the analysers headlessly:
+
+    build: every residue family (see :data:`FAMILIES`) with every build engine, for chains of 5, 20, 100 and 500
+        residues, including the terminal caps
+    fold: folding the same chains into the secondary structure typical of the family, then packing the side chains
+    io: writing and analysing systems of 10^3, 10^4 and 10^5 atoms, made of copies of a capped 14-helix
+    import: importing the plugin in a fresh headless interpreter, and the submodule behind the betafab2 command
+
+Some entry points scale quadratically with the number of atoms. They are only run up to the sizes in
+:data:`MAXATOMS`, larger runs are recorded as skipped.
+
+The results are saved as JSON, keyed by a name like ``build/nerf/beta3/100``, and compared against a stored
+baseline: runs slower than the baseline by more than the tolerance are reported as regressions.
+
+Run it as ``python -m pmlbeta.benchmarks.suite [-o results.json] [--baseline baseline.json]``, see ``--help``.
+"""
+import argparse
+import copy
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import chempy
+import chempy.models
+import numpy as np
+from pymol import cmd
+
+from . import timed
+from ..betafab2 import betafab2
+from ..clashes import find_clashes
+from ..hbond import restrain_hbonds_gmx
+from ..peptidearrays import PeptideArrays
+from ..rotamers import pack_selection
+from ..savegro import save_gro, save_g96, save_crd
+from ..setbetahelix import fold_bp
+from ..utils import restrain_beta_backbone_dihedrals
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# residue family -> (N-terminal cap, residues repeated in the chain, secondary structure for betafab2, for fold_bp)
+FAMILIES = {
+    'alpha': ('ACE', ['(S)AL', '(S)AK', '(S)AF', '(S)AS'], '[-57 -47]', 'Alpha-helix'),
+    'beta2': ('ACE', ['(S)B2hV', '(S)B2hA', '(S)B2hL', '(S)B2hK'], '{H14M}', 'H14M'),
+    'beta3': ('BUT', ['(S)B3hV', '(S)B3hA', '(S)B3hL', '(S)B3hW'], '{H14M}', 'H14M'),
+    'beta23': ('ACE', ['(2S3S)B23h(2A3L)', '(2S3S)B23h(2A3A)'], '{H14M}', 'H14M'),
+    'cyclic': ('ACE', ['(2S3S)ACHC', '(2S3S)ACPC'], '{H14M}', 'H14M'),
+}
+
+LENGTHS = (5, 20, 100, 500)
+SIZES = (1000, 10000, 100000)
+ENGINES = ('fuse', 'append', 'nerf')
+
+# the largest system each entry point of the "io" benchmark is run on
+MAXATOMS = {
+    'save_gro': 10000,
+    'save_g96': 10000,
+    'save_crd': 10000,
+    'restrain_hbonds_gmx': 1000,
+    'restrain_beta_backbone_dihedrals': 1000,
+    'find_clashes': 100000,
+}
+
+# the longest chain built with the quadratic 'fuse' engine
+FUSE_MAXLENGTH = 100
+
+
+def family_sequence(family: str, length: int, folded: bool = True) -> List[str]:
+    """Create a capped sequence of a residue family
+
+    :param family: the residue family, a key of :data:`FAMILIES`
+    :type family: str
+    :param length: the number of residues, including the caps
+    :type length: int
+    :param folded: add the secondary structure of the family to the residues
+    :type folded: bool
+    :return: the residue designations
+    :rtype: list of str
+    """
+    ncap, residues, ss, foldss = FAMILIES[family]
+    fold = ss if folded else ''
+    return [ncap] + [residues[i % len(residues)] + fold for i in range(length - 2)] + ['NME']
+
+
+def best_of(function: Callable, repeat: int = 3, mintime: float = 0.2, *args, **kwargs) -> float:
+    """Measure the time of a function call, repeating short calls and taking the fastest
+
+    :param function: the function to call
+    :type function: callable
+    :param repeat: the maximum number of calls
+    :type repeat: int
+    :param mintime: calls shorter than this (in seconds) are repeated
+    :type mintime: float
+    :return: the shortest elapsed time in seconds
+    :rtype: float
+    """
+    best, _ = timed(function, *args, **kwargs)
+    for i in range(repeat - 1):
+        if best >= mintime:
+            break
+        best = min(best, timed(function, *args, **kwargs)[0])
+    return best
+
+
+def benchmark_build(lengths: Sequence[int] = LENGTHS, families: Sequence[str] = tuple(FAMILIES),
+                    engines: Sequence[str] = ENGINES, fuse_maxlength: int = FUSE_MAXLENGTH) -> Dict[str, Dict]:
+    """Measure the time of building folded peptides
+
+    :param lengths: the chain lengths to try
+    :type lengths: sequence of int
+    :param families: the residue families, keys of :data:`FAMILIES`
+    :type families: sequence of str
+    :param engines: the build engines
+    :type engines: sequence of str
+    :param fuse_maxlength: the longest chain to build with the quadratic 'fuse' engine
+    :type fuse_maxlength: int
+    :return: the results
+    :rtype: dict mapping names to dicts with keys 'time' and 'natoms'
+    """
+    results = {}
+    objname = '_bench_build'
+    for family in families:
+        for engine in engines:
+            for length in lengths:
+                if engine == 'fuse' and length > fuse_maxlength:
+                    continue
+                elapsed = best_of(betafab2, 3, 0.2, objname, *family_sequence(family, length), engine=engine)
+                name = 'build/{}/{}/{}'.format(engine, family, length)
+                results[name] = {'time': elapsed, 'natoms': cmd.count_atoms('model ' + objname)}
+                cmd.delete(objname)
+                logger.debug('{}: {:.3f} s'.format(name, elapsed))
+    return results
+
+
+def benchmark_fold(lengths: Sequence[int] = LENGTHS, families: Sequence[str] = tuple(FAMILIES)) -> Dict[str, Dict]:
+    """Measure the time of folding unfolded peptides, then packing their side chains
+
+    :param lengths: the chain lengths to try
+    :type lengths: sequence of int
+    :param families: the residue families, keys of :data:`FAMILIES`
+    :type families: sequence of str
+    :return: the results
+    :rtype: dict mapping names to dicts with keys 'time' and 'natoms'
+    """
+    results = {}
+    objname = '_bench_fold'
+    for family in families:
+        for length in lengths:
+            betafab2(objname, *family_sequence(family, length, folded=False), engine='nerf')
+            natoms = cmd.count_atoms('model ' + objname)
+            selection = 'model ' + objname
+            for task, function, args, kwargs in [
+                ('fold', fold_bp, (FAMILIES[family][3], selection), {'pack': False}),
+                ('pack', pack_selection, (selection,), {}),
+            ]:
+                name = '{}/{}/{}'.format(task, family, length)
+                results[name] = {'time': timed(function, *args, **kwargs)[0], 'natoms': natoms}
+                logger.debug('{}: {:.3f} s'.format(name, results[name]['time']))
+            cmd.delete(objname)
+    return results
+
+
+def replicated_system(objname: str, natoms: int, gap: float = 5.0) -> int:
+    """Create a system of about the requested size from copies of a capped 14-helix
+
+    The copies are placed on a rectangular grid, each one in a separate chain, and the residues are numbered
+    consecutively.
+
+    :param objname: the name of the new PyMOL object
+    :type objname: str
+    :param natoms: the desired number of atoms
+    :type natoms: int
+    :param gap: the distance between the bounding boxes of neighbouring copies, in Angstroms
+    :type gap: float
+    :return: the number of atoms in the system
+    :rtype: int
+    """
+    unitname = objname + '_unit'
+    betafab2(unitname, *family_sequence('beta3', 50), engine='nerf')
+    unit = cmd.get_model('model ' + unitname)
+    cmd.delete(unitname)
+    unitcoords = np.array([a.coord for a in unit.atom])
+    unitcoords -= unitcoords.mean(axis=0)
+    spacing = unitcoords.max(axis=0) - unitcoords.min(axis=0) + gap
+    nresidues = max(a.resi_number for a in unit.atom)
+    ncopies = max(1, int(round(natoms / len(unit.atom))))
+    side = int(np.ceil(ncopies ** (1 / 3)))
+    model = chempy.models.Indexed()
+    for icopy in range(ncopies):
+        offset = len(model.atom)
+        shift = spacing * np.array([icopy % side, (icopy // side) % side, icopy // side ** 2])
+        for atom, xyz in zip(unit.atom, unitcoords + shift):
+            atom = copy.copy(atom)
+            atom.coord = [float(x) for x in xyz]
+            atom.resi_number += icopy * nresidues
+            atom.resi = str(atom.resi_number)
+            atom.chain = chr(ord('A') + icopy % 26)
+            atom.segi = 'P{:03d}'.format(icopy)
+            model.add_atom(atom)
+        for bond in unit.bond:
+            newbond = chempy.Bond()
+            newbond.index = [bond.index[0] + offset, bond.index[1] + offset]
+            newbond.order = bond.order
+            model.add_bond(newbond)
+    cmd.delete(objname)
+    cmd.load_model(model, objname)
+    return len(model.atom)
+
+
+def benchmark_io(sizes: Sequence[int] = SIZES, maxatoms: Optional[Dict[str, int]] = None) -> Dict[str, Dict]:
+    """Measure the time of the writers and the analysers on systems of different sizes
+
+    :param sizes: the approximate numbers of atoms in the systems
+    :type sizes: sequence of int
+    :param maxatoms: the largest system each entry point is run on (default: :data:`MAXATOMS`)
+    :type maxatoms: dict mapping function names to int
+    :return: the results. Skipped runs have None for 'time'.
+    :rtype: dict mapping names to dicts with keys 'time' and 'natoms'
+    """
+    if maxatoms is None:
+        maxatoms = MAXATOMS
+    results = {}
+    objname = '_bench_io'
+    selection = 'model ' + objname
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tasks = [
+            (save_gro, (os.path.join(tmpdir, 'system.gro'), selection)),
+            (save_g96, (os.path.join(tmpdir, 'system.g96'), selection)),
+            (save_crd, (os.path.join(tmpdir, 'system.crd'), selection)),
+            (restrain_hbonds_gmx, (selection, os.path.join(tmpdir, 'hbonds.itp'))),
+            (restrain_beta_backbone_dihedrals, (os.path.join(tmpdir, 'dihedrals.itp'), selection)),
+            (lambda sel: find_clashes(PeptideArrays.fromSelection(sel)), (selection,)),
+        ]
+        for size in sizes:
+            natoms = replicated_system(objname, size)
+            for (function, args), taskname in zip(tasks, [
+                    'save_gro', 'save_g96', 'save_crd', 'restrain_hbonds_gmx', 'restrain_beta_backbone_dihedrals',
+                    'find_clashes']):
+                name = 'io/{}/{}'.format(taskname, size)
+                if natoms > maxatoms.get(taskname, natoms):
+                    results[name] = {'time': None, 'natoms': natoms}
+                    logger.debug('{}: skipped'.format(name))
+                    continue
+                results[name] = {'time': best_of(function, 3, 0.2, *args), 'natoms': natoms}
+                logger.debug('{}: {:.3f} s'.format(name, results[name]['time']))
+            cmd.delete(objname)
+    return results
+
+
+# measures the import time of a module in a fresh interpreter, after PyMOL has been imported
+IMPORT_SCRIPT = """
+import time
+from pymol import cmd
+t0 = time.perf_counter()
+import {}
+print(time.perf_counter() - t0)
+"""
+
+
+def benchmark_import(repeat: int = 3) -> Dict[str, Dict]:
+    """Measure the time of importing the plugin and the module of the betafab2 command
+
+    Each import is done in a new headless Python interpreter, the fastest of `repeat` trials is taken.
+
+    :param repeat: the number of trials
+    :type repeat: int
+    :return: the results
+    :rtype: dict mapping names to dicts with keys 'time' and 'natoms' (None)
+    """
+    package = __package__.split('.')[0]
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(sys.modules[package].__file__))] +
+        ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    results = {}
+    for module in [package, package + '.betafab2']:
+        times = []
+        for i in range(repeat):
+            output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module)], env=env, check=True,
+                                    stdout=subprocess.PIPE, universal_newlines=True).stdout
+            times.append(float(output.split()[-1]))
+        name = 'import/{}'.format(module.replace(package, 'pmlbeta', 1))
+        results[name] = {'time': min(times), 'natoms': None}
+        logger.debug('{}: {:.3f} s'.format(name, results[name]['time']))
+    return results
+
+
+def environment() -> Dict[str, str]:
+    """Describe the environment the benchmarks run in
+
+    :return: the versions of the interpreter and of the main dependencies, the platform and the date
+    :rtype: dict
+    """
+    return {
+        'python': platform.python_version(),
+        'pymol': cmd.get_version()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def run_suite(benchmarks: Sequence[str] = ('build', 'fold', 'io', 'import'), quick: bool = False,
+              limits: bool = True) -> Dict:
+    """Run the benchmark suite
+
+    :param benchmarks: the benchmarks to run: 'build', 'fold', 'io' and/or 'import'
+    :type benchmarks: sequence of str
+    :param quick: only run the smallest cases (chains of up to 20 residues, systems of 10^3 atoms)
+    :type quick: bool
+    :param limits: respect :data:`MAXATOMS` in the "io" benchmark
+    :type limits: bool
+    :return: the environment (see :func:`environment`) and the results
+    :rtype: dict with keys 'environment' and 'results'
+    """
+    lengths = [l for l in LENGTHS if l <= 20] if quick else LENGTHS
+    sizes = SIZES[:1] if quick else SIZES
+    results = {}
+    if 'build' in benchmarks:
+        results.update(benchmark_build(lengths))
+    if 'fold' in benchmarks:
+        results.update(benchmark_fold(lengths))
+    if 'io' in benchmarks:
+        results.update(benchmark_io(sizes, MAXATOMS if limits else {}))
+    if 'import' in benchmarks:
+        results.update(benchmark_import())
+    return {'environment': environment(), 'results': results}
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float = 0.25, resolution: float = 0.02
+            ) -> List[Tuple[str, Optional[float], Optional[float], str]]:
+    """Compare the results of the suite to a baseline
+
+    :param results: the current results, as in the 'results' field of the output of :func:`run_suite`
+    :type results: dict
+    :param baseline: the baseline results, in the same format
+    :type baseline: dict
+    :param tolerance: relative slowdown still accepted
+    :type tolerance: float
+    :param resolution: differences smaller than this (in seconds) are not significant
+    :type resolution: float
+    :return: name, baseline time, current time and verdict ('ok', 'slower', 'faster', 'new', 'missing' or
+        'skipped') for each benchmark
+    :rtype: list of tuples
+    """
+    comparison = []
+    for name in sorted(set(results) | set(baseline)):
+        old = baseline[name]['time'] if name in baseline else None
+        new = results[name]['time'] if name in results else None
+        if name not in baseline:
+            verdict = 'new'
+        elif name not in results:
+            verdict = 'missing'
+        elif old is None or new is None:
+            verdict = 'skipped'
+        elif abs(new - old) < resolution:
+            verdict = 'ok'
+        elif new > old * (1 + tolerance):
+            verdict = 'slower'
+        elif new < old / (1 + tolerance):
+            verdict = 'faster'
+        else:
+            verdict = 'ok'
+        comparison.append((name, old, new, verdict))
+    return comparison
+
+
+def _formatTime(t: Optional[float]) -> str:
+    return '{:10.3f}'.format(t) if t is not None else '{:>10s}'.format('-')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(prog='python -m pmlbeta.benchmarks.suite', description=__doc__.split('\n')[0])
+    p.add_argument('-o', '--output', help='write the results to this JSON file')
+    p.add_argument('-b', '--baseline', default=os.path.join(os.path.dirname(__file__), 'baseline.json'),
+                   help='compare with this JSON file, if it exists (default: baseline.json next to this module)')
+    p.add_argument('--update-baseline', action='store_true', help='store the results as the new baseline')
+    p.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown still accepted (default: 0.25)')
+    p.add_argument('--resolution', type=float, default=0.02,
+                   help='smallest significant difference in seconds (default: 0.02)')
+    p.add_argument('--only', nargs='+', choices=['build', 'fold', 'io', 'import'],
+                   default=['build', 'fold', 'io', 'import'],
+                   help='run only these benchmarks')
+    p.add_argument('--quick', action='store_true', help='run only the smallest cases')
+    p.add_argument('--no-limits', action='store_true', help='run the quadratic entry points on all system sizes')
+    p.add_argument('-v', '--verbose', action='store_true', help='print each result as it is measured')
+    args = p.parse_args(argv)
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+        logging.basicConfig(level=logging.DEBUG)
+
+    suite = run_suite(args.only, args.quick, not args.no_limits)
+    if args.output is not None:
+        with open(args.output, 'wt') as f:
+            json.dump(suite, f, indent=2)
+    regressions = 0
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, 'rt') as f:
+            baseline = json.load(f)
+        print('{:<44s} {:>10s} {:>10s}  {}'.format('benchmark', 'baseline', 'time (s)', 'verdict'))
+        for name, old, new, verdict in compare(suite['results'], baseline['results'], args.tolerance,
+                                                 args.resolution):
+            if verdict == 'missing':
+                continue
+            print('{:<44s} {} {}  {}'.format(name, _formatTime(old), _formatTime(new), verdict))
+            regressions += verdict == 'slower'
+        print('{} regression(s) against the baseline from {}'.format(regressions, baseline['environment']['date']))
+    else:
+        print('{:<44s} {:>8s} {:>10s}'.format('benchmark', 'atoms', 'time (s)'))
+        for name, result in suite['results'].items():
+            print('{:<44s} {:>8s} {}'.format(name, str(result['natoms'] or '-'), _formatTime(result['time'])))
+    if args.update_baseline:
+        with open(args.baseline, 'wt') as f:
+            json.dump(suite, f, indent=2)
+        print('Baseline written to {}'.format(args.baseline))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,24 +4,83 @@ import warnings
 try:
     from pymol import cmd
     import chempy.models
-    import pymol.plugins
 except ImportError:
     warnings.warn(
         'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
     cmd = None
 import re
-import os
-from .utils import tempObjectName, fetchModel, set_dihedral
-from typing import Optional, List, Dict, Union
+from .utils import tempObjectName, fetchModel, set_dihedrals, cmdBatch
+from .nerf import ResidueTemplate, assemble
+from .geometry import kabsch, invert_stereocentres, stereo_descriptors
+from .templatecache import TemplateCache
+from .topology import Topology
+from .residuelibrary import ResidueLibrary
+from .sequencetrie import SequenceTrie
+from .clashes import report_clashes
+from .rotamers import pack_selection
+from .profiling import profiled, building_residue
+from .fragments import FragmentLibrary, resource_directory
+from typing import Optional, Iterable, List, Dict, Tuple, Union, Sequence
 import logging
 from .secstructdb import SecondaryStructureDB
-import itertools
-import random
+import copy
+
+import numpy as np
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+# the grammar of a single residue in a sequence, see BetaPeptide.parseBetaPeptideSequence()
+_FLOAT_REGEX = r"""([+-]\s*)?  # optional sign and whitespace
+                (  # start of the mantissa
+                (\d+(\.\d*)?)   # one option: some digits, then optionally some decimals
+                | or
+                (\.\d+)  # second option: only the decimals, led in by a decimal point
+                ) # end of the mantissa
+                ([eE][+-]?\d+)? # optionally, an exponent
+                """
+
+RESIDUE_GRAMMAR = re.compile(r"""^( # begin
+                      (?P<ace>ACE) # acetyl group on the N-terminus
+                      |
+                      (?P<but>BUT) # butyl group on the N-terminus
+                      |
+                      (?P<nme>NME) # N-methylamide group on the C-terminus
+                      |
+                      \(2(?P<achcstereo2>[RS])3(?P<achcstereo3>[RS])\)ACHC  # 2-aminocyclohexanecarboxylic acid
+                      | 
+                      \(2(?P<acpcstereo2>[RS])3(?P<acpcstereo3>[RS])\)ACPC  # 2-aminocyclopentanecarboxylic acid
+                      | 
+                      (  # begin beta23-amino acid regex
+                      \(2(?P<stereo2>[RS])3(?P<stereo3>[RS])\)  # chirality for beta2,3
+                      B23h
+                      \(2(?P<sc2>[A-Z]{{1,2}})3(?P<sc3>[A-Z]{{1,2}})\)  # sidechain designation
+                      ) # end beta23-amino acid regex
+                      | # or
+                      ( # begin monosubstituted  beta-amino acid regex
+                      \((?P<monostereo>[RS])\) # chirality for mono-substituted beta-amino acids
+                      B(?P<monokind>[23])h
+                      (?P<monosc>[A-Z]{{1,2}}) # sidechain designation
+                      ) # end monostubstituted beta-amino acid regex
+                      | # or
+                      (?P<bare>BA) # bare beta-amino acid (homo-glycine) 
+                      | # or
+                      ( # begin alpha-amino acid regex
+                      \((?P<alphastereo>[RSLD])\) # chirality for alpha-amino acids
+                      A
+                      (?P<alphasc>[A-Z]{{1,2}}) # sidechain designation
+                      ))
+                      \s* # allow for whitespace between the amino-acid designation and the secondary structure info
+                      ( # begin optional torsion angle declaration
+                      (\[\s*(?P<phi>{0})\s+(?P<theta>{0})(\s+(?P<psi>{0}))?\s*\]) # two or three torsion angles in square brackets 
+                      | # or
+                      (\{{\s*(?P<ssname>[-a-zA-Z0-9_+ ]+)\s*\}}) # name of a secondary structure database entry in curly braces 
+                      )? # end optional torsion angle declaration 
+                      $ # end alpha-amino acid regex
+                      """.format(_FLOAT_REGEX), re.X)
+
+
 class BetaPeptideException(Exception):
     pass
 
@@ -30,6 +89,27 @@ class BetaPeptideConsistencyError(BetaPeptideException):
     pass
 
 
+class SequenceParseError(ValueError):
+    """A sequence cannot be parsed
+
+    The message is the first argument, like for other ValueErrors. The location of the error is given by the attributes
+    `position` (the offset of the offending residue in the sequence string) and `index` (the number of the sequence
+    in :func:`parse_many`, None otherwise).
+    """
+
+    def __init__(self, message: str, residue: str, position: int, index: Optional[int] = None):
+        super().__init__(message)
+        self.residue = residue
+        self.position = position
+        self.index = index
+
+    def __str__(self) -> str:
+        location = 'column {}'.format(self.position + 1)
+        if self.index is not None:
+            location = 'sequence {}, {}'.format(self.index + 1, location)
+        return '{} ({})'.format(self.args[0], location)
+
+
 class BetaPeptide:
     """A class for constructing alpha/beta peptides.
     """
@@ -65,6 +145,13 @@ class BetaPeptide:
         'W': 'trp',
         'Y': 'tyr',
     }
+    # finished single residues, keyed by :meth:`residueKey`
+    templateCache = TemplateCache(256)
+    # heavy atom names with the side chain tags, see :meth:`renameAtomsInResidue`
+    _HEAVYATOMNAME = re.compile(
+        '^(?P<symbol>[BCNOFPS])(?P<greek>[{}])(?P<index>[123456789])?_sc(?P<sidechain>[023])$'.format(GREEKLETTERS))
+    # the methyl hydrogens of the ACE and NME fragments of PyMOL, renamed
+    _METHYLHYDROGENS = {'1HH3': 'HH31', '2HH3': 'HH32', '3HH3': 'HH33'}
 
     def __init__(self, modelname: Optional[str], isbeta: bool = True, alphasidechain: str = 'G', alphastereo: str = 'S',
                  betasidechain: str = 'G', betastereo: str = 'S'):
@@ -84,6 +171,7 @@ class BetaPeptide:
         :type betastereo: str, "R" or "S"
         """
         self._modelname = modelname
+        self._topology = None
         if modelname is None:
             return
         if isbeta:
@@ -91,6 +179,15 @@ class BetaPeptide:
         else:
             self.initializeAlphaResidue(alphasidechain, alphastereo)
 
+    @staticmethod
+    def resourceDirectory() -> str:
+        """Get the directory containing the fragment files shipped with this plugin
+
+        :return: the path of the resource directory
+        :rtype: str
+        """
+        return resource_directory()
+
     def copy(self, newname: str) -> "BetaPeptide":
         """Make a deep copy of ourselves
         
@@ -106,6 +203,24 @@ class BetaPeptide:
         obj._modelname = newname
         return obj
 
+    def topology(self) -> Topology:
+        """Get the topology index of this peptide
+
+        The index is built on first use and rebuilt if the model has changed: either by the methods of this class,
+        which call :meth:`invalidateTopology`, or outside of it, which is detected by a change in the number of atoms.
+
+        :return: the topology index
+        :rtype: Topology
+        """
+        if (self._topology is None) or (self._topology.name != 'model {}'.format(self._modelname)) or \
+                (len(self._topology) != cmd.count_atoms('model {}'.format(self._modelname))):
+            self._topology = Topology.fromSelection('model {}'.format(self._modelname))
+        return self._topology
+
+    def invalidateTopology(self):
+        """Discard the topology index after the model has been changed"""
+        self._topology = None
+
     def initializeAlphaResidue(self, sidechain: str = 'G', stereo: str = 'S'):
         """Initialize this residue to be an alpha-amino acid
 
@@ -117,19 +232,15 @@ class BetaPeptide:
         :rtype: NoneType
         """
         cmd.delete('model {}'.format(self._modelname))
-        try:
-            cmd.fragment(self.SIDECHAINS[sidechain], self._modelname)
-        except pymol.CmdException as exc:
-            # could not load fragment: this might be a special one. Try to load it from our resource folder
-            resourcedir = os.path.join(os.path.split(pymol.plugins.plugins['pmlbeta'].filename)[0], 'resource')
-            cmd.load(os.path.join(resourcedir, '{}.pkl'.format(self.SIDECHAINS[sidechain])), self._modelname)
-        if sidechain == 'CM':
-            cmd.remove('model {} and name HG'.format(self._modelname))
-            cmd.alter('model {} and name SG'.format(self._modelname), 'formal_charge=-1')
-            cmd.alter('model {} and name SG'.format(self._modelname), 'partial_charge=-1')
-            cmd.alter('model {}'.format(self._modelname), 'resn="CYM"')
-        cmd.alter('model {}'.format(self._modelname), 'resv=1')
-        cmd.alter('model {}'.format(self._modelname), 'chain="A"')
+        self.loadSideChainFragment(self.SIDECHAINS[sidechain], self._modelname)
+        with cmdBatch() as bcmd:
+            if sidechain == 'CM':
+                bcmd.remove('model {} and name HG'.format(self._modelname))
+                bcmd.alter('model {} and name SG'.format(self._modelname), 'formal_charge=-1')
+                bcmd.alter('model {} and name SG'.format(self._modelname), 'partial_charge=-1')
+                bcmd.alter('model {}'.format(self._modelname), 'resn="CYM"')
+            bcmd.alter('model {}'.format(self._modelname), 'resv=1')
+            bcmd.alter('model {}'.format(self._modelname), 'chain="A"')
 
         # alpha-residues are by default all have L chirality. Now let's fix the chirality. The case of cisteine is
         # complicated...
@@ -140,11 +251,14 @@ class BetaPeptide:
                                                      'CM']) or  # for most amino-acids, L is S, thus for R, we have to flip
                 (stereo == 'S' and sidechain in ['C', 'CM'])  # for Cys, L is R, thus for S, we have to flip
         ):
-            cmd.edit('model {} and resi {} and name CA'.format(self._modelname, 1),
-                     'model {} and resi {} and name HA'.format(self._modelname, 1),
-                     'model {} and resi {} and name C'.format(self._modelname, 1))
-            cmd.invert()
-            cmd.unpick()
+            self.invertStereocentres([('CA', 'HA', 'C')])
+        if sidechain != 'G' and stereo in ['R', 'S']:
+            # verify the result. Only the CH2-S side chain of cysteine outranks the carbonyl carbon.
+            ranking = ('N', 'CB', 'C', 'HA') if sidechain in ['C', 'CM'] else ('N', 'C', 'CB', 'HA')
+            actual = self.stereoDescriptors([('CA',) + ranking])[0]
+            if actual != stereo:
+                raise BetaPeptideConsistencyError(
+                    'Alpha carbon has {} configuration instead of the requested {}'.format(actual, stereo))
 
         # now rename the atoms
         with fetchModel(self._modelname) as model:
@@ -173,54 +287,52 @@ class BetaPeptide:
 
         :raises BetaPeptideConsistencyError: when one of the above tests fails
         """
-        with fetchModel(self._modelname) as model:
-            minresidue = min([a.resi_number for a in model.atom])
-            maxresidue = max([a.resi_number for a in model.atom])
+        topology = self.topology()
+        minresidue = min(topology.residues)
+        maxresidue = max(topology.residues)
 
         if minresidue != 1:
             raise BetaPeptideConsistencyError(
                 'Lowest residue number is {} instead of the expected 1.'.format(minresidue))
 
+        amidenitrogens = topology.atoms(None, 'N')
+        amidecarbons = topology.atoms(None, 'C')
         for i in range(1, maxresidue + 1):
-            resname = cmd.get_model('model {} and resi {}'.format(self._modelname, i)).atom[0].resn
+            try:
+                resname = topology.resnames[i]
+            except KeyError:
+                raise BetaPeptideConsistencyError('Residue {} has no atoms.'.format(i))
             logger.debug('Residue {}: {}'.format(i, resname))
             if (i > 1) and resname not in ['PRO', 'DPRO']:  # not the N-terminal and not proline
                 # count amide hydrogens on the nitrogen: must be one on a non-N-terminal residue
-                hcount = cmd.count_atoms('model {} and resi {} and (neighbor name N ) and (name H+HN)'.format(
-                    self._modelname, i))
+                hcount = len(topology.bondedTo(amidenitrogens) & topology.atoms(i, 'H+HN'))
                 if hcount != 1:
                     raise BetaPeptideConsistencyError('Amide N in residue {} has {} hydrogens.'.format(i, hcount))
                 # count amide carbons bonded to the nitrogen: must be one on a non-N-terminal residue. This also ensures
                 # continuity of residue numbering (partly)
-                ccount = cmd.count_atoms('(neighbor (model {} and resi {} and name N)) and (resi {} and name C)'.format(
-                    self._modelname, i, i - 1))
+                ccount = len(topology.bondedTo(topology.atoms(i, 'N')) & topology.atoms(i - 1, 'C'))
                 if ccount != 1:
                     raise BetaPeptideConsistencyError(
                         'Amide N in residue {} has {} amide carbons from the previous residue.'.format(i, ccount))
             if i < maxresidue:
                 # not the C-terminal 
                 # count amide oxygens on the carbon: must be one on a non-C-terminal residue
-                ocount = cmd.count_atoms('model {} and resi {} and (neighbor name C) and name O'.format(
-                    self._modelname, i))
+                ocount = len(topology.bondedTo(amidecarbons) & topology.atoms(i, 'O'))
                 if ocount != 1:
                     raise BetaPeptideConsistencyError('Amide C in residue {} has {} oxygens.'.format(i, ocount))
                 # count amide nitrogens bonded to the carbon: must be one on a non-C-terminal residue. Together with 
                 # the previous similar check, this ensures the continuity of residue numbering.
-                ncount = cmd.count_atoms(
-                    '(neighbor (model {} and resi {} and name C)) and (resi {} and name N)'.format(
-                        self._modelname, i, i + 1))
+                ncount = len(topology.bondedTo(topology.atoms(i, 'C')) & topology.atoms(i + 1, 'N'))
                 if ncount != 1:
                     raise BetaPeptideConsistencyError(
                         'Amide C in residue {} has {} amide nitrogens from the next residue'.format(i, ncount)
                     )
             # all residues, including terminals
-            cbcount = cmd.count_atoms('model {} and resi {} and (neighbor name N) and (name CB+CB1+CA)'.format(
-                self._modelname, i))
+            cbcount = len(topology.bondedTo(amidenitrogens) & topology.atoms(i, 'CB+CB1+CA'))
             if (cbcount != 1) and (resname != 'NME') and (resname != 'ACE') and (resname != 'BUT'):
                 raise BetaPeptideConsistencyError('Amide N in residue {} has {} CA or CB neighbours.'.format(
                     i, cbcount))
-            cacount = cmd.count_atoms('model {} and resi {} and (neighbor name C) and (name CA)'.format(
-                self._modelname, i))
+            cacount = len(topology.bondedTo(amidecarbons) & topology.atoms(i, 'CA'))
             if (cacount != 1) and (resname != 'ACE') and (resname != 'NME'):
                 raise BetaPeptideConsistencyError('Amide C in residue {} has {} CA neighbours.'.format(i, cacount))
 
@@ -231,8 +343,7 @@ class BetaPeptide:
         :return: the highest residue number
         :rtype: int
         """
-        with fetchModel(self._modelname) as model:
-            return max([a.resi_number for a in model.atom])
+        return max(self.topology().residues)
 
     def isNProtected(self) -> bool:
         """Check if the N-terminal is protected
@@ -240,8 +351,8 @@ class BetaPeptide:
         :return: True if the N-terminal is protected 
         :rtype: bool
         """
-        return cmd.count_atoms(
-            '(neighbor (model {} and name N and resi 1)) and not name CB+CB1+CA+H+HN+CH3'.format(self._modelname)) > 0
+        topology = self.topology()
+        return len(topology.bondedTo(topology.atoms(1, 'N')) - topology.atoms(None, 'CB+CB1+CA+H+HN+CH3')) > 0
 
     def isCProtected(self) -> bool:
         """Check if the C-terminal is protected
@@ -249,10 +360,8 @@ class BetaPeptide:
         :return: True if the C-terminal is protected
         :rtype: bool
         """
-        maxresidue = self.maxResidue
-        return cmd.count_atoms(
-            '(neighbor (model {} and name C and resi {})) and (not name O+CA+CH3)'.format(self._modelname,
-                                                                                          maxresidue)) > 0
+        topology = self.topology()
+        return len(topology.bondedTo(topology.atoms(self.maxResidue, 'C')) - topology.atoms(None, 'O+CA+CH3')) > 0
 
     def startsWithProline(self) -> bool:
         """Check if the N-terminus is a proline residue
@@ -260,14 +369,13 @@ class BetaPeptide:
         :return: True if the N-terminus is an alpha-proline
         :rtype: bool
         """
-        with fetchModel(self._modelname) as m:
-            minresi = min({a.resi_number for a in m.atom})
-            firstresidue = {a.resn for a in m.atom if a.resi_number == minresi}
-            if len(firstresidue) > 1:
-                raise BetaPeptideConsistencyError('Atoms in the same residue must have the same residue names.')
-            else:
-                assert len(firstresidue) == 1  # len()==0 cannot happen.
-                return firstresidue.pop() in ['PRO', 'DPRO']
+        topology = self.topology()
+        firstresidue = topology.allresnames[min(topology.residues)]
+        if len(firstresidue) > 1:
+            raise BetaPeptideConsistencyError('Atoms in the same residue must have the same residue names.')
+        else:
+            assert len(firstresidue) == 1  # len()==0 cannot happen.
+            return next(iter(firstresidue)) in ['PRO', 'DPRO']
 
     def __iadd__(self, right: "BetaPeptide") -> "BetaPeptide":
         """Append another peptide to our C-terminal
@@ -298,6 +406,7 @@ class BetaPeptide:
             with fetchModel(righttemp) as model:
                 for a in model.atom:
                     a.resi_number += maxleft
+            right.invalidateTopology()
             # mould is a peptide bond, with the following layout:
             #
             #   O        Cnext
@@ -323,13 +432,14 @@ class BetaPeptide:
             logger.debug('Mould name: {}'.format(mouldname))
             logger.debug('Lefttemp: {}'.format(lefttemp))
             logger.debug('Righttemp: {}'.format(righttemp))
-            self.safe_pairfit('model {}'.format(lefttemp),
-                              'model {}'.format(mouldname),
-                              maxleft,
-                              1,
-                              ['CA+CH3', 'C', 'O'],
-                              ['Cprev', 'C', 'O'],
-                              0.1)
+            rms = self.safe_pairfit('model {}'.format(lefttemp),
+                                    'model {}'.format(mouldname),
+                                    maxleft,
+                                    1,
+                                    ['CA+CH3', 'C', 'O'],
+                                    ['Cprev', 'C', 'O'],
+                                    0.1)
+            logger.debug('Left side fitted with RMS {:.4f}'.format(rms))
             # find the neighbour of N
             cbname = cmd.get_model(
                 '(neighbor (model {} and resi {} and name N)) and (symbol C) and (not name C)'.format(righttemp,
@@ -340,13 +450,14 @@ class BetaPeptide:
             #   H of the first residue of "right" to H of mould
             #   CB, CB1 or CA or CH3 of the first residue of "right" to Cnext of mould
             logger.debug('Fitting right side')
-            self.safe_pairfit('model {}'.format(righttemp),
-                              'model {}'.format(mouldname),
-                              1 + maxleft,
-                              1,
-                              ['N', 'H' if not right.startsWithProline() else 'CD', cbname],
-                              ['N', 'H', 'Cnext'],
-                              0.1 if not right.startsWithProline() else 0.3)
+            rms = self.safe_pairfit('model {}'.format(righttemp),
+                                    'model {}'.format(mouldname),
+                                    1 + maxleft,
+                                    1,
+                                    ['N', 'H' if not right.startsWithProline() else 'CD', cbname],
+                                    ['N', 'H', 'Cnext'],
+                                    0.1 if not right.startsWithProline() else 0.3)
+            logger.debug('Right side fitted with RMS {:.4f}'.format(rms))
             cmd.fuse("model {} and resi {} and name C".format(lefttemp, maxleft),
                      "model {} and resi {} and name N".format(righttemp, 1 + maxleft),
                      mode=3)
@@ -357,12 +468,12 @@ class BetaPeptide:
 
     @staticmethod
     def safe_pairfit(model1: str, model2: str, resi1: int, resi2: int, atoms1: List[str], atoms2: List[str],
-                     rmstolerance: float = 0.1, ntries: int = 10):
-        """Align model1 and model2 by the given atoms. Try to find an optimal tolerance.
+                     rmstolerance: float = 0.1, ntries: Optional[int] = None) -> float:
+        """Align model1 and model2 by the given atoms.
 
-        The problem with the original pair_fit of PyMOL was that sometimes it found a local minimum, not
-        the desired one. If it converged into a local minimum and moved out by a random rotation, it
-        can find the global minimum.
+        The optimal rigid-body transformation is found in closed form (Kabsch algorithm, see
+        :func:`pmlbeta.geometry.kabsch`) and applied to the coordinates of model1 in one step. Unlike the iterative
+        pair_fit of PyMOL, this cannot get stuck in a local minimum, thus no random restarts are needed.
 
         :param model1: the name of the model to be moved
         :type model1: str
@@ -376,25 +487,31 @@ class BetaPeptide:
         :type atoms1: list of str
         :param atoms2: name of atoms in the stationary model
         :type atoms2: list of str
-        :param rmstolerance: try to fit the models until the RMS is less than this
+        :param rmstolerance: raise an exception if the RMS after the fit exceeds this
         :type rmstolerance: float
-        :param ntries: the number of trials
+        :param ntries: ignored, kept for backwards compatibility
         :type ntries: int
         :return: the final rms
         :rtype: float
+        :raises RuntimeError: if the RMS after the fit is not less than `rmstolerance`
         """
-        selections1 = ['({}) and resi {} and name {}'.format(model1, resi1, name) for name in atoms1]
-        selections2 = ['({}) and resi {} and name {}'.format(model2, resi2, name) for name in atoms2]
-        selections = list(itertools.chain.from_iterable(zip(selections1, selections2)))
-        for i in range(ntries):
-            rms = cmd.pair_fit(*selections, quiet=True)
-            if rms < rmstolerance:
-                return rms
-            else:
-                # it may not have converged: do a random rotation and try to fit
-                cmd.rotate('xyz'[random.randint(0, 2)], random.randrange(0, 360), model1)
-        else:
+        mobile = []
+        target = []
+        for name1, name2 in zip(atoms1, atoms2):
+            coords1 = cmd.get_coords('({}) and resi {} and name {}'.format(model1, resi1, name1))
+            coords2 = cmd.get_coords('({}) and resi {} and name {}'.format(model2, resi2, name2))
+            if coords1 is None or coords2 is None or len(coords1) != 1 or len(coords2) != 1:
+                raise BetaPeptideConsistencyError(
+                    'Fitting needs exactly one atom in {} and resi {} and name {} and in {} and resi {} and '
+                    'name {}'.format(model1, resi1, name1, model2, resi2, name2))
+            mobile.append(coords1[0])
+            target.append(coords2[0])
+        rot, trans, rms = kabsch(np.array(mobile), np.array(target))
+        if rms >= rmstolerance:
             raise RuntimeError('Could not fit with RMS less than {}. RMS is: {}'.format(rmstolerance, rms))
+        cmd.load_coords(cmd.get_coords(model1) @ rot.T + trans, model1)
+        logger.debug('Fitted {} on {} with RMS {:.4f}'.format(model1, model2, rms))
+        return rms
 
     @staticmethod
     def betaResidueName(sidechain2: Optional[str] = None, sidechain3: Optional[str] = None) -> str:
@@ -460,27 +577,19 @@ class BetaPeptide:
 
         cmd.alter('model {} and resi {}'.format(self._modelname, 1), 'chain="A"')
         # Adjustment of the chirality is needed in the following special cases:
+        inversions = []
         if sidechain2 in ['C', 'CM', 'S', 'T']:
             # switch chirality of the alpha carbon
-            cmd.edit('model {} and resi {} and name CA'.format(self._modelname, 1),
-                     'model {} and resi {} and name CB+CB1'.format(self._modelname, 1),
-                     'model {} and resi {} and name C'.format(self._modelname, 1))
-            cmd.invert()
-            cmd.unpick()
+            inversions.append(('CA', 'CB+CB1', 'C'))
         if sidechain3 in ['C', 'CM', 'S', 'T']:
             # switch chirality of the beta carbon
-            cmd.edit('model {} and resi {} and name CB+CB1'.format(self._modelname, 1),
-                     'model {} and resi {} and name CA'.format(self._modelname, 1),
-                     'model {} and resi {} and name N'.format(self._modelname, 1))
-            cmd.invert()
-            cmd.unpick()
+            inversions.append(('CB+CB1', 'CA', 'N'))
         if sidechain3 in ['M', 'D', 'DH'] and sidechain2 in ['G']:
             # switch chirality of the beta carbon
-            cmd.edit('model {} and resi {} and name CB+CB1'.format(self._modelname, 1),
-                     'model {} and resi {} and name CA'.format(self._modelname, 1),
-                     'model {} and resi {} and name N'.format(self._modelname, 1))
-            cmd.invert()
-            cmd.unpick()
+            inversions.append(('CB+CB1', 'CA', 'N'))
+        if inversions:
+            self.invertStereocentres(inversions)
+        self.invalidateTopology()
 
     def attachBetaSideChain(self, residue: int, site: int, stereo: str, sidechain: str):
         """Attach a side-chain to the beta-backbone. The atoms in the side-chain (including the attach site and its other
@@ -501,18 +610,14 @@ class BetaPeptide:
         """
         with tempObjectName() as fragmentname:
             # load the appropriate amino-acid fragment
-            try:
-                cmd.fragment(self.SIDECHAINS[sidechain], fragmentname)
-            except pymol.CmdException as exc:
-                # could not load fragment: this might be a special one. Try to load it from our resource folder
-                resourcedir = os.path.join(os.path.split(pymol.plugins.plugins['pmlbeta'].filename)[0], 'resource')
-                cmd.load(os.path.join(resourcedir, '{}.pkl'.format(self.SIDECHAINS[sidechain])), fragmentname)
-            # keep only the side-chain and Calpha
-            cmd.remove('model {} and (name C+O+N+H+HA)'.format(fragmentname))
-            # hack for residue 'CM'
-            if sidechain == 'CM':
-                cmd.remove('model {} and name HG'.format(fragmentname))
-                cmd.alter('model {} and name SG'.format(fragmentname), 'formal_charge=-1')
+            self.loadSideChainFragment(self.SIDECHAINS[sidechain], fragmentname)
+            with cmdBatch() as bcmd:
+                # keep only the side-chain and Calpha
+                bcmd.remove('model {} and (name C+O+N+H+HA)'.format(fragmentname))
+                # hack for residue 'CM'
+                if sidechain == 'CM':
+                    bcmd.remove('model {} and name HG'.format(fragmentname))
+                    bcmd.alter('model {} and name SG'.format(fragmentname), 'formal_charge=-1')
 
             has_beta2sidechain = cmd.count_atoms(
                 'model {} and resi {} and name CB1'.format(self._modelname, residue)) == 1
@@ -559,18 +664,79 @@ class BetaPeptide:
             cmd.pair_fit('(model {0} and name CA_sc{1}+{2})'.format(fragmentname, site, caneighbour),
                          'model {} and resi {} and name {}+{}'.format(self._modelname, residue, *attachatoms),
                          quiet=True)
-            cmd.remove('model {} and name CA_sc{}'.format(fragmentname, site))
-            cmd.remove('model {} and resi {} and name {}'.format(self._modelname, residue, attachatoms[1]))
+            with cmdBatch() as bcmd:
+                bcmd.remove('model {} and name CA_sc{}'.format(fragmentname, site))
+                bcmd.remove('model {} and resi {} and name {}'.format(self._modelname, residue, attachatoms[1]))
             cmd.fuse('model {} and name {}'.format(fragmentname, caneighbour),
                      'model {} and resi {} and name {}'.format(self._modelname, residue, attachatoms[0]))
         # we are done with fusing, only renaming is needed.
+        self.invalidateTopology()
+
+    def _stereocentreAtoms(self, centres: Sequence[Tuple[str, ...]], residue: int) -> Tuple[np.ndarray, ...]:
+        """Fetch the coordinates and bonds of this model and find the atoms of stereocentres by name
+
+        :return: the coordinates, the bonds and the indices of the atoms of each centre
+        :rtype: tuple of (np.ndarray of shape (N, 3), np.ndarray of shape (M, 2), np.ndarray of shape (K, len(centre)))
+        """
+        model = cmd.get_model('model {}'.format(self._modelname))
+        lookup = {}
+        for i, a in enumerate(model.atom):
+            if a.resi_number == residue:
+                lookup.setdefault(a.name, i)
+
+        def find(name: str) -> int:
+            for n in name.split('+'):
+                if n in lookup:
+                    return lookup[n]
+            raise KeyError('No atom {} in residue {}'.format(name, residue))
+
+        return (np.array([a.coord for a in model.atom], dtype=float),
+                np.array([b.index for b in model.bond], dtype=int).reshape(-1, 2),
+                np.array([[find(name) for name in centre] for centre in centres], dtype=int))
+
+    def invertStereocentres(self, centres: Sequence[Tuple[str, str, str]], residue: int = 1):
+        """Invert the configuration of stereocentres in a residue
+
+        Two substituents of each centre stay in place, the branches of the other two are swapped. The coordinates are
+        fetched and put back once for all centres, see :func:`pmlbeta.geometry.invert_stereocentres`.
+
+        :param centres: atom names of the stereocentre and its two fixed substituents. Alternative names can be
+            separated by '+', as in PyMOL selections.
+        :type centres: sequence of tuples of three str
+        :param residue: the residue number
+        :type residue: int
+        :raises KeyError: if an atom is not found
+        :raises ValueError: if a centre cannot be inverted
+        """
+        coords, bonds, atoms = self._stereocentreAtoms(centres, residue)
+        cmd.load_coords(invert_stereocentres(coords, bonds, atoms[:, 0], atoms[:, 1:]),
+                        'model {}'.format(self._modelname))
+
+    def stereoDescriptors(self, centres: Sequence[Tuple[str, str, str, str, str]], residue: int = 1) -> List[str]:
+        """Determine the absolute configuration of stereocentres in a residue
+
+        :param centres: atom names of the stereocentre and its four substituents in decreasing order of CIP priority.
+            Alternative names can be separated by '+', as in PyMOL selections.
+        :type centres: sequence of tuples of five str
+        :param residue: the residue number
+        :type residue: int
+        :return: 'R' or 'S' for each centre
+        :rtype: list of str
+        :raises KeyError: if an atom is not found
+        """
+        coords, bonds, atoms = self._stereocentreAtoms(centres, residue)
+        return stereo_descriptors(coords, atoms[:, 0], atoms[:, 1:]).tolist()
 
     def renameAtomsInResidue(self, residue: int) -> None:
         """Rename atoms in a residue
 
+        The model is fetched from PyMOL and committed back only once. Hydrogens are found through an adjacency list
+        built from the bond table, thus the cost is linear in the number of atoms and bonds.
+
         :param int residue: the residue number.
         """
         with fetchModel(self._modelname) as model:
+            residueatoms = [a for a in model.atom if a.resi_number == residue]
             # first deconstruct the names of the atoms in the sidechains and the backbone into the form:
             #   <symbol>:<greek>:<index>:<sidechain>
             #
@@ -578,17 +744,12 @@ class BetaPeptide:
             #    CD1 in the alpha-sidechain -> C:D:1:2
             #    NE2 in the beta-sidechain -> N:E:2:3
             # hydrogens are skipped for the time being.
-            for a in model.atom:
+            for a in residueatoms:
                 assert isinstance(a, chempy.Atom)
-                if a.resi_number != residue:
-                    # skip atoms which do not belong to this residue
-                    continue
                 if a.symbol == 'H':
                     # this is a hydrogen, skip it for now.
                     continue
-                m = re.match(
-                    '^(?P<symbol>[BCNOFPS])(?P<greek>[{}])(?P<index>[123456789])?_sc(?P<sidechain>[023])$'.format(
-                        self.GREEKLETTERS), a.name)
+                m = self._HEAVYATOMNAME.match(a.name)
                 if m is None:
                     if a.name in ['C_sc0', 'O_sc0', 'N_sc0', 'H_sc0']:
                         # these are legal
@@ -611,9 +772,12 @@ class BetaPeptide:
             #    - index is the number of this atom in the original residue (e.g. the "2" from CD2)
             #    - sidechain is the sidechain designation, '0' being the backbone, '2' the alpha- and '3' the beta-sidechain
             scsort = {'0': 0, '3': 1, '2': 2}
+            bygreek = {}
+            for a in residueatoms:
+                if a.symbol != 'H' and '_' in a.name:
+                    bygreek.setdefault(a.name.split('_')[1], []).append(a)
             for g in self.GREEKLETTERS:
-                atoms = [a for a in model.atom if
-                         a.symbol != 'H' and '_' in a.name and a.resi_number == residue and a.name.split('_')[1] == g]
+                atoms = bygreek.get(g, [])
                 if not atoms:
                     continue
                 elif len(atoms) == 1:
@@ -628,20 +792,17 @@ class BetaPeptide:
                         logger.debug('{}: {}'.format(i + 1, a.name))
                         symbol, greek, index, sidechain = a.name.split('_')
                         a.name = symbol + greek + str(i + 1)
-        # re-fetch it from PyMOL, because we will use cmd.select for finding hydrogen neighbours of heavy atoms
-        with fetchModel(self._modelname) as model:
+
             # now fix the hydrogens
-            for a in model.atom:
-                assert isinstance(a, chempy.Atom)
-                if a.symbol == 'H':
-                    continue
-                if a.resi_number != residue:
+            neighbours = [[] for a in model.atom]
+            for b in model.bond:
+                neighbours[b.index[0]].append(b.index[1])
+                neighbours[b.index[1]].append(b.index[0])
+            for atomindex, a in enumerate(model.atom):
+                if a.symbol == 'H' or a.resi_number != residue:
                     continue
-                # find the atom to which this is bonded
-                atomindex = model.atom.index(a)
-                pairindices = [b.index for b in model.bond if atomindex in b.index]
-                neighbourindices = [x[0] if x[1] == atomindex else x[1] for x in pairindices]
-                hydrogens = [model.atom[idx] for idx in neighbourindices if model.atom[idx].symbol == 'H']
+                # find the hydrogens bonded to this atom
+                hydrogens = [model.atom[idx] for idx in neighbours[atomindex] if model.atom[idx].symbol == 'H']
                 if not hydrogens:
                     continue
                 elif len(hydrogens) == 1:
@@ -653,15 +814,13 @@ class BetaPeptide:
                     for i, h in enumerate(sorted(hydrogens, key=lambda h: h.name)):
                         h.name = 'H' + a.name[1:] + str(i + 1)
 
-        with fetchModel(self._modelname) as model:
             # see if some atoms are still having some :tags at the end of their names. Must be the N:sc0, H:sc0, O:sc0, C:sc0
-            for a in model.atom:
-                if a.resi_number != residue:
-                    continue
+            for a in residueatoms:
                 if a.name.endswith('_sc0'):
                     assert a.name.split('_')[0] in ['N', 'H', 'O', 'C']
                     a.name = a.name.split('_')[0]
                 assert '_' not in a.name
+        self.invalidateTopology()
 
     def isBetaResidue(self, residue: int) -> bool:
         """Check if the residue is a beta-amino acid
@@ -671,30 +830,7 @@ class BetaPeptide:
         :return: True if it is a beta-amino acid
         :rtype: bool
         """
-        if cmd.count_atoms('model {0} and resi {1} and name N+C+H+CA+O'.format(self._modelname, residue)) != 5:
-            # this might not even be an amino-acid!
-            return False
-        if cmd.count_atoms(
-                '(neighbor (model {0} and resi {1} and name N)) and resi {1} and name H'.format(self._modelname,
-                                                                                                residue)) != 1:
-            # N-H bond missing
-            return False
-        if cmd.count_atoms(
-                '(neighbor (model {0} and resi {1} and name C)) and resi {1} and name CA'.format(self._modelname,
-                                                                                                 residue)) != 1:
-            # N-CA bond missing
-            return False
-        if cmd.count_atoms(
-                '(neighbor (model {0} and resi {1} and name C)) and (neighbor (model {0} and resi {1} and name N)) and (resi {1} and name CA)'.format(
-                    self._modelname, residue)) == 1:
-            # N and C have a common neighbour, named CA. This is an alpha-amino acid
-            return False
-        if cmd.count_atoms(
-                '(neighbor (model {0} and resi {1} and name CA)) and (neighbor (model {0} and resi {1} and name N)) and (resi {1} and name CB+CB1)'.format(
-                    self._modelname, residue)) == 1:
-            # N and CA have a common neighbour, named either CB or CB1. This is a beta-amino acid.
-            return True
-        return False
+        return self.topology().residueKind(residue) == 'beta'
 
     def isAlphaResidue(self, residue: int) -> bool:
         """Check if the residue is an alpha-amino acid
@@ -704,30 +840,7 @@ class BetaPeptide:
         :return: True if it is an alpha-amino acid
         :rtype: bool
         """
-        if cmd.count_atoms('model {0} and resi {1} and name N+C+H+CA+O'.format(self._modelname, residue)) != 5:
-            # this might not even be an amino-acid!
-            return False
-        if cmd.count_atoms(
-                '(neighbor (model {0} and resi {1} and name N)) and resi {1} and name H'.format(self._modelname,
-                                                                                                residue)) != 1:
-            # N-H bond missing
-            return False
-        if cmd.count_atoms(
-                '(neighbor (model {0} and resi {1} and name C)) and resi {1} and name CA'.format(self._modelname,
-                                                                                                 residue)) != 1:
-            # N-CA bond missing
-            return False
-        if cmd.count_atoms(
-                '(neighbor (model {0} and resi {1} and name C)) and (neighbor (model {0} and resi {1} and name N)) and (resi {1} and name CA)'.format(
-                    self._modelname, residue)) == 1:
-            # N and C have a common neighbour, named CA. This is an alpha-amino acid
-            return True
-        if cmd.count_atoms(
-                '(neighbor (model {0} and resi {1} and name CA)) and (neighbor (model {0} and resi {1} and name N)) and (resi {1} and name CB+CB1)'.format(
-                    self._modelname, residue)) == 1:
-            # N and CA have a common neighbour, named either CB or CB1. This is a beta-amino acid.
-            return False
-        return False
+        return self.topology().residueKind(residue) == 'alpha'
 
     def fold(self, residue: int, dihedrals: Union[List[float], str]):
         """Fold a residue into the desired secondary structure
@@ -744,28 +857,50 @@ class BetaPeptide:
         :type dihedrals: list of floats or a str
         :raises ValueError: if the residue is neither an alpha-, nor a beta-amino acid
         """
+        self.foldResidues({residue: dihedrals})
+
+    def foldResidues(self, dihedrals: Dict[int, Union[List[float], str]]):
+        """Fold several residues into the desired secondary structures in one pass
+
+        The result is the same as calling :meth:`fold` for each residue in turn, but the coordinates are fetched
+        from and loaded back to PyMOL only once, see :func:`pmlbeta.utils.set_dihedrals`.
+
+        :param dihedrals: secondary structure designations (see :meth:`fold`) keyed by the residue numbers
+        :type dihedrals: dict
+        :raises ValueError: if a residue is neither an alpha-, nor a beta-amino acid
+        """
+        torsions = []
+        for residue, ss in dihedrals.items():
+            torsions.extend(self.backboneTorsions(residue, ss))
+        logger.debug(set_dihedrals(self._modelname, torsions))
+
+    def backboneTorsions(self, residue: int, dihedrals: Union[List[float], str]) -> List[tuple]:
+        """Get the backbone torsions of a residue with the desired values
+
+        :param residue: the number of the residue
+        :type residue: int
+        :param dihedrals: secondary structure designation (see :meth:`fold`)
+        :type dihedrals: list of floats or a str
+        :return: four (name, residue) pairs and the value for each dihedral, as expected by
+            :func:`pmlbeta.utils.set_dihedrals`
+        :rtype: list of tuples
+        :raises ValueError: if the residue is neither an alpha-, nor a beta-amino acid
+        """
         if isinstance(dihedrals, str):
             dihedrals = SecondaryStructureDB.dihedrals(dihedrals)
-        logger.debug('Folding alpha-residue {} to {}'.format(residue, dihedrals))
         if self.isAlphaResidue(residue):
             logger.debug('Folding alpha-residue {} to {}'.format(residue, dihedrals))
-            logger.debug(
-                set_dihedral(self._modelname, ('C', residue - 1), ('N', residue), ('CA', residue), ('C', residue),
-                             dihedrals[0]))
-            logger.debug(
-                set_dihedral(self._modelname, ('N', residue), ('CA', residue), ('C', residue), ('N', residue + 1),
-                             dihedrals[1]))
+            return [
+                (('C', residue - 1), ('N', residue), ('CA', residue), ('C', residue), dihedrals[0]),
+                (('N', residue), ('CA', residue), ('C', residue), ('N', residue + 1), dihedrals[1]),
+            ]
         elif self.isBetaResidue(residue):
             logger.debug('Folding beta-residue {} to {}'.format(residue, dihedrals))
-            logger.debug(
-                set_dihedral(self._modelname, ('C', residue - 1), ('N', residue), ('CB+CB1', residue), ('CA', residue),
-                             dihedrals[0]))
-            logger.debug(
-                set_dihedral(self._modelname, ('N', residue), ('CB+CB1', residue), ('CA', residue), ('C', residue),
-                             dihedrals[1]))
-            logger.debug(
-                set_dihedral(self._modelname, ('CB+CB1', residue), ('CA', residue), ('C', residue), ('N', residue + 1),
-                             dihedrals[2]))
+            return [
+                (('C', residue - 1), ('N', residue), ('CB+CB1', residue), ('CA', residue), dihedrals[0]),
+                (('N', residue), ('CB+CB1', residue), ('CA', residue), ('C', residue), dihedrals[1]),
+                (('CB+CB1', residue), ('CA', residue), ('C', residue), ('N', residue + 1), dihedrals[2]),
+            ]
         else:
             raise ValueError('Residue {} is neither an alpha-, nor a beta-amino acid'.format(residue))
 
@@ -778,9 +913,7 @@ class BetaPeptide:
         :return: the name of the new object
         :rtype: str
         """
-        resourcedir = os.path.join(os.path.split(pymol.plugins.plugins['pmlbeta'].filename)[0], 'resource')
-        cmd.load(os.path.join(resourcedir, 'betabackbone.pkl'), objectname)
-        return objectname
+        return FragmentLibrary.default().load('betabackbone', objectname)
 
     @staticmethod
     def loadPeptideBond(objectname: str) -> str:
@@ -790,8 +923,26 @@ class BetaPeptide:
         :return: the name of the new object
         :rtype: str
         """
-        resourcedir = os.path.join(os.path.split(pymol.plugins.plugins['pmlbeta'].filename)[0], 'resource')
-        cmd.load(os.path.join(resourcedir, 'peptidebond.pkl'), objectname)
+        return FragmentLibrary.default().load('peptidebond', objectname)
+
+    @staticmethod
+    def loadSideChainFragment(fragment: str, objectname: str) -> str:
+        """Create a new object: an alpha-amino acid with the desired side chain
+
+        Special amino acids shipped with this plugin are loaded from the fragment library, all others from the
+        fragments of PyMOL.
+
+        :param fragment: the name of the fragment, see :attr:`SIDECHAINS`
+        :type fragment: str
+        :param objectname: desired name of the new object
+        :type objectname: str
+        :return: the name of the new object
+        :rtype: str
+        """
+        fragments = FragmentLibrary.default()
+        if fragment in fragments:
+            return fragments.load(fragment, objectname)
+        cmd.fragment(fragment, objectname)
         return objectname
 
     def _debugModel(self, model=None):
@@ -813,10 +964,10 @@ class BetaPeptide:
     @classmethod
     def But(cls, modelname=None):
         obj = cls(None)
-        resourcedir = os.path.join(os.path.split(pymol.plugins.plugins['pmlbeta'].filename)[0], 'resource')
-        cmd.load(os.path.join(resourcedir, 'butyrate.pkl'), modelname)
-        cmd.alter('model {}'.format(modelname), 'resv=1')
-        cmd.alter('model {}'.format(modelname), 'chain="A"')
+        FragmentLibrary.default().load('butyrate', modelname)
+        with cmdBatch() as bcmd:
+            bcmd.alter('model {}'.format(modelname), 'resv=1')
+            bcmd.alter('model {}'.format(modelname), 'chain="A"')
         obj._modelname = modelname
         return obj
 
@@ -824,10 +975,11 @@ class BetaPeptide:
     def Ace(cls, modelname=None):
         obj = cls(None)
         cmd.fragment('ace', modelname)
-        for i in range(1, 4):
-            cmd.alter('model {} and name {}HH3'.format(modelname, i), 'name="HH3{}"'.format(i))
-        cmd.alter('model {}'.format(modelname), 'resv=1')
-        cmd.alter('model {}'.format(modelname), 'chain="A"')
+        with cmdBatch() as bcmd:
+            bcmd.alter('model {}'.format(modelname), 'name = hh3names.get(name, name)',
+                       space={'hh3names': cls._METHYLHYDROGENS})
+            bcmd.alter('model {}'.format(modelname), 'resv=1')
+            bcmd.alter('model {}'.format(modelname), 'chain="A"')
         obj._modelname = modelname
         return obj
 
@@ -835,43 +987,124 @@ class BetaPeptide:
     def NMe(cls, modelname=None):
         obj = cls(None)
         cmd.fragment('nme', modelname)
-        for i in range(1, 4):
-            cmd.alter('model {} and name {}HH3'.format(modelname, i), 'name="HH3{}"'.format(i))
-        cmd.alter('model {}'.format(modelname), 'resv=1')
-        cmd.alter('model {}'.format(modelname), 'chain="A"')
+        with cmdBatch() as bcmd:
+            bcmd.alter('model {}'.format(modelname), 'name = hh3names.get(name, name)',
+                       space={'hh3names': cls._METHYLHYDROGENS})
+            bcmd.alter('model {}'.format(modelname), 'resv=1')
+            bcmd.alter('model {}'.format(modelname), 'chain="A"')
         obj._modelname = modelname
         return obj
 
     @classmethod
     def ACHC(cls, stereo2: str, stereo3: str, modelname: str = None):
         obj = cls(None)
-        resourcedir = os.path.join(os.path.split(pymol.plugins.plugins['pmlbeta'].filename)[0], 'resource')
         try:
-            cmd.load(os.path.join(resourcedir, 'ACHC_2{}3{}.pkl'.format(stereo2.upper(), stereo3.upper())), modelname)
-        except pymol.CmdException:
+            FragmentLibrary.default().load('ACHC_2{}3{}'.format(stereo2.upper(), stereo3.upper()), modelname)
+        except KeyError:
             raise ValueError('Invalid stereochemistry: {} and {}'.format(stereo2, stereo3))
-        cmd.alter('model {}'.format(modelname), 'resv=1')
-        cmd.alter('model {}'.format(modelname), 'chain="A"')
-        cmd.alter('model {}'.format(modelname), 'resn="ACHC"')
+        with cmdBatch() as bcmd:
+            bcmd.alter('model {}'.format(modelname), 'resv=1')
+            bcmd.alter('model {}'.format(modelname), 'chain="A"')
+            bcmd.alter('model {}'.format(modelname), 'resn="ACHC"')
         obj._modelname = modelname
         return obj
 
     @classmethod
     def ACPC(cls, stereo2: str, stereo3: str, modelname: str = None):
         obj = cls(None)
-        resourcedir = os.path.join(os.path.split(pymol.plugins.plugins['pmlbeta'].filename)[0], 'resource')
         try:
-            cmd.load(os.path.join(resourcedir, 'ACPC_2{}3{}.pkl'.format(stereo2.upper(), stereo3.upper())), modelname)
-        except pymol.CmdException:
+            FragmentLibrary.default().load('ACPC_2{}3{}'.format(stereo2.upper(), stereo3.upper()), modelname)
+        except KeyError:
             raise ValueError('Invalid stereochemistry: {} and {}'.format(stereo2, stereo3))
-        cmd.alter('model {}'.format(modelname), 'resv=1')
-        cmd.alter('model {}'.format(modelname), 'chain="A"')
-        cmd.alter('model {}'.format(modelname), 'resn="ACPC"')
+        with cmdBatch() as bcmd:
+            bcmd.alter('model {}'.format(modelname), 'resv=1')
+            bcmd.alter('model {}'.format(modelname), 'chain="A"')
+            bcmd.alter('model {}'.format(modelname), 'resn="ACPC"')
         obj._modelname = modelname
         return obj
 
+    @classmethod
+    def fromResidue(cls, residue: Dict[str, str], modelname: str) -> "BetaPeptide":
+        """Create a single residue from its parsed description
+
+        Finished residues are kept in a cache (see :attr:`templateCache`), thus repeated residues are only copied.
+
+        :param residue: residue description, as returned by :meth:`parseBetaPeptideSequence`
+        :type residue: dict
+        :param modelname: the name of the new object
+        :type modelname: str
+        :return: the new residue
+        :rtype: BetaPeptide
+        """
+        template = cls.residueTemplate(residue)
+        cmd.delete('model {}'.format(modelname))
+        cmd.load_model(template.model, modelname)
+        obj = cls(None)
+        obj._modelname = modelname
+        return obj
+
+    @classmethod
+    def residueTemplate(cls, residue: Dict[str, str]) -> ResidueTemplate:
+        """Get the template of a single residue from the cache
+
+        Residues not yet in the cache are taken from the precompiled residue library, or built from PyMOL fragments
+        if they are not found there either.
+
+        :param residue: residue description, as returned by :meth:`parseBetaPeptideSequence`
+        :type residue: dict
+        :return: the residue template
+        :rtype: ResidueTemplate
+        """
+
+        def build() -> ResidueTemplate:
+            model = ResidueLibrary.default().model(cls.residueKey(residue))
+            if model is not None:
+                return ResidueTemplate(model)
+            with tempObjectName() as name:
+                cls.buildResidue(residue, name)
+                return ResidueTemplate(cmd.get_model('model {}'.format(name)))
+
+        return cls.templateCache.get(cls.residueKey(residue), build)
+
+    @classmethod
+    def buildResidue(cls, residue: Dict[str, str], modelname: str) -> "BetaPeptide":
+        """Build a single residue from scratch, bypassing the cache
+
+        :param residue: residue description, as returned by :meth:`parseBetaPeptideSequence`
+        :type residue: dict
+        :param modelname: the name of the new object
+        :type modelname: str
+        :return: the new residue
+        :rtype: BetaPeptide
+        """
+        if residue['kind'] == 'ACE':
+            return cls.Ace(modelname)
+        elif residue['kind'] == 'BUT':
+            return cls.But(modelname)
+        elif residue['kind'] == 'NME':
+            return cls.NMe(modelname)
+        elif residue['kind'] == 'ACHC':
+            return cls.ACHC(residue['stereo2'], residue['stereo3'], modelname)
+        elif residue['kind'] == 'ACPC':
+            return cls.ACPC(residue['stereo2'], residue['stereo3'], modelname)
+        else:
+            return cls(modelname, residue['kind'] != 'A', residue['sidechain2'], residue['stereo2'],
+                       residue['sidechain3'], residue['stereo3'])
+
+    @staticmethod
+    def residueKey(residue: Dict[str, str]) -> tuple:
+        """Get a hashable key identifying the chemical identity of a residue (the dihedrals are not included)
+
+        :param residue: residue description, as returned by :meth:`parseBetaPeptideSequence`
+        :type residue: dict
+        :return: the key
+        :rtype: tuple
+        """
+        return tuple(residue[k] for k in ['kind', 'sidechain2', 'stereo2', 'sidechain3', 'stereo3'])
+
     @staticmethod
-    def parseBetaPeptideSequence(sequencestr: str) -> List[Dict[str, str]]:
+    def parseBetaPeptideSequence(sequencestr: str, sstypes: Optional[Dict[str, tuple]] = None
+                                 ) -> List[Dict[str, str]]:
         """Parse a beta-peptide sequence
 
         The markup is the following (case sensitive):
@@ -916,127 +1149,166 @@ class BetaPeptide:
 
         :param sequence: a string representation of the peptide sequence, following the above markup
         :type sequence: str
+        :param sstypes: the secondary structure database, as returned by :meth:`SecondaryStructureDB.getAll`. If not
+            given, it is read from the PyMOL preferences when first needed.
+        :type sstypes: dict or None
         :return: parsed alpha- or beta-amino acids
         :rtype: a list of dicts having the following keys: 'kind', 'stereo2', 'stereo3', 'sidechain2', 'sidechain3'
-        :raises ValueError: if an element of a sequence cannot be interpreted
+        :raises SequenceParseError: if an element of a sequence cannot be interpreted (a subclass of ValueError)
         """
-        float_regex = r"""([+-]\s*)?  # optional sign and whitespace
-                        (  # start of the mantissa
-                        (\d+(\.\d*)?)   # one option: some digits, then optionally some decimals
-                        | or
-                        (\.\d+)  # second option: only the decimals, led in by a decimal point
-                        ) # end of the mantissa
-                        ([eE][+-]?\d+)? # optionally, an exponent
-                        """
-
-        regex = re.compile(r"""^( # begin
-                              (?P<ace>ACE) # acetyl group on the N-terminus
-                              |
-                              (?P<but>BUT) # butyl group on the N-terminus
-                              |
-                              (?P<nme>NME) # N-methylamide group on the C-terminus
-                              |
-                              \(2(?P<achcstereo2>[RS])3(?P<achcstereo3>[RS])\)ACHC  # 2-aminocyclohexanecarboxylic acid
-                              | 
-                              \(2(?P<acpcstereo2>[RS])3(?P<acpcstereo3>[RS])\)ACPC  # 2-aminocyclopentanecarboxylic acid
-                              | 
-                              (  # begin beta23-amino acid regex
-                              \(2(?P<stereo2>[RS])3(?P<stereo3>[RS])\)  # chirality for beta2,3
-                              B23h
-                              \(2(?P<sc2>[A-Z]{{1,2}})3(?P<sc3>[A-Z]{{1,2}})\)  # sidechain designation
-                              ) # end beta23-amino acid regex
-                              | # or
-                              ( # begin monosubstituted  beta-amino acid regex
-                              \((?P<monostereo>[RS])\) # chirality for mono-substituted beta-amino acids
-                              B(?P<monokind>[23])h
-                              (?P<monosc>[A-Z]{{1,2}}) # sidechain designation
-                              ) # end monostubstituted beta-amino acid regex
-                              | # or
-                              (?P<bare>BA) # bare beta-amino acid (homo-glycine) 
-                              | # or
-                              ( # begin alpha-amino acid regex
-                              \((?P<alphastereo>[RSLD])\) # chirality for alpha-amino acids
-                              A
-                              (?P<alphasc>[A-Z]{{1,2}}) # sidechain designation
-                              ))
-                              \s* # allow for whitespace between the amino-acid designation and the secondary structure info
-                              ( # begin optional torsion angle declaration
-                              (\[\s*(?P<phi>{0})\s+(?P<theta>{0})(\s+(?P<psi>{0}))?\s*\]) # two or three torsion angles in square brackets 
-                              | # or
-                              (\{{\s*(?P<ssname>[-a-zA-Z0-9_+ ]+)\s*\}}) # name of a secondary structure database entry in curly braces 
-                              )? # end optional torsion angle declaration 
-                              $ # end alpha-amino acid regex
-                              """.format(float_regex), re.X)
-
+        if (sstypes is None) and ('{' in sequencestr):
+            # secondary structure names are used: read the database only once
+            sstypes = SecondaryStructureDB.getAll()
         sequence = []
-        for aminoacid in [a.strip() for a in sequencestr.split(',')]:
-            m = regex.match(aminoacid)
-            if not m:
-                raise ValueError('Invalid amino-acid designation: {}'.format(aminoacid))
-            if m['phi'] is not None and m['theta'] is not None and m['psi'] is not None:
-                dihedrals = [float(m['phi']), float(m['theta']), float(m['psi'])]
-            elif m['phi'] is not None and m['theta'] is not None:  # implies that 'psi' not in m
-                dihedrals = [float(m['phi']), float(m['theta'])]
-            elif m['ssname'] is not None:
-                dihedrals = SecondaryStructureDB.dihedrals(m['ssname'])
-            else:
-                dihedrals = None
-            if m['bare'] is not None:
-                if dihedrals is not None and len(dihedrals) != 3:
-                    raise ValueError('Not enough dihedral angles specified in residue {}'.format(aminoacid))
-                sequence.append(
-                    {'kind': 'BA', 'sidechain2': 'G', 'stereo2': '', 'sidechain3': 'G', 'stereo3': '',
-                     'dihedrals': dihedrals})
-            elif m['alphastereo'] is not None:
-                if dihedrals is not None and len(dihedrals) != 2:
-                    raise ValueError('Too many dihedral angles specified in residue {}'.format(aminoacid))
-                sequence.append(
-                    {'kind': 'A', 'sidechain2': m['alphasc'], 'stereo2': m['alphastereo'],
-                     'sidechain3': '', 'stereo3': '', 'dihedrals': dihedrals})
-            elif m['monostereo'] is not None:
-                if dihedrals is not None and len(dihedrals) != 3:
-                    raise ValueError('Not enough dihedral angles specified in residue {}'.format(aminoacid))
-                if m['monokind'] == '2':
-                    sequence.append(
-                        {'kind': 'B2', 'sidechain2': m['monosc'], 'stereo2': m['monostereo'],
-                         'sidechain3': 'G', 'stereo3': '', 'dihedrals': dihedrals})
-                else:
-                    assert m['monokind'] == '3'
-                    sequence.append(
-                        {'kind': 'B3', 'sidechain2': 'G', 'stereo2': '',
-                         'sidechain3': m['monosc'], 'stereo3': m['monostereo'], 'dihedrals': dihedrals})
-            elif m['ace'] is not None:
-                if dihedrals is not None:
-                    raise ValueError('Residue ACE does not supports custom dihedrals.')
-                sequence.append({'kind': 'ACE', 'sidechain2': '', 'stereo2': '', 'sidechain3': '', 'stereo3': '',
-                                 'dihedrals': dihedrals})
-            elif m['but'] is not None:
-                if dihedrals is not None:
-                    raise ValueError('Residue BUT does not supports custom dihedrals.')
-                sequence.append({'kind': 'BUT', 'sidechain2': '', 'stereo2': '', 'sidechain3': '', 'stereo3': '',
-                                 'dihedrals': dihedrals})
-            elif m['nme'] is not None:
-                if dihedrals is not None:
-                    raise ValueError('Residue NME does not supports custom dihedrals.')
-                sequence.append({'kind': 'NME', 'sidechain2': '', 'stereo2': '', 'sidechain3': '', 'stereo3': '',
-                                 'dihedrals': dihedrals})
-            elif m['acpcstereo2'] is not None and m['acpcstereo3'] is not None:
-                sequence.append({'kind': 'ACPC', 'sidechain2': '', 'stereo2': m['acpcstereo2'], 'sidechain3': '',
-                                 'stereo3': m['acpcstereo3'], 'dihedrals': dihedrals})
-            elif m['achcstereo2'] is not None and m['achcstereo3'] is not None:
-                sequence.append({'kind': 'ACHC', 'sidechain2': '', 'stereo2': m['achcstereo2'], 'sidechain3': '',
-                                 'stereo3': m['achcstereo3'], 'dihedrals': dihedrals})
-            else:
-                if dihedrals is not None and len(dihedrals) != 3:
-                    raise ValueError('Not enough dihedral angles specified in residue {}'.format(aminoacid))
-                assert m['stereo2'] is not None
-                sequence.append(
-                    {'kind': 'B23', 'sidechain2': m['sc2'], 'stereo2': m['stereo2'],
-                     'sidechain3': m['sc3'], 'stereo3': m['stereo3'], 'dihedrals': dihedrals})
+        position = 0
+        for aminoacid in sequencestr.split(','):
+            column = position + len(aminoacid) - len(aminoacid.lstrip())
+            position += len(aminoacid) + 1
+            aminoacid = aminoacid.strip()
+            try:
+                sequence.append(BetaPeptide._parseResidue(aminoacid, sstypes))
+            except ValueError as ve:
+                raise SequenceParseError(ve.args[0], aminoacid, column) from None
         return sequence
 
+    @staticmethod
+    def _parseResidue(aminoacid: str, sstypes: Optional[Dict[str, tuple]]) -> Dict[str, str]:
+        """Parse a single residue (without the separating commas), see :meth:`parseBetaPeptideSequence`"""
+        m = RESIDUE_GRAMMAR.match(aminoacid)
+        if not m:
+            raise ValueError('Invalid amino-acid designation: {}'.format(aminoacid))
+        if m['phi'] is not None and m['theta'] is not None and m['psi'] is not None:
+            dihedrals = [float(m['phi']), float(m['theta']), float(m['psi'])]
+        elif m['phi'] is not None and m['theta'] is not None:  # implies that 'psi' not in m
+            dihedrals = [float(m['phi']), float(m['theta'])]
+        elif m['ssname'] is not None:
+            try:
+                dihedrals = sstypes[m['ssname']]
+            except KeyError:
+                raise ValueError('Unknown secondary structure: {}'.format(m['ssname']))
+        else:
+            dihedrals = None
+        if m['bare'] is not None:
+            if dihedrals is not None and len(dihedrals) != 3:
+                raise ValueError('Not enough dihedral angles specified in residue {}'.format(aminoacid))
+            return {'kind': 'BA', 'sidechain2': 'G', 'stereo2': '', 'sidechain3': 'G', 'stereo3': '',
+                    'dihedrals': dihedrals}
+        elif m['alphastereo'] is not None:
+            if dihedrals is not None and len(dihedrals) != 2:
+                raise ValueError('Too many dihedral angles specified in residue {}'.format(aminoacid))
+            return {'kind': 'A', 'sidechain2': m['alphasc'], 'stereo2': m['alphastereo'],
+                    'sidechain3': '', 'stereo3': '', 'dihedrals': dihedrals}
+        elif m['monostereo'] is not None:
+            if dihedrals is not None and len(dihedrals) != 3:
+                raise ValueError('Not enough dihedral angles specified in residue {}'.format(aminoacid))
+            if m['monokind'] == '2':
+                return {'kind': 'B2', 'sidechain2': m['monosc'], 'stereo2': m['monostereo'],
+                        'sidechain3': 'G', 'stereo3': '', 'dihedrals': dihedrals}
+            else:
+                assert m['monokind'] == '3'
+                return {'kind': 'B3', 'sidechain2': 'G', 'stereo2': '',
+                        'sidechain3': m['monosc'], 'stereo3': m['monostereo'], 'dihedrals': dihedrals}
+        elif m['ace'] is not None:
+            if dihedrals is not None:
+                raise ValueError('Residue ACE does not supports custom dihedrals.')
+            return {'kind': 'ACE', 'sidechain2': '', 'stereo2': '', 'sidechain3': '', 'stereo3': '',
+                    'dihedrals': dihedrals}
+        elif m['but'] is not None:
+            if dihedrals is not None:
+                raise ValueError('Residue BUT does not supports custom dihedrals.')
+            return {'kind': 'BUT', 'sidechain2': '', 'stereo2': '', 'sidechain3': '', 'stereo3': '',
+                    'dihedrals': dihedrals}
+        elif m['nme'] is not None:
+            if dihedrals is not None:
+                raise ValueError('Residue NME does not supports custom dihedrals.')
+            return {'kind': 'NME', 'sidechain2': '', 'stereo2': '', 'sidechain3': '', 'stereo3': '',
+                    'dihedrals': dihedrals}
+        elif m['acpcstereo2'] is not None and m['acpcstereo3'] is not None:
+            return {'kind': 'ACPC', 'sidechain2': '', 'stereo2': m['acpcstereo2'], 'sidechain3': '',
+                    'stereo3': m['acpcstereo3'], 'dihedrals': dihedrals}
+        elif m['achcstereo2'] is not None and m['achcstereo3'] is not None:
+            return {'kind': 'ACHC', 'sidechain2': '', 'stereo2': m['achcstereo2'], 'sidechain3': '',
+                    'stereo3': m['achcstereo3'], 'dihedrals': dihedrals}
+        else:
+            if dihedrals is not None and len(dihedrals) != 3:
+                raise ValueError('Not enough dihedral angles specified in residue {}'.format(aminoacid))
+            assert m['stereo2'] is not None
+            return {'kind': 'B23', 'sidechain2': m['sc2'], 'stereo2': m['stereo2'],
+                    'sidechain3': m['sc3'], 'stereo3': m['stereo3'], 'dihedrals': dihedrals}
+
+
+# the object property holding the sequence a peptide was built from, see store_sequence()
+SEQUENCE_PROPERTY = 'betafab2_sequence'
+
+
+def store_sequence(objname: str, residues: Iterable[str]):
+    """Record the sequence of a peptide as a property of its PyMOL object
+
+    The property is saved in sessions and kept by :func:`pymol.cmd.copy`. Commands changing the peptide as a whole,
+    e.g. :func:`pmlbeta.enantiomer.enantiomer`, keep it up to date.
+
+    :param objname: the name of the object
+    :type objname: str
+    :param residues: the amino-acid abbreviations, as in :func:`betafab2`
+    :type residues: iterable of str
+    """
+    cmd.set_property(SEQUENCE_PROPERTY, ', '.join(r.strip() for r in residues), objname)
+
+
+def stored_sequence(objname: str) -> Optional[str]:
+    """Get the sequence recorded by :func:`store_sequence`
+
+    :param objname: the name of the object
+    :type objname: str
+    :return: the sequence, parseable by :meth:`BetaPeptide.parseBetaPeptideSequence`, or None if not recorded
+    :rtype: str or None
+    """
+    return cmd.get_property(SEQUENCE_PROPERTY, objname)
+
+
+def parse_many(sequences: Iterable[str]) -> Tuple[List[Optional[List[Dict[str, str]]]], List[SequenceParseError]]:
+    """Parse many sequences, collecting the errors instead of stopping at the first one
+
+    The secondary structure database is read only once, and each distinct residue designation is parsed only once.
 
-def betafab2(objname, *args):
+    :param sequences: the sequences, e.g. the lines of a file (surrounding whitespace is ignored)
+    :type sequences: iterable of str
+    :return: the parsed sequences (None where parsing failed) and the errors, whose `index` attribute is the number
+        of the offending sequence (counted from 0)
+    :rtype: a list of lists of dicts, see :meth:`BetaPeptide.parseBetaPeptideSequence` and a list of
+        :class:`SequenceParseError` instances
+    """
+    sstypes = SecondaryStructureDB.getAll()
+    residues = {}  # residue designation -> parsed residue
+    parsed = []
+    errors = []
+    for index, sequencestr in enumerate(sequences):
+        sequence = []
+        position = 0
+        try:
+            for aminoacid in sequencestr.split(','):
+                column = position + len(aminoacid) - len(aminoacid.lstrip())
+                position += len(aminoacid) + 1
+                aminoacid = aminoacid.strip()
+                try:
+                    residue = residues[aminoacid]
+                except KeyError:
+                    try:
+                        residue = residues[aminoacid] = BetaPeptide._parseResidue(aminoacid, sstypes)
+                    except ValueError as ve:
+                        raise SequenceParseError(ve.args[0], aminoacid, column, index) from None
+                # the residues are handed out as separate objects, as if they were parsed one by one
+                sequence.append(dict(residue))
+        except SequenceParseError as spe:
+            errors.append(spe)
+            parsed.append(None)
+        else:
+            parsed.append(sequence)
+    return parsed, errors
+
+
+def betafab2(objname, *args, engine: str = 'fuse', clashcheck: bool = False, pack: bool = False,
+             profile: Union[bool, str] = False):
     """ Construct an alpha/beta peptide
 
         Amino acids can be given in the following way:
@@ -1097,32 +1369,67 @@ def betafab2(objname, *args):
             2. referencing an entry of the secondary structure database in
                curly braces, e.g. (S)AQ{Alpha-helix}   or  (S)B3hV{H14M}
 
+        The following build engines are available:
+
+            fuse: each residue is fused to the growing chain in PyMOL, then
+                the backbone dihedrals are set one by one (the default)
+            append: like fuse, but residues are appended to a single growing
+                model outside PyMOL, which is loaded once at the end. The
+                cost grows linearly with the chain length.
+            nerf: each distinct residue is created only once, then the whole
+                peptide is placed from internal coordinates in a single pass and
+                loaded into PyMOL at once. Much faster for long sequences.
+
     :param objname: the name PyMOL will know about the resulting peptide
     :type objname: str
     :param args: amino-acid abbreviations
     :type args: str
+    :param engine: the build engine: 'fuse', 'append' or 'nerf'
+    :type engine: str
+    :param clashcheck: report the clashing residue pairs of the finished peptide
+    :type clashcheck: bool
+    :param pack: place the side chains of the finished peptide in their best rotamers
+    :type pack: bool
+    :param profile: record the wall time and the number of calls of the build stages, per residue, and the number of
+        PyMOL commands issued (see :class:`BuildProfiler`). True prints a summary table, a file name also writes the
+        results to that file in JSON format.
+    :type profile: bool or str
     :return: the constructed peptide
     :rtype: BetaPeptide
     """
-    sequence = [BetaPeptide.parseBetaPeptideSequence(a)[0] for a in args]
+    if engine not in ['fuse', 'append', 'nerf']:
+        raise ValueError('Unknown build engine: {}'.format(engine))
+    with profiled(profile):
+        # a single pass, reading the secondary structure database at most once
+        sequence = BetaPeptide.parseBetaPeptideSequence(', '.join(args))
+
+        if engine == 'nerf':
+            betapeptide = _betafab2_nerf(objname, sequence)
+        elif engine == 'append':
+            betapeptide = _betafab2_append(objname, sequence)
+        else:
+            _betafab2_fuse(objname, sequence)
+            betapeptide = None
+        store_sequence(objname, args)
+        if pack:
+            pack_selection('model {}'.format(objname))
+        if clashcheck:
+            report_clashes('model {}'.format(objname))
+    return betapeptide
+
 
+def _betafab2_fuse(objname: str, sequence: List[Dict]):
+    """Build a peptide by fusing residues one by one to the growing chain in PyMOL
+
+    :param objname: the name PyMOL will know about the resulting peptide
+    :type objname: str
+    :param sequence: the parsed residues
+    :type sequence: list of dicts, as returned by :meth:`BetaPeptide.parseBetaPeptideSequence`
+    """
     betapeptide = None
     for ires, residue in enumerate(sequence):
-        with tempObjectName() as nextname:
-            if residue['kind'] == 'ACE':
-                nextresidue = BetaPeptide.Ace(nextname)
-            elif residue['kind'] == 'BUT':
-                nextresidue = BetaPeptide.But(nextname)
-            elif residue['kind'] == 'NME':
-                nextresidue = BetaPeptide.NMe(nextname)
-            elif residue['kind'] == 'ACHC':
-                nextresidue = BetaPeptide.ACHC(residue['stereo2'], residue['stereo3'], nextname)
-            elif residue['kind'] == 'ACPC':
-                nextresidue = BetaPeptide.ACPC(residue['stereo2'], residue['stereo3'], nextname)
-            else:
-                nextresidue = BetaPeptide(
-                    nextname, residue['kind'] != 'A', residue['sidechain2'], residue['stereo2'],
-                    residue['sidechain3'], residue['stereo3'])
+        with building_residue(ires + 1, residue), tempObjectName() as nextname:
+            nextresidue = BetaPeptide.fromResidue(residue, nextname)
             if betapeptide is None:
                 betapeptide = nextresidue
             else:
@@ -1130,15 +1437,236 @@ def betafab2(objname, *args):
             betapeptide = betapeptide.copy(objname)
     # we are ready. Now we need to fold it. Folding is skipped to this point, because folding a residue needs some
     # atoms from the previous and the next residues, respectively.
+    betapeptide.foldResidues({ires: residue['dihedrals'] for ires, residue in enumerate(sequence, start=1)
+                              if residue['dihedrals'] is not None})
+
+    cmd.show_as('sticks', 'model {}'.format(objname))
+
+
+def _residueTemplates(sequence: List[Dict]) -> Dict[tuple, ResidueTemplate]:
+    """Get the template of each distinct residue of a sequence
+
+    :param sequence: the parsed residues
+    :type sequence: list of dicts, as returned by :meth:`BetaPeptide.parseBetaPeptideSequence`
+    :return: the residue templates
+    :rtype: dict mapping residue keys (see :meth:`BetaPeptide.residueKey`) to ResidueTemplate instances
+    """
+    templates = {}
     for ires, residue in enumerate(sequence, start=1):
-        if residue['dihedrals'] is not None:
-            betapeptide.fold(ires, residue['dihedrals'])
+        key = BetaPeptide.residueKey(residue)
+        if key not in templates:
+            with building_residue(ires, residue):
+                templates[key] = BetaPeptide.residueTemplate(residue)
+    return templates
+
+
+def _peptideBondMould() -> ResidueTemplate:
+    """Get the peptide bond mould as a template"""
+    with tempObjectName() as mouldname:
+        BetaPeptide.loadPeptideBond(mouldname)
+        return ResidueTemplate(cmd.get_model('model {}'.format(mouldname)))
+
+
+def _betafab2_nerf(objname: str, sequence: List[Dict]) -> BetaPeptide:
+    """Build a peptide from internal coordinates: PyMOL is only needed for creating each distinct residue once.
 
+    :param objname: the name PyMOL will know about the resulting peptide
+    :type objname: str
+    :param sequence: the parsed residues
+    :type sequence: list of dicts, as returned by :meth:`BetaPeptide.parseBetaPeptideSequence`
+    :return: the constructed peptide
+    :rtype: BetaPeptide
+    """
+    templates = _residueTemplates(sequence)
+    model = assemble([templates[BetaPeptide.residueKey(r)] for r in sequence],
+                     [r['dihedrals'] for r in sequence], _peptideBondMould())
+    cmd.delete('model {}'.format(objname))
+    cmd.load_model(model, objname)
     cmd.show_as('sticks', 'model {}'.format(objname))
-    return
+    obj = BetaPeptide(None)
+    obj._modelname = objname
+    return obj
+
+
+class PeptideBuilder:
+    """Build peptides by appending residues to a single growing model, in linear time.
+
+    Like in :meth:`BetaPeptide.__iadd__`, each new residue is joined through the peptide bond mould, but only the
+    last residue of the chain is used for the superposition and the chain is never copied. The named object is
+    created once, at the end, then folded.
+
+    The unfolded atoms of each residue are kept after the build. If the next sequence to be built has the same
+    first k residues as the previous one, only the residues from k+1 onward are built again. If only the secondary
+    structure has changed, nothing is built, the chain is only folded again.
+    """
+
+    def __init__(self):
+        self._mould = None
+        # for each residue of the last build: residue key, template, atoms and bonds in the unfolded chain
+        self._residues = []
+        self.objname = None
+        self.rebuilt = 0
+
+    def _appendResidue(self, key: tuple, template: ResidueTemplate):
+        if self._mould is None:
+            self._mould = _peptideBondMould()
+        coords = template.coords
+        if self._residues:
+            lastkey, lasttemplate, lastatoms, lastbonds = self._residues[-1]
+            mould = self._mould
+            # put the mould on the C-terminus of the chain, then the new residue on the mould
+            rot, trans, rmsd = kabsch(mould.coords[[mould.find('Cprev'), mould.find('C'), mould.find('O')]],
+                                      np.array([lastatoms[i].coord for i in lasttemplate.leftFitAtoms()]))
+            mouldcoords = mould.coords[[mould.find('N'), mould.find('H'), mould.find('Cnext')]] @ rot.T + trans
+            rot, trans, rmsd = kabsch(coords[template.rightFitAtoms()], mouldcoords)
+            coords = coords @ rot.T + trans
+        ires = len(self._residues) + 1
+        atoms = []
+        for atom, xyz in zip(template.model.atom, coords):
+            atom = copy.deepcopy(atom)
+            atom.resi_number = ires
+            atom.resi = str(ires)
+            atom.coord = [float(x) for x in xyz]
+            atoms.append(atom)
+        bonds = [copy.deepcopy(bond) for bond in template.model.bond]
+        if self._residues:
+            # the peptide bond, the index of the C atom is relative to the first atom of the previous residue
+            bond = chempy.Bond()
+            bond.index = [lasttemplate.leftFitAtoms()[1] - len(lastatoms), template.rightFitAtoms()[0]]
+            bond.order = 1
+            bonds.append(bond)
+        self._residues.append((key, template, atoms, bonds))
+
+    def model(self) -> "chempy.models.Indexed":
+        """Get the unfolded chain of the last build
+
+        :return: the model
+        :rtype: chempy.models.Indexed
+        """
+        model = chempy.models.Indexed()
+        for key, template, atoms, bonds in self._residues:
+            offset = len(model.atom)
+            for atom in atoms:
+                model.add_atom(atom)
+            for bond in bonds:
+                bond = copy.copy(bond)
+                bond.index = [bond.index[0] + offset, bond.index[1] + offset]
+                model.add_bond(bond)
+        return model
+
+    def __len__(self) -> int:
+        return len(self._residues)
+
+    def truncate(self, length: int):
+        """Forget the residues after the first `length` ones, returning to an earlier state of the chain
+
+        :param length: the number of residues to keep
+        :type length: int
+        """
+        del self._residues[length:]
+
+    def extend(self, sequence: List[Dict]):
+        """Append residues to the chain
+
+        :param sequence: the parsed residues
+        :type sequence: list of dicts, as returned by :meth:`BetaPeptide.parseBetaPeptideSequence`
+        """
+        for residue in sequence:
+            with building_residue(len(self._residues) + 1, residue):
+                self._appendResidue(BetaPeptide.residueKey(residue), BetaPeptide.residueTemplate(residue))
+
+    def load(self, objname: str, sequence: List[Dict]) -> BetaPeptide:
+        """Create a PyMOL object from the current chain and fold it
+
+        :param objname: the name PyMOL will know about the resulting peptide
+        :type objname: str
+        :param sequence: the parsed residues, only their dihedrals are used
+        :type sequence: list of dicts, as returned by :meth:`BetaPeptide.parseBetaPeptideSequence`
+        :return: the constructed peptide
+        :rtype: BetaPeptide
+        """
+        cmd.delete('model {}'.format(objname))
+        cmd.load_model(self.model(), objname)
+        self.objname = objname
+        betapeptide = BetaPeptide(None)
+        betapeptide._modelname = objname
+        # folding is cheap, thus the whole chain is folded, like after a full build
+        betapeptide.foldResidues({ires: residue['dihedrals'] for ires, residue in enumerate(sequence, start=1)
+                                  if residue['dihedrals'] is not None})
+        cmd.show_as('sticks', 'model {}'.format(objname))
+        return betapeptide
+
+    def build(self, objname: str, sequence: List[Dict]) -> BetaPeptide:
+        """Build a peptide, reusing the residues of the previous build where possible
+
+        :param objname: the name PyMOL will know about the resulting peptide
+        :type objname: str
+        :param sequence: the parsed residues
+        :type sequence: list of dicts, as returned by :meth:`BetaPeptide.parseBetaPeptideSequence`
+        :return: the constructed peptide
+        :rtype: BetaPeptide
+        """
+        keys = [BetaPeptide.residueKey(residue) for residue in sequence]
+        unchanged = 0
+        while (unchanged < min(len(keys), len(self._residues))) and (self._residues[unchanged][0] == keys[unchanged]):
+            unchanged += 1
+        self.truncate(unchanged)
+        self.extend(sequence[unchanged:])
+        self.rebuilt = len(sequence) - unchanged
+        logger.debug('Reused {} residues, built {}'.format(unchanged, self.rebuilt))
+        return self.load(objname, sequence)
+
+
+def _betafab2_append(objname: str, sequence: List[Dict]) -> BetaPeptide:
+    """Build a peptide by appending residues to a single growing model, in linear time.
+
+    :param objname: the name PyMOL will know about the resulting peptide
+    :type objname: str
+    :param sequence: the parsed residues
+    :type sequence: list of dicts, as returned by :meth:`BetaPeptide.parseBetaPeptideSequence`
+    :return: the constructed peptide
+    :rtype: BetaPeptide
+    """
+    return PeptideBuilder().build(objname, sequence)
+
 
+def betafab2_library(sequences: Dict[str, List[str]]) -> Dict[str, int]:
+    """Build many peptides, building the residues of shared N-terminal prefixes only once
 
-def betafab2cmd(objname, *args, **kwargs):  # kwargs is needed to swallow the _self argument given by PyMol
+    The sequences are arranged in a prefix tree, which is then walked depth-first with a single
+    :class:`PeptideBuilder`. When a branch is finished, the builder returns to the unfolded chain at the branching
+    point and continues with the next branch from there. Secondary structures do not hinder sharing: folding is
+    done separately for each peptide.
+
+    :param sequences: object names mapped to the amino-acid abbreviations, as in :func:`betafab2`
+    :type sequences: dict of str -> list of str
+    :return: the number of sequences, of residues in them, of residue builds and of the residue builds saved
+    :rtype: dict with keys 'sequences', 'residues', 'built' and 'saved'
+    :raises SequenceParseError: if a sequence cannot be parsed, before anything is built
+    """
+    objnames = list(sequences)
+    parsed, errors = parse_many([', '.join(sequences[objname]) for objname in objnames])
+    if errors:
+        raise errors[0]
+    trie = SequenceTrie()
+    for objname, sequence in zip(objnames, parsed):
+        trie.insert([BetaPeptide.residueKey(residue) for residue in sequence], sequence, (objname, sequence))
+    builder = PeptideBuilder()
+    for shared, residues, items in trie.walk():
+        builder.truncate(shared)
+        builder.extend(residues)
+        for objname, sequence in items:
+            builder.load(objname, sequence)
+            store_sequence(objname, sequences[objname])
+    result = {'sequences': len(trie), 'residues': trie.elements, 'built': trie.nodes,
+              'saved': trie.elements - trie.nodes}
+    logger.info('Built {sequences} peptides with {residues} residues, {saved} residue builds saved by sharing '
+                'prefixes'.format(**result))
+    return result
+
+
+def betafab2cmd(objname, *args, engine='fuse', clashcheck=0, pack=0, profile=0,
+                **kwargs):  # kwargs is needed to swallow the _self argument given by PyMol
     """
     DESCRIPTION
 
@@ -1146,12 +1674,29 @@ def betafab2cmd(objname, *args, **kwargs):  # kwargs is needed to swallow the _s
 
     USAGE
 
-        betafab2 objname [, aa1 [, aa2 [, aa3 [,...]]]]
+        betafab2 objname [, aa1 [, aa2 [, aa3 [,...]]]] [, engine=fuse|append|nerf] [, clashcheck=0|1]
+            [, pack=0|1] [, profile=0|1|filename]
 
     ARGUMENTS
 
         objname = str: target object name. Will be overwritten!
 
+        engine = str: 'fuse' (default) builds the peptide residue by residue in
+            PyMOL, 'append' joins the residues in a single growing model, 'nerf'
+            places all atoms from internal coordinates in a single pass. The
+            latter two are much faster for long sequences.
+
+        clashcheck = 0 or 1: report the clashing residue pairs of the finished
+            peptide (see check_clashes)
+
+        pack = 0 or 1: place the side chains of the finished peptide in their
+            best rotamers (see pack_sidechains)
+
+        profile = 0, 1 or a file name: print the wall time and the number of
+            calls of the build stages, the time spent on each residue and the
+            number of PyMOL commands issued. If a file name is given, the
+            results are also written to it in JSON format.
+
         aa1, aa2 etc. = str: descriptors of the alpha/beta amino
             acid residues. The following cases are understood:
 
@@ -1211,8 +1756,49 @@ def betafab2cmd(objname, *args, **kwargs):  # kwargs is needed to swallow the _s
          betafab2 helix, (S)B3hV{H14M}, (S)B3hA{H14M}, (S)B3hL{H14M}, (2S3S)B23h(2A3A){H14M}, (S)B3hV{H14M}, (S)B3hA{H14M}, (S)B3hL{H14M}
 
     """
-    return betafab2(objname, *args)
+    if profile in ['0', '1', 0, 1]:
+        profile = bool(int(profile))
+    return betafab2(objname, *args, engine=engine, clashcheck=bool(int(clashcheck)), pack=bool(int(pack)),
+                    profile=profile)
+
+
+def betafab2_cache(action='info', size=None, _self=None):
+    """
+    DESCRIPTION
+
+        Inspect or manage the cache of finished residues used by betafab2
+
+    USAGE
+
+        betafab2_cache [action [, size]]
+
+    ARGUMENTS
+
+        action = str: 'info' (default) prints the usage statistics, 'clear'
+            empties the cache and 'resize' changes its capacity
+
+        size = int: the new capacity for the 'resize' action
+
+    NOTES
+
+        'clear' also forgets the fragments read from the resource directory,
+        which are kept in memory once loaded
+    """
+    if action == 'clear':
+        BetaPeptide.templateCache.clear()
+        FragmentLibrary.default().clear()
+    elif action == 'resize':
+        if size is None:
+            raise ValueError('The new size must be given')
+        BetaPeptide.templateCache.resize(int(size))
+    elif action != 'info':
+        raise ValueError('Unknown action: {}'.format(action))
+    stats = BetaPeptide.templateCache.stats()
+    print('Residue template cache: {size} of {maxsize} entries, {hits} hits, {misses} misses, '
+          '{evictions} evictions'.format(**stats))
+    return stats
 
 
 if cmd is not None:
     cmd.extend("betafab2", betafab2cmd)
+    cmd.extend("betafab2_cache", betafab2_cache)
@@ -1,6 +1,4 @@
-import warnings
+"""Graphical user interface
 
-try:
-    from . import betafab2, dihedraleditor
-except ImportError as ie:
-    warnings.warn('GUI is not supported due to an import error: {}'.format(ie.args))
+The windows are imported by the plugin menu when first opened, since importing Qt and the icon resources is slow.
+"""
@@ -5,8 +5,9 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 
 from .betafab2_ui import Ui_Form
 from .sequencemodel import SequenceModel
-from ..betafab2 import BetaPeptide, betafab2
+from ..betafab2 import BetaPeptide, PeptideBuilder, store_sequence
 from ..utils import select_bbb
+from ..minimize import minimize_selection
 
 try:
     from pymol import cmd
@@ -23,6 +24,8 @@ class Betafab2GUI(QtWidgets.QWidget, Ui_Form):
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        # keeps the residues of the last build, so that only the changed part of the sequence is built again
+        self._builder = PeptideBuilder()
         self.setupUi(self)
 
     def setupUi(self, Form):
@@ -315,7 +318,7 @@ class Betafab2GUI(QtWidgets.QWidget, Ui_Form):
     def build(self):
         """Build the peptide"""
         name = self.targetObjectNameLineEdit.text()
-        if name in cmd.get_object_list():
+        if (name in cmd.get_object_list()) and (name != self._builder.objname):
             if QtWidgets.QMessageBox.question(
                     self, 'Overwrite existing model?',
                     'Model {} already exists. Do you want to overwrite it?'.format(name),
@@ -324,9 +327,10 @@ class Betafab2GUI(QtWidgets.QWidget, Ui_Form):
                 # "No" was selected by the user, return without building
                 return
             cmd.delete('model {}'.format(name))
-        residues = self.model.residues()
         try:
-            betafab2(name, *residues)
+            sequence = BetaPeptide.parseBetaPeptideSequence(', '.join(self.model.residues()))
+            self._builder.build(name, sequence)
+            store_sequence(name, self.model.residues())
         except Exception as exc:
             QtWidgets.QMessageBox.critical(
                 self, 'Error while building peptide',
@@ -340,10 +344,11 @@ class Betafab2GUI(QtWidgets.QWidget, Ui_Form):
                 cmd.clean('model {}'.format(name))
             except:
                 warnings.warn('Cannot run clean(): This PyMOL build appears not to include full modeling capabilities '
-                              '(could not import the freemol.mengine module). Using the inferior sculpting facility.')
-                cmd.sculpt_activate(name)
-                cmd.sculpt_iterate(name, cycles=1000)
-                cmd.sculpt_deactivate(name)
+                              '(could not import the freemol.mengine module). Using the built-in clash relief.')
+                result = minimize_selection('model {}'.format(name))
+                if not result['converged']:
+                    warnings.warn('The clash relief has not converged, the largest remaining force is {:.2f} '
+                                  'kcal/mol/A.'.format(result['maxforce']))
             cmd.flag('fix', '_bbone_of_{}'.format(name), 'clear')
             cmd.delete('_bbone_of_{}'.format(name))
 
@@ -0,0 +1,246 @@
+"""Detection of steric clashes
+
+Two atoms clash if their van der Waals spheres overlap by more than a tolerance, unless they are separated by at most
+three bonds (1-2, 1-3 and 1-4 pairs), whose distances are governed by the covalent geometry. Close pairs are found
+with a cell list: atoms are binned into cubic cells with an edge length equal to the cutoff, and only atoms in the same
+or in adjacent cells are compared. The cost grows linearly with the number of atoms. Hydrogen bonds are not clashes:
+polar hydrogens and acceptors may come closer than other atoms.
+"""
+import logging
+import warnings
+from typing import List, Tuple
+
+import numpy as np
+
+try:
+    from pymol import cmd
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    cmd = None
+
+from .peptidearrays import PeptideArrays
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# the cell offsets to be visited from each cell: the cell itself and half of its 26 neighbours, thus each pair of
+# cells is visited only once
+_HALFSHELL = np.array([(0, 0, 0)] + [(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)
+                                     if (i, j, k) > (0, 0, 0)])
+
+# the van der Waals spheres of a polar hydrogen and an acceptor may overlap this much more, in a hydrogen bond with
+# a H...O distance of 1.8 Angstroms the overlap is about 0.9 Angstroms
+HBOND_OVERLAP = 0.6
+
+
+def _expandRanges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenate the index ranges starts[i]:starts[i]+counts[i]"""
+    total = counts.sum()
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+
+
+def neighbour_pairs(coords: np.ndarray, cutoff: float) -> np.ndarray:
+    """Find all pairs of points closer than a cutoff, using a cell list
+
+    :param coords: the points
+    :type coords: (N, 3) array of floats
+    :param cutoff: the distance cutoff
+    :type cutoff: float
+    :return: the pairs, the first index being smaller
+    :rtype: (P, 2) array of ints
+    """
+    coords = np.asarray(coords, dtype=float)
+    if len(coords) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    cells = np.floor((coords - coords.min(axis=0)) / cutoff).astype(np.int64) + 1  # leave an empty layer at 0
+    dims = cells.max(axis=0) + 2
+
+    def cellid(c):
+        return (c[:, 0] * dims[1] + c[:, 1]) * dims[2] + c[:, 2]
+
+    # sort the atoms by cell: the atoms of a cell are then atomorder[cellstart[c]:cellstart[c] + cellcount[c]]
+    ids = cellid(cells)
+    atomorder = np.argsort(ids, kind='stable')
+    sortedids = ids[atomorder]
+    pairs = []
+    for offset in _HALFSHELL:
+        otherids = cellid(cells + offset)
+        starts = np.searchsorted(sortedids, otherids, side='left')
+        counts = np.searchsorted(sortedids, otherids, side='right') - starts
+        i = np.repeat(np.arange(len(coords)), counts)
+        j = atomorder[_expandRanges(starts, counts)]
+        if not offset.any():
+            # in the same cell, take each pair only once
+            keep = i < j
+            i, j = i[keep], j[keep]
+        close = ((coords[i] - coords[j]) ** 2).sum(axis=1) < cutoff ** 2
+        pairs.append(np.stack([np.minimum(i[close], j[close]), np.maximum(i[close], j[close])], axis=1))
+    return np.concatenate(pairs)
+
+
+def bonded_pairs(arrays: PeptideArrays, maxbonds: int = 3) -> np.ndarray:
+    """Find the pairs of atoms separated by at most a given number of bonds
+
+    :param arrays: the molecule
+    :type arrays: PeptideArrays
+    :param maxbonds: the maximum number of bonds between the atoms (3 for 1-2, 1-3 and 1-4 pairs)
+    :type maxbonds: int
+    :return: the pairs, the first index being smaller
+    :rtype: (P, 2) array of ints
+    """
+    natoms = len(arrays)
+    degrees = arrays.degrees()
+    # walks of increasing length: extend each walk (i, k) with the neighbours j of k. Pairs are encoded as i * N + j.
+    first = np.concatenate([arrays.bonds[:, 0], arrays.bonds[:, 1]])
+    last = np.concatenate([arrays.bonds[:, 1], arrays.bonds[:, 0]])
+    found = [np.minimum(first, last) * natoms + np.maximum(first, last)]
+    for length in range(2, maxbonds + 1):
+        counts = degrees[last]
+        first = np.repeat(first, counts)
+        last = arrays.neighbourindices[_expandRanges(arrays.neighbourptr[last], counts)]
+        walks = np.unique(first[first != last] * natoms + last[first != last])
+        first, last = walks // natoms, walks % natoms
+        found.append(np.minimum(first, last) * natoms + np.maximum(first, last))
+    keys = np.unique(np.concatenate(found))
+    return np.stack([keys // natoms, keys % natoms], axis=1)
+
+
+def polar_atoms(arrays: PeptideArrays) -> Tuple[np.ndarray, np.ndarray]:
+    """Find the potential hydrogen bond acceptors (N and O) and the polar hydrogens (bonded to N or O)
+
+    :param arrays: the molecule
+    :type arrays: PeptideArrays
+    :return: which atoms are acceptors and which are polar hydrogens
+    :rtype: two arrays of bools
+    """
+    polar = np.isin(arrays.symbol, ['N', 'O'])
+    hydrogen = arrays.symbol == 'H'
+    polarhydrogen = np.zeros(len(arrays), dtype=bool)
+    for i, j in [(0, 1), (1, 0)]:
+        bonds = arrays.bonds[hydrogen[arrays.bonds[:, i]] & polar[arrays.bonds[:, j]]]
+        polarhydrogen[bonds[:, i]] = True
+    return polar, polarhydrogen
+
+
+def hbond_pairs(arrays: PeptideArrays, pairs: np.ndarray) -> np.ndarray:
+    """Find the pairs of a polar hydrogen (bonded to N or O) and a potential acceptor (N or O)
+
+    :param arrays: the molecule
+    :type arrays: PeptideArrays
+    :param pairs: the atom pairs
+    :type pairs: (P, 2) array of ints
+    :return: which pairs can form a hydrogen bond
+    :rtype: array of P bools
+    """
+    polar, polarhydrogen = polar_atoms(arrays)
+    return (polarhydrogen[pairs[:, 0]] & polar[pairs[:, 1]]) | (polar[pairs[:, 0]] & polarhydrogen[pairs[:, 1]])
+
+
+def find_clashes(arrays: PeptideArrays, tolerance: float = 0.6, maxbonds: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+    """Find clashing atoms
+
+    Hydrogen bonds are allowed an extra overlap of :data:`HBOND_OVERLAP`.
+
+    :param arrays: the molecule
+    :type arrays: PeptideArrays
+    :param tolerance: the allowed overlap of the van der Waals spheres, in Angstroms
+    :type tolerance: float
+    :param maxbonds: atoms separated by at most this many bonds are never considered clashing
+    :type maxbonds: int
+    :return: the clashing pairs and their overlaps (less the hydrogen bond allowance), the worst first
+    :rtype: (P, 2) array of ints and array of P floats
+    """
+    vdw = arrays.vdw.astype(float)
+    if not len(vdw):
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0)
+    pairs = neighbour_pairs(arrays.coords, 2 * vdw.max() - tolerance)
+    if len(pairs) and maxbonds > 0:
+        natoms = len(arrays)
+        excluded = bonded_pairs(arrays, maxbonds)
+        keep = ~np.isin(pairs[:, 0] * natoms + pairs[:, 1], excluded[:, 0] * natoms + excluded[:, 1],
+                        assume_unique=True)
+        pairs = pairs[keep]
+    distances = np.linalg.norm(arrays.coords[pairs[:, 0]] - arrays.coords[pairs[:, 1]], axis=1)
+    overlaps = vdw[pairs[:, 0]] + vdw[pairs[:, 1]] - distances - HBOND_OVERLAP * hbond_pairs(arrays, pairs)
+    clashing = overlaps > tolerance
+    order = np.argsort(-overlaps[clashing], kind='stable')
+    return pairs[clashing][order], overlaps[clashing][order]
+
+
+def clashing_residues(arrays: PeptideArrays, tolerance: float = 0.6) -> List[Tuple[int, int, int, float]]:
+    """Find the pairs of residues containing clashing atoms
+
+    :param arrays: the molecule
+    :type arrays: PeptideArrays
+    :param tolerance: the allowed overlap of the van der Waals spheres, in Angstroms
+    :type tolerance: float
+    :return: the residue numbers, the number of clashing atom pairs and the largest overlap, the worst first
+    :rtype: list of (int, int, int, float) tuples
+    """
+    pairs, overlaps = find_clashes(arrays, tolerance)
+    residues = {}
+    for (i, j), overlap in zip(pairs.tolist(), overlaps.tolist()):
+        key = tuple(sorted([int(arrays.resi_number[i]), int(arrays.resi_number[j])]))
+        count, worst = residues.get(key, (0, 0.0))
+        residues[key] = (count + 1, max(worst, overlap))
+    return sorted([(r1, r2, count, worst) for (r1, r2), (count, worst) in residues.items()], key=lambda x: -x[3])
+
+
+def report_clashes(selection: str, tolerance: float = 0.6, quiet: bool = False) -> List[Tuple[int, int, int, float]]:
+    """Check a selection for clashes and print the offending residue pairs
+
+    :param selection: the selection
+    :type selection: str
+    :param tolerance: the allowed overlap of the van der Waals spheres, in Angstroms
+    :type tolerance: float
+    :param quiet: do not print anything
+    :type quiet: bool
+    :return: the clashing residue pairs, see :func:`clashing_residues`
+    :rtype: list of (int, int, int, float) tuples
+    """
+    arrays = PeptideArrays.fromSelection(selection)
+    residues = clashing_residues(arrays, tolerance)
+    if not quiet:
+        if not residues:
+            print('No clashes found in {}'.format(selection))
+        else:
+            resnames = dict(zip(arrays.resi_number.tolist(), arrays.resn.tolist()))
+            print('{} clashing residue pairs in {}:'.format(len(residues), selection))
+            for r1, r2, count, worst in residues:
+                print('    {}{} - {}{}: {} atom pairs, max. overlap {:.2f} A'.format(
+                    resnames[r1], r1, resnames[r2], r2, count, worst))
+    return residues
+
+
+def check_clashes(selection='all', tolerance=0.6, quiet=0, _self=None):
+    """
+    DESCRIPTION
+
+        Find steric clashes, i.e. atoms whose van der Waals spheres overlap
+
+    USAGE
+
+        check_clashes [selection [, tolerance [, quiet]]]
+
+    ARGUMENTS
+
+        selection = str: the atoms to check (default: all)
+
+        tolerance = float: the allowed overlap in Angstroms (default: 0.6)
+
+        quiet = 0 or 1: do not print the clashing residue pairs
+
+    NOTES
+
+        Atoms separated by at most three bonds (1-2, 1-3 and 1-4 pairs) are
+        not considered. Clashing residue pairs are reported with the number
+        of clashing atom pairs and the largest overlap.
+    """
+    return report_clashes(selection, float(tolerance), bool(int(quiet)))
+
+
+if cmd is not None:
+    cmd.extend('check_clashes', check_clashes)
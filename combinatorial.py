@@ -0,0 +1,240 @@
+"""Enumerate and build combinatorial libraries of peptide sequences
+
+Patterns extend the sequence markup of :meth:`pmlbeta.betafab2.BetaPeptide.parseBetaPeptideSequence` by alternatives:
+any part of a residue can be replaced by a group of alternatives, separated by '|' and enclosed in parentheses,
+brackets or curly braces, e.g.::
+
+    (R|S)B3h(V|L|I){H14M|H12P}, (2(R|S)3(R|S))B23h(2A3L), (S)(B3hV|AL)
+
+Parentheses of a group belong to the residue notation (and are kept) if they open the residue or follow 'B23h', as in
+the stereo descriptors of the first residue above. Otherwise, like the sidechains of the first residue, they only
+delimit the group and are dropped. Brackets and curly braces are always kept.
+
+Sequences are enumerated lazily, varying the last residue fastest. Consecutive sequences thus share the longest
+possible N-terminal prefix, which the builder needs to build only once. Neither the enumeration nor the building
+keeps more than a chunk of sequences in memory.
+"""
+import itertools
+import logging
+import os
+import re
+import warnings
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from pymol import cmd
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    cmd = None
+
+from .betafab2 import BetaPeptide, betafab2_library
+from .batch import save_peptide
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# a group of alternatives: no nested delimiters inside, at least one '|'
+_GROUP = re.compile(r'(?P<open>[(\[{])(?P<alternatives>[^()\[\]{}|]*(?:\|[^()\[\]{}|]*)+)(?P<close>[)\]}])')
+_CLOSING = {'(': ')', '[': ']', '{': '}'}
+
+
+def split_pattern(pattern: str) -> List[str]:
+    """Split a pattern to residues at the commas
+
+    :param pattern: the pattern
+    :type pattern: str
+    :return: the residue patterns
+    :rtype: list of str
+    """
+    return [p.strip() for p in pattern.split(',') if p.strip()]
+
+
+def expand_residue(pattern: str) -> List[str]:
+    """Get all residues matching a residue pattern
+
+    :param pattern: the residue pattern, e.g. '(R|S)B3h(V|L)'
+    :type pattern: str
+    :return: the concrete residues in the order of the alternatives, e.g. ['(R)B3hV', '(R)B3hL', '(S)B3hV', '(S)B3hL']
+    :rtype: list of str
+    :raises ValueError: if the delimiters of a group do not match or a residue cannot be parsed
+    """
+    pieces = []  # constant strings and lists of alternatives
+    position = 0
+    for m in _GROUP.finditer(pattern):
+        if _CLOSING[m['open']] != m['close']:
+            raise ValueError('Mismatched delimiters in pattern {} at position {}'.format(pattern, m.start()))
+        pieces.append(pattern[position:m.start()])
+        if m['open'] != '(' or m.start() == 0 or pattern[:m.start()].endswith('B23h'):
+            pieces.append([m['open'] + a.strip() + m['close'] for a in m['alternatives'].split('|')])
+        else:
+            pieces.append([a.strip() for a in m['alternatives'].split('|')])
+        position = m.end()
+    pieces.append(pattern[position:])
+    residues = [''.join(choice) for choice in itertools.product(*[[p] if isinstance(p, str) else p for p in pieces])]
+    for residue in residues:
+        parsed = BetaPeptide.parseBetaPeptideSequence(residue)
+        if len(parsed) != 1:
+            raise ValueError('Pattern {} does not describe a single residue: {}'.format(pattern, residue))
+        for sidechain in [parsed[0]['sidechain2'], parsed[0]['sidechain3']]:
+            if sidechain and sidechain not in BetaPeptide.SIDECHAINS:
+                raise ValueError('Unknown sidechain {} in residue {}'.format(sidechain, residue))
+    return residues
+
+
+def count_variants(pattern: str) -> int:
+    """Count the sequences matching a pattern, without enumerating them
+
+    :param pattern: the pattern
+    :type pattern: str
+    :return: the number of sequences
+    :rtype: int
+    """
+    count = 1
+    for residue in split_pattern(pattern):
+        count *= len(expand_residue(residue))
+    return count
+
+
+def enumerate_sequences(pattern: str) -> Iterator[str]:
+    """Enumerate the sequences matching a pattern, the last residue varying fastest
+
+    :param pattern: the pattern
+    :type pattern: str
+    :return: the sequences, residues separated by commas
+    :rtype: iterator of str
+    """
+    # only the alternatives of each position are stored, itertools.product() does not materialize the combinations
+    for residues in itertools.product(*[expand_residue(p) for p in split_pattern(pattern)]):
+        yield ', '.join(residues)
+
+
+def chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    """Cut an iterable into lists of at most `size` elements
+
+    :param iterable: the iterable
+    :type iterable: iterable
+    :param size: the maximum length of the chunks
+    :type size: int
+    :return: the chunks
+    :rtype: iterator of lists
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _writeModel(f, objname: str, fmt: str, imodel: int):
+    if fmt == 'pdb':
+        f.write('MODEL     {:>4d}\n'.format(imodel))
+        f.write(''.join(line + '\n' for line in cmd.get_str('pdb', 'model {}'.format(objname)).splitlines()
+                        if line.strip() and not line.startswith('END')))
+        f.write('ENDMDL\n')
+    else:
+        f.write(cmd.get_str(fmt, 'model {}'.format(objname)))
+
+
+def build_variants(pattern: str, output: str, fmt: Optional[str] = None, chunksize: int = 64,
+                   prefix: str = 'variant', limit: Optional[int] = None) -> Tuple[int, int]:
+    """Build all sequences matching a pattern and write them to disk
+
+    The sequences are built in chunks by :func:`pmlbeta.betafab2.betafab2_library`, and deleted from PyMOL after
+    they have been written.
+
+    :param pattern: the pattern
+    :type pattern: str
+    :param output: a multi-model file (e.g. 'variants.pdb') or, if `fmt` is given, a directory. The latter is needed
+        for single-structure formats like .gro, .g96 and .crd.
+    :type output: str
+    :param fmt: the file format in the output directory, e.g. 'pdb', 'gro', 'g96' or 'crd'. If None, `output` is a
+        multi-model file in the format given by its extension
+    :type fmt: str or None
+    :param chunksize: the number of sequences built at once
+    :type chunksize: int
+    :param prefix: the peptides are named <prefix><running number>
+    :type prefix: str
+    :param limit: stop after this many sequences
+    :type limit: int or None
+    :return: the number of sequences built and the number of residue builds saved by sharing prefixes
+    :rtype: tuple of two ints
+    """
+    total = count_variants(pattern)
+    if limit is not None:
+        total = min(total, limit)
+    namefmt = '{}{{:0{}d}}'.format(prefix, len(str(total)))
+    numbered = enumerate(itertools.islice(enumerate_sequences(pattern), total), start=1)
+    if fmt is None:
+        multimodelfmt = os.path.splitext(output)[1][1:].lower()
+        f = open(output, 'wt')
+    else:
+        multimodelfmt = None
+        os.makedirs(output, exist_ok=True)
+        f = None
+    built = saved = 0
+    try:
+        for chunk in chunks(numbered, chunksize):
+            names = {namefmt.format(i): sequence for i, sequence in chunk}
+            stats = betafab2_library({name: split_pattern(sequence) for name, sequence in names.items()})
+            saved += stats['saved']
+            for i, name in enumerate(names, start=built + 1):
+                if f is not None:
+                    _writeModel(f, name, multimodelfmt, i)
+                else:
+                    save_peptide(os.path.join(output, '{}.{}'.format(name, fmt)), name)
+                cmd.delete('model {}'.format(name))
+            built += len(names)
+            logger.debug('Built {} of {} sequences'.format(built, total))
+    finally:
+        if f is not None:
+            f.close()
+    return built, saved
+
+
+def betafab2_enumerate(pattern, output, fmt=None, chunksize=64, prefix='variant', limit=None, _self=None):
+    """
+    DESCRIPTION
+
+        Build all peptides matching a sequence pattern with alternatives
+
+    USAGE
+
+        betafab2_enumerate pattern, output [, fmt [, chunksize [, prefix [, limit]]]]
+
+    ARGUMENTS
+
+        pattern = str: a sequence in the markup of the betafab2 command, where
+            parts of residues can be replaced by alternatives separated by '|',
+            e.g. "ACE, (R|S)B3h(V|L|I){H14M}, (2(R|S)3(R|S))B23h(2A3L){H14M}".
+            Enclose the pattern in quotes, as it contains commas.
+
+        output = str: a multi-model file (.pdb, .sdf, .mol2, ...) or, if fmt
+            is given, a directory to write each structure into
+
+        fmt = str: the format of the files in the output directory, e.g. pdb,
+            gro, g96 or crd
+
+        chunksize = int: the number of peptides built at once (default: 64)
+
+        prefix = str: the peptides are named <prefix><running number>
+
+        limit = int: build at most this many peptides
+
+    NOTES
+
+        The peptides are not kept in the PyMOL session.
+
+    SEE ALSO
+
+        betafab2, betafab2_batch
+    """
+    built, saved = build_variants(pattern, output, fmt, int(chunksize), prefix,
+                                  int(limit) if limit is not None else None)
+    print('Built {} peptides into {}, {} residue builds saved by sharing prefixes'.format(built, output, saved))
+    return built
+
+
+if cmd is not None:
+    cmd.extend('betafab2_enumerate', betafab2_enumerate)
@@ -0,0 +1,187 @@
+"""Mirror images of peptides
+
+The enantiomer of a peptide is made by reflecting its coordinates through a plane, which inverts every stereocentre
+and negates every dihedral angle at once, without rebuilding anything. The sequence recorded with the object (see
+:func:`pmlbeta.betafab2.store_sequence`) is mirrored as well: R and S (L and D for alpha-amino acids) are swapped,
+explicit backbone dihedrals are negated and secondary structure names are replaced by the entry of the secondary
+structure database with the negated dihedrals, e.g. H14M by H14P.
+"""
+import logging
+import warnings
+from typing import Dict, Optional
+
+try:
+    from pymol import cmd
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    cmd = None
+
+from .betafab2 import RESIDUE_GRAMMAR, store_sequence, stored_sequence
+from .secstructdb import SecondaryStructureDB
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# the normals of the mirror planes
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+_MIRRORED_DESCRIPTORS = str.maketrans('RSLD', 'SRDL')
+
+
+def _sameDihedrals(dihedrals1: tuple, dihedrals2: tuple, tolerance: float = 1e-3) -> bool:
+    return len(dihedrals1) == len(dihedrals2) and all(
+        (d1 is None and d2 is None) or (d1 is not None and d2 is not None and abs(d1 - d2) < tolerance)
+        for d1, d2 in zip(dihedrals1, dihedrals2))
+
+
+def mirror_residue(residue: str, sstypes: Optional[Dict[str, tuple]] = None) -> str:
+    """Get the designation of the mirror image of a residue
+
+    :param residue: the residue, in the markup of :meth:`pmlbeta.betafab2.BetaPeptide.parseBetaPeptideSequence`
+    :type residue: str
+    :param sstypes: the secondary structure database, as returned by :meth:`SecondaryStructureDB.getAll`. If not
+        given, it is read from the PyMOL preferences when needed.
+    :type sstypes: dict or None
+    :return: the mirrored residue in the same markup
+    :rtype: str
+    :raises ValueError: if the residue cannot be interpreted
+    """
+    residue = residue.strip()
+    m = RESIDUE_GRAMMAR.match(residue)
+    if not m:
+        raise ValueError('Invalid amino-acid designation: {}'.format(residue))
+    designation = m.group(1)
+    if designation.startswith('('):
+        # only the first parentheses hold stereo descriptors, the second ones of beta2,3-residues the side chains
+        end = designation.index(')')
+        designation = designation[:end].translate(_MIRRORED_DESCRIPTORS) + designation[end:]
+    if m['ssname'] is not None:
+        if sstypes is None:
+            sstypes = SecondaryStructureDB.getAll()
+        try:
+            mirrored = tuple(None if d is None else -d for d in sstypes[m['ssname']])
+        except KeyError:
+            raise ValueError('Unknown secondary structure: {}'.format(m['ssname']))
+        for name, dihedrals in sstypes.items():
+            if _sameDihedrals(mirrored, tuple(dihedrals)):
+                return '{}{{{}}}'.format(designation, name)
+        # no entry for the mirror image, give the dihedrals explicitly
+        dihedrals = [d for d in mirrored if d is not None]
+    elif m['phi'] is not None:
+        dihedrals = [-float(m[g]) for g in ['phi', 'theta', 'psi'] if m[g] is not None]
+    else:
+        return designation
+    return '{}[{}]'.format(designation, ' '.join(str(d + 0.0) for d in dihedrals))
+
+
+def mirror_sequence(sequence: str, sstypes: Optional[Dict[str, tuple]] = None) -> str:
+    """Get the sequence of the mirror image of a peptide
+
+    :param sequence: comma-separated residues, in the markup of
+        :meth:`pmlbeta.betafab2.BetaPeptide.parseBetaPeptideSequence`
+    :type sequence: str
+    :param sstypes: the secondary structure database, as returned by :meth:`SecondaryStructureDB.getAll`. If not
+        given, it is read from the PyMOL preferences when needed.
+    :type sstypes: dict or None
+    :return: the mirrored sequence
+    :rtype: str
+    :raises ValueError: if a residue cannot be interpreted
+    """
+    if (sstypes is None) and ('{' in sequence):
+        # read the database only once
+        sstypes = SecondaryStructureDB.getAll()
+    mirrored = {}
+    for residue in sequence.split(','):
+        # sequences are highly repetitive: mirror each distinct residue once
+        residue = residue.strip()
+        if residue not in mirrored:
+            mirrored[residue] = mirror_residue(residue, sstypes)
+    return ', '.join(mirrored[residue.strip()] for residue in sequence.split(','))
+
+
+def mirror_object(objname: str, axis: str = 'x'):
+    """Reflect all coordinates of an object through a plane
+
+    The plane goes through the centre of the first state, thus the object stays in place. Each state is reflected in a
+    single array operation.
+
+    :param objname: the name of the object
+    :type objname: str
+    :param axis: the normal of the plane: 'x', 'y' or 'z'
+    :type axis: str
+    :raises ValueError: if the object does not exist or the axis is invalid
+    """
+    try:
+        k = AXES[axis]
+    except KeyError:
+        raise ValueError('Invalid axis: {}'.format(axis))
+    if objname not in cmd.get_object_list():
+        raise ValueError('No such object: {}'.format(objname))
+    selection = 'model {}'.format(objname)
+    centre = None
+    for state in range(1, cmd.count_states(selection) + 1):
+        coords = cmd.get_coords(selection, state)
+        if coords is None:
+            continue
+        if centre is None:
+            centre = coords[:, k].mean()
+        coords[:, k] = 2 * centre - coords[:, k]
+        cmd.load_coords(coords, selection, state=state)
+
+
+def enantiomer(objname, newname='', axis='x', quiet=0, _self=None):
+    """
+    DESCRIPTION
+
+        Make the mirror image of a peptide
+
+    USAGE
+
+        enantiomer objname [, newname [, axis [, quiet]]]
+
+    ARGUMENTS
+
+        objname = str: the object to mirror
+
+        newname = str: the name of the mirror image. If not given, the
+            object is mirrored in place.
+
+        axis = x, y or z: the normal of the mirror plane, which goes through
+            the centre of the object (default: x)
+
+        quiet = 0 or 1: do not print the mirrored sequence
+
+    NOTES
+
+        The coordinates are reflected, thus all stereocentres are inverted
+        and all dihedral angles change sign. If the object was built by
+        betafab2, the sequence recorded with it is mirrored as well: R and S
+        (L and D) are swapped, explicit dihedrals are negated and secondary
+        structures are replaced by their mirror images, e.g. H14M by H14P.
+
+    SEE ALSO
+
+        betafab2
+    """
+    sequence = stored_sequence(objname) if objname in cmd.get_object_list() else None
+    if sequence is not None:
+        # fail before anything is changed
+        sequence = mirror_sequence(sequence)
+    if newname:
+        if objname not in cmd.get_object_list():
+            raise ValueError('No such object: {}'.format(objname))
+        cmd.delete('model {}'.format(newname))
+        cmd.copy(newname, objname, zoom=0)
+    else:
+        newname = objname
+    mirror_object(newname, axis)
+    if sequence is not None:
+        store_sequence(newname, [sequence])
+        if not int(quiet):
+            print('Mirrored sequence: {}'.format(sequence))
+    return sequence
+
+
+if cmd is not None:
+    cmd.extend('enantiomer', enantiomer)
@@ -0,0 +1,116 @@
+"""An in-memory store of the molecular fragments shipped in the resource directory
+
+The backbone, the peptide bond mould, the butyrate and cyclic residues and some special side chains are stored as
+pickled ChemPy models. Each is read from disk on first use only and kept in memory: new PyMOL objects are created from
+the cached model, without accessing the file system again.
+"""
+import logging
+import os
+import warnings
+from typing import Dict
+
+try:
+    from pymol import cmd
+    import chempy.models
+    from chempy import io
+    import pymol.plugins
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    cmd = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def resource_directory() -> str:
+    """Get the directory containing the fragment files shipped with this plugin
+
+    :return: the path of the resource directory
+    :rtype: str
+    """
+    try:
+        return os.path.join(os.path.split(pymol.plugins.plugins['pmlbeta'].filename)[0], 'resource')
+    except KeyError:
+        # not registered as a plugin, e.g. when used from a Python script
+        return os.path.join(os.path.split(__file__)[0], 'resource')
+
+
+class FragmentLibrary:
+    """Fragments of a resource directory, each loaded once and cached as a ChemPy model
+
+    A fragment named `name` is read from the file `<directory>/<name>.pkl`.
+    """
+    _default = None
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._models = {}  # type: Dict[str, chempy.models.Indexed]
+
+    @classmethod
+    def default(cls) -> "FragmentLibrary":
+        """Get the fragments shipped with this plugin"""
+        if cls._default is None:
+            cls._default = cls(resource_directory())
+        return cls._default
+
+    def filename(self, name: str) -> str:
+        """The file a fragment is read from
+
+        :param name: the name of the fragment
+        :type name: str
+        :return: the path of the file
+        :rtype: str
+        """
+        return os.path.join(self.directory, '{}.pkl'.format(name))
+
+    def __contains__(self, name: str) -> bool:
+        return (name in self._models) or os.path.isfile(self.filename(name))
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def model(self, name: str) -> "chempy.models.Indexed":
+        """Get the cached model of a fragment, reading it on first use
+
+        The model is shared between all callers: do not modify it.
+
+        :param name: the name of the fragment
+        :type name: str
+        :return: the model
+        :rtype: chempy.models.Indexed
+        :raises KeyError: if the fragment does not exist
+        """
+        try:
+            return self._models[name]
+        except KeyError:
+            pass
+        try:
+            model = io.pkl.fromFile(self.filename(name))
+        except IOError:
+            raise KeyError('Unknown fragment: {}'.format(name))
+        logger.debug('Loaded fragment {} from {}'.format(name, self.filename(name)))
+        self._models[name] = model
+        return model
+
+    def load(self, name: str, objectname: str) -> str:
+        """Create a PyMOL object from a fragment
+
+        This is equivalent to loading the fragment file by :func:`pymol.cmd.load`: if the object already exists, the
+        fragment is added as a new state.
+
+        :param name: the name of the fragment
+        :type name: str
+        :param objectname: the name of the PyMOL object
+        :type objectname: str
+        :return: the name of the object
+        :rtype: str
+        :raises KeyError: if the fragment does not exist
+        """
+        # discrete=-1 is the default of cmd.load(), it keeps the atom order of the file
+        cmd.load_model(self.model(name), objectname, discrete=-1)
+        return objectname
+
+    def clear(self):
+        """Forget all cached models, e.g. after the fragment files have been changed"""
+        self._models.clear()
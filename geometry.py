@@ -0,0 +1,391 @@
+"""Vectorized geometry primitives working on NumPy coordinate arrays
+
+All functions accept arrays of shape (..., 3) and operate along the last axis, thus many bonds, angles or dihedrals
+can be handled in a single call. Angles are expressed in degrees, following the PyMOL conventions.
+"""
+import itertools
+from typing import List, Set, Tuple
+
+import numpy as np
+
+
+def _normalize(v: np.ndarray) -> np.ndarray:
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+def bond_lengths(p0: np.ndarray, p1: np.ndarray) -> np.ndarray:
+    """Calculate distances between pairs of points
+
+    :param p0: coordinates of the first atoms
+    :type p0: np.ndarray of shape (..., 3)
+    :param p1: coordinates of the second atoms
+    :type p1: np.ndarray of shape (..., 3)
+    :return: the distances
+    :rtype: np.ndarray of shape (...)
+    """
+    return np.linalg.norm(np.asarray(p1, dtype=float) - np.asarray(p0, dtype=float), axis=-1)
+
+
+def bond_angles(p0: np.ndarray, p1: np.ndarray, p2: np.ndarray) -> np.ndarray:
+    """Calculate the angles p0-p1-p2 (p1 being the vertex)
+
+    :param p0: coordinates of the first atoms
+    :type p0: np.ndarray of shape (..., 3)
+    :param p1: coordinates of the vertex atoms
+    :type p1: np.ndarray of shape (..., 3)
+    :param p2: coordinates of the third atoms
+    :type p2: np.ndarray of shape (..., 3)
+    :return: the angles in degrees
+    :rtype: np.ndarray of shape (...)
+    """
+    v0 = _normalize(np.asarray(p0, dtype=float) - p1)
+    v2 = _normalize(np.asarray(p2, dtype=float) - p1)
+    return np.degrees(np.arccos(np.clip((v0 * v2).sum(axis=-1), -1.0, 1.0)))
+
+
+def dihedral_angles(p0: np.ndarray, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray) -> np.ndarray:
+    """Calculate the dihedral angles p0-p1-p2-p3, using the same sign convention as :func:`pymol.cmd.get_dihedral`
+
+    :param p0: coordinates of the first atoms
+    :type p0: np.ndarray of shape (..., 3)
+    :param p1: coordinates of the second atoms
+    :type p1: np.ndarray of shape (..., 3)
+    :param p2: coordinates of the third atoms
+    :type p2: np.ndarray of shape (..., 3)
+    :param p3: coordinates of the fourth atoms
+    :type p3: np.ndarray of shape (..., 3)
+    :return: the dihedral angles in degrees, in the interval [-180, 180]
+    :rtype: np.ndarray of shape (...)
+    """
+    p0, p1, p2, p3 = [np.asarray(p, dtype=float) for p in (p0, p1, p2, p3)]
+    b0 = p0 - p1
+    b1 = _normalize(p2 - p1)
+    b2 = p3 - p2
+    # project b0 and b2 on the plane perpendicular to b1
+    v = b0 - (b0 * b1).sum(axis=-1, keepdims=True) * b1
+    w = b2 - (b2 * b1).sum(axis=-1, keepdims=True) * b1
+    x = (v * w).sum(axis=-1)
+    y = (np.cross(b1, v) * w).sum(axis=-1)
+    return np.degrees(np.arctan2(y, x))
+
+
+def nerf(a: np.ndarray, b: np.ndarray, c: np.ndarray, bond: np.ndarray, angle: np.ndarray,
+         dihedral: np.ndarray) -> np.ndarray:
+    """Place atoms from internal coordinates (Natural Extension Reference Frame)
+
+    The new atom X is placed such that the bond length X-a, the angle X-a-b and the dihedral angle X-a-b-c
+    attain the requested values.
+
+    :param a: coordinates of the atoms bonded to the new ones
+    :type a: np.ndarray of shape (..., 3)
+    :param b: coordinates of the second reference atoms
+    :type b: np.ndarray of shape (..., 3)
+    :param c: coordinates of the third reference atoms
+    :type c: np.ndarray of shape (..., 3)
+    :param bond: bond lengths
+    :type bond: np.ndarray of shape (...)
+    :param angle: bond angles in degrees
+    :type angle: np.ndarray of shape (...)
+    :param dihedral: dihedral angles in degrees
+    :type dihedral: np.ndarray of shape (...)
+    :return: the coordinates of the new atoms
+    :rtype: np.ndarray of shape (..., 3)
+    """
+    a, b, c = [np.asarray(p, dtype=float) for p in (a, b, c)]
+    theta = np.radians(angle)[..., np.newaxis]
+    phi = np.radians(dihedral)[..., np.newaxis]
+    bond = np.asarray(bond, dtype=float)[..., np.newaxis]
+    bc = _normalize(a - b)
+    n = _normalize(np.cross(b - c, bc))
+    m = np.cross(n, bc)
+    return a + bond * (-np.cos(theta) * bc + np.sin(theta) * np.cos(phi) * m + np.sin(theta) * np.sin(phi) * n)
+
+
+def kabsch(mobile: np.ndarray, target: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float]:
+    """Find the rigid-body transformation which superimposes `mobile` on `target` in the least-squares sense
+
+    The transformation is found in closed form (Kabsch algorithm), without iterations. Apply it to coordinates as
+    ``coords @ rotation.T + translation``.
+
+    :param mobile: coordinates of the atoms to be moved
+    :type mobile: np.ndarray of shape (N, 3)
+    :param target: coordinates of the stationary atoms
+    :type target: np.ndarray of shape (N, 3)
+    :return: the rotation matrix, the translation vector and the RMSD after the superposition
+    :rtype: tuple of (np.ndarray of shape (3, 3), np.ndarray of shape (3,), float)
+    """
+    mobile = np.asarray(mobile, dtype=float)
+    target = np.asarray(target, dtype=float)
+    if mobile.shape != target.shape:
+        raise ValueError('Coordinate sets of different shapes cannot be superimposed: {} and {}'.format(
+            mobile.shape, target.shape))
+    mobile_center = mobile.mean(axis=0)
+    target_center = target.mean(axis=0)
+    u, s, vt = np.linalg.svd((mobile - mobile_center).T @ (target - target_center))
+    # avoid improper rotations (reflections)
+    d = np.sign(np.linalg.det(vt.T @ u.T))
+    if d == 0:
+        d = 1.0
+    rotation = vt.T @ np.diag([1.0, 1.0, d]) @ u.T
+    translation = target_center - mobile_center @ rotation.T
+    rmsd = float(np.sqrt(((mobile @ rotation.T + translation - target) ** 2).sum(axis=-1).mean()))
+    return rotation, translation, rmsd
+
+
+def rotate_about_axis(points: np.ndarray, origin: np.ndarray, axis: np.ndarray, angle: np.ndarray) -> np.ndarray:
+    """Rotate sets of points around axes, by Rodrigues' formula
+
+    :param points: the points to rotate
+    :type points: np.ndarray of shape (..., M, 3)
+    :param origin: a point on each axis
+    :type origin: np.ndarray of shape (..., 3)
+    :param axis: the directions of the axes, need not be normalized
+    :type axis: np.ndarray of shape (..., 3)
+    :param angle: the angles of right-handed rotation in degrees
+    :type angle: np.ndarray of shape (...)
+    :return: the rotated points
+    :rtype: np.ndarray of shape (..., M, 3)
+    """
+    origin = np.asarray(origin, dtype=float)[..., np.newaxis, :]
+    k = _normalize(np.asarray(axis, dtype=float))[..., np.newaxis, :]
+    angle = np.radians(np.asarray(angle, dtype=float))[..., np.newaxis, np.newaxis]
+    v = np.asarray(points, dtype=float) - origin
+    c, s = np.cos(angle), np.sin(angle)
+    return origin + v * c + np.cross(k, v) * s + k * (k * v).sum(axis=-1, keepdims=True) * (1 - c)
+
+
+def _rotationMatrix(axis: np.ndarray, angle: float) -> np.ndarray:
+    """Rotation matrix for a right-handed rotation around a unit vector, the angle given in degrees"""
+    x, y, z = axis
+    c = np.cos(np.radians(angle))
+    s = np.sin(np.radians(angle))
+    t = 1 - c
+    return np.array([[t * x * x + c, t * x * y - s * z, t * x * z + s * y],
+                     [t * x * y + s * z, t * y * y + c, t * y * z - s * x],
+                     [t * x * z - s * y, t * y * z + s * x, t * z * z + c]])
+
+
+def _spanningForest(neighbours: List[List[int]], roots: List[int]) -> Tuple[np.ndarray, ...]:
+    """Depth-first spanning forest of a molecular graph
+
+    :return: the atoms in preorder, the preorder position, the parent (-1 for roots), the end of the subtree in
+        preorder, the first and last+1 preorder positions of the connected component and the lowest preorder position
+        reachable from the subtree through at most one non-tree bond (for finding bridges), all indexed by atom
+    """
+    natoms = len(neighbours)
+    position = np.full(natoms, -1, dtype=int)
+    parent = np.full(natoms, -1, dtype=int)
+    order = []
+    componentstart = np.zeros(natoms, dtype=int)
+    componentend = np.zeros(natoms, dtype=int)
+    for root in itertools.chain(roots, range(natoms)):
+        if position[root] >= 0:
+            continue
+        first = len(order)
+        stack = [(root, -1)]
+        while stack:
+            atom, up = stack.pop()
+            if position[atom] >= 0:
+                continue
+            position[atom] = len(order)
+            parent[atom] = up
+            order.append(atom)
+            stack.extend((n, atom) for n in reversed(neighbours[atom]) if position[n] < 0)
+        componentstart[order[first:]] = first
+        componentend[order[first:]] = len(order)
+    size = np.ones(natoms, dtype=int)
+    low = position.copy()
+    for atom in reversed(order):
+        for n in neighbours[atom]:
+            if n != parent[atom]:
+                low[atom] = min(low[atom], low[n] if parent[n] == atom else position[n])
+        if parent[atom] >= 0:
+            size[parent[atom]] += size[atom]
+    return np.array(order, dtype=int), position, parent, position + size, componentstart, componentend, low
+
+
+def set_dihedral_angles(coords: np.ndarray, bonds: np.ndarray, torsions: np.ndarray,
+                        values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Set many dihedral angles in one pass, the same way as successive calls to :func:`pymol.cmd.set_dihedral` would
+
+    For each torsion a-b-c-d, the part of the molecule on the side of c is rotated around the b-c bond. If that bond
+    is in a ring, the whole molecule is rotated, like PyMOL does, leaving the dihedral angle unchanged. The atoms are
+    reordered along a depth-first spanning tree, making each rotated part a contiguous block of the coordinate array,
+    thus every dihedral change is a single rigid-body transformation on the coordinates already transformed by the
+    previous ones.
+
+    :param coords: the atomic coordinates
+    :type coords: np.ndarray of shape (N, 3)
+    :param bonds: pairs of bonded atom indices
+    :type bonds: np.ndarray of shape (M, 2)
+    :param torsions: the indices of the atoms a, b, c and d for each dihedral angle
+    :type torsions: np.ndarray of shape (T, 4)
+    :param values: the desired dihedral angles in degrees
+    :type values: np.ndarray of shape (T,)
+    :return: the new coordinates and a boolean mask telling which dihedrals could be set (b-c must be a bond)
+    :rtype: tuple of (np.ndarray of shape (N, 3), np.ndarray of shape (T,))
+    """
+    coords = np.asarray(coords, dtype=float)
+    torsions = np.asarray(torsions, dtype=int).reshape(-1, 4)
+    neighbours = [[] for i in range(len(coords))]
+    for i, j in np.asarray(bonds, dtype=int).reshape(-1, 2):
+        if i != j and j not in neighbours[i]:
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+    order, position, parent, end, componentstart, componentend, low = _spanningForest(
+        neighbours, [int(t[1]) for t in torsions[:1]])
+    x = coords[order]
+    applied = np.zeros(len(torsions), dtype=bool)
+    for i, ((a, b, c, d), value) in enumerate(zip(torsions, values)):
+        if c not in neighbours[b]:
+            continue
+        applied[i] = True
+        pa, pb, pc, pd = position[[a, b, c, d]]
+        if parent[c] == b and low[c] >= pc:
+            # bridge, c is below b in the tree: move the subtree of c
+            blocks = [(pc, end[c])]
+        elif parent[b] == c and low[b] >= pb:
+            # bridge, b is below c in the tree: move everything in the component but the subtree of b
+            blocks = [(componentstart[b], pb), (end[b], componentend[b])]
+        else:
+            # ring bond: the whole component is moved
+            blocks = [(componentstart[b], componentend[b])]
+        delta = value - float(dihedral_angles(x[pa], x[pb], x[pc], x[pd]))
+        rotation = _rotationMatrix(_normalize(x[pc] - x[pb]), delta)
+        origin = x[pb].copy()
+        for first, last in blocks:
+            x[first:last] = (x[first:last] - origin) @ rotation.T + origin
+    result = np.empty_like(x)
+    result[order] = x
+    return result, applied
+
+
+def signed_volumes(centres: np.ndarray, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray) -> np.ndarray:
+    """Calculate the signed volumes (times six) of the tetrahedra spanned by centres and three of their substituents
+
+    The sign tells the handedness of the substituents around the centre: it changes if the configuration is inverted.
+
+    :param centres: coordinates of the central atoms
+    :type centres: np.ndarray of shape (..., 3)
+    :param p1: coordinates of the first substituents
+    :type p1: np.ndarray of shape (..., 3)
+    :param p2: coordinates of the second substituents
+    :type p2: np.ndarray of shape (..., 3)
+    :param p3: coordinates of the third substituents
+    :type p3: np.ndarray of shape (..., 3)
+    :return: the signed volumes
+    :rtype: np.ndarray of shape (...)
+    """
+    c = np.asarray(centres, dtype=float)
+    u, v, w = [np.moveaxis(np.asarray(p, dtype=float) - c, -1, 0) for p in (p1, p2, p3)]
+    # the triple product, written out: np.cross() has a large overhead on small arrays
+    return u[0] * (v[1] * w[2] - v[2] * w[1]) + u[1] * (v[2] * w[0] - v[0] * w[2]) + u[2] * (v[0] * w[1] - v[1] * w[0])
+
+
+def stereo_descriptors(coords: np.ndarray, centres: np.ndarray, substituents: np.ndarray) -> np.ndarray:
+    """Determine the absolute configuration (R or S) of stereocentres
+
+    :param coords: the atomic coordinates
+    :type coords: np.ndarray of shape (N, 3)
+    :param centres: indices of the stereocentres
+    :type centres: np.ndarray of shape (K,)
+    :param substituents: indices of the substituents of each centre, in decreasing order of CIP priority
+    :type substituents: np.ndarray of shape (K, 4)
+    :return: 'R' or 'S' for each centre
+    :rtype: np.ndarray of shape (K,)
+    """
+    coords = np.asarray(coords, dtype=float)
+    centres = np.asarray(centres, dtype=int).reshape(-1)
+    substituents = np.asarray(substituents, dtype=int).reshape(-1, 4)
+    # seen from the side opposite to the lowest-ranking substituent, 1 -> 2 -> 3 turns clockwise for R, giving a
+    # negative volume
+    volumes = signed_volumes(coords[centres], coords[substituents[:, 0]], coords[substituents[:, 1]],
+                             coords[substituents[:, 2]])
+    return np.where(volumes < 0, 'R', 'S')
+
+
+def _branches(neighbours: List[List[int]], centre: int, anchors: Tuple[int, int]) -> Set[int]:
+    """The atoms moved on inverting a stereocentre: all atoms connected to the centre not through its anchors"""
+    for a in anchors:
+        if a not in neighbours[centre]:
+            raise ValueError('Atom {} is not bonded to the stereocentre {}'.format(a, centre))
+    seen = {centre}
+    stack = [n for n in neighbours[centre] if n not in anchors]
+    while stack:
+        atom = stack.pop()
+        if atom in seen:
+            continue
+        if atom in anchors:
+            raise ValueError('Stereocentre {} cannot be inverted: its anchor {} is in a ring with a moving '
+                             'substituent'.format(centre, atom))
+        seen.add(atom)
+        stack.extend(n for n in neighbours[atom] if n not in seen)
+    seen.remove(centre)
+    return seen
+
+
+def invert_stereocentres(coords: np.ndarray, bonds: np.ndarray, centres: np.ndarray,
+                         anchors: np.ndarray) -> np.ndarray:
+    """Invert many stereocentres, the same way as successive calls to :func:`pymol.cmd.invert` would
+
+    Two substituents of each centre (the anchors) stay in place. The other two are swapped by reflecting their
+    positions through the plane of the anchors and the centre. Their whole branches are moved with them by a rotation
+    of 180 degrees around the bisector of the two anchor bonds, which is the same as the reflection for the
+    substituent atoms, but keeps the geometry and the chirality within the branches. Centres not interfering with each
+    other are inverted together in one array operation, and the change of sign of the signed volume of each centre is
+    verified.
+
+    :param coords: the atomic coordinates
+    :type coords: np.ndarray of shape (N, 3)
+    :param bonds: pairs of bonded atom indices
+    :type bonds: np.ndarray of shape (M, 2)
+    :param centres: indices of the stereocentres
+    :type centres: np.ndarray of shape (K,)
+    :param anchors: indices of the two substituents of each centre which stay in place
+    :type anchors: np.ndarray of shape (K, 2)
+    :return: the new coordinates
+    :rtype: np.ndarray of shape (N, 3)
+    :raises ValueError: if an anchor is not bonded to its centre, an anchor is in a ring with a moving substituent or
+        a centre has no moving substituent in a general position
+    """
+    x = np.array(coords, dtype=float)
+    centres = np.asarray(centres, dtype=int).reshape(-1)
+    anchors = np.asarray(anchors, dtype=int).reshape(-1, 2)
+    neighbours = [[] for i in range(len(x))]
+    for i, j in np.asarray(bonds, dtype=int).reshape(-1, 2).tolist():
+        if i != j and j not in neighbours[i]:
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+    owned = [(c, (a1, a2)) for c, (a1, a2) in zip(centres.tolist(), anchors.tolist())]
+    branches = [_branches(neighbours, c, a) for c, a in owned]
+    # a moving substituent of each centre, for checking the signed volume
+    probes = np.array([([n for n in neighbours[c] if n not in a] or [c])[0] for c, a in owned], dtype=int)
+
+    first = 0
+    while first < len(centres):
+        # a round of centres which do not move each other's atoms, keeping the original order
+        moved, fixed = set(), set()
+        last = first
+        while last < len(centres):
+            own = {owned[last][0], *owned[last][1]}
+            if (own & moved) or (branches[last] & (moved | fixed)):
+                break
+            moved |= branches[last]
+            fixed |= own
+            last += 1
+        c = x[centres[first:last]]
+        a1, a2 = x[anchors[first:last, 0]], x[anchors[first:last, 1]]
+        before = signed_volumes(c, a1, a2, x[probes[first:last]])
+        if (np.abs(before) < 1e-6).any():
+            raise ValueError('Not a stereocentre: {}'.format(centres[first:last][np.abs(before) < 1e-6]))
+        axes = _normalize(_normalize(a1 - c) + _normalize(a2 - c))
+        owner = np.concatenate([np.full(len(branches[k]), k - first, dtype=int) for k in range(first, last)])
+        atoms = np.array([atom for k in range(first, last) for atom in sorted(branches[k])], dtype=int)
+        v = x[atoms] - c[owner]
+        x[atoms] = c[owner] + 2 * (v * axes[owner]).sum(axis=-1, keepdims=True) * axes[owner] - v
+        after = signed_volumes(c, a1, a2, x[probes[first:last]])
+        if (np.sign(after) == np.sign(before)).any():
+            raise RuntimeError('Inversion failed for stereocentre(s): {}'.format(
+                centres[first:last][np.sign(after) == np.sign(before)]))
+        first = last
+    return x
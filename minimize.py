@@ -0,0 +1,390 @@
+"""A fast force field minimiser for cleaning up built peptides
+
+Built or folded peptides may contain clashing sidechains, while their bond lengths and angles are those of the
+residue templates. The clean-up therefore keeps the covalent geometry and relieves the clashes, with a simple
+force field:
+
+    - harmonic bond stretching and angle bending terms, the reference values taken from the starting structure
+    - a purely repulsive Lennard-Jones term (the Weeks-Chandler-Andersen potential) between atoms separated by more
+      than three bonds, the contact distance derived from the van der Waals radii and shortened for hydrogen bonds
+
+The backbone atoms (see :func:`pmlbeta.utils.select_bbb`) and atoms flagged as fixed in PyMOL are kept in place. The
+energy is minimised by the limited-memory BFGS method with a backtracking line search. Non-bonded pairs come from a
+Verlet neighbour list, built with a cell list and only updated when an atom has moved more than half of the skin
+distance.
+
+All terms are evaluated on NumPy arrays, there is no loop over atoms.
+"""
+import logging
+import warnings
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+try:
+    from pymol import cmd
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    cmd = None
+
+from .clashes import HBOND_OVERLAP, bonded_pairs, neighbour_pairs, polar_atoms
+from .peptidearrays import PeptideArrays
+from .utils import BACKBONE_ATOMS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# the atom flag set by cmd.flag('fix', ...)
+FIXED_FLAG = 1 << 3
+
+
+def _accumulate(natoms: int, indices: List[np.ndarray], vectors: List[np.ndarray]) -> np.ndarray:
+    """Sum up vectors by atom index
+
+    :param natoms: the number of atoms
+    :type natoms: int
+    :param indices: atom indices
+    :type indices: list of arrays of ints
+    :param vectors: the vectors belonging to the indices
+    :type vectors: list of (n, 3) arrays of floats
+    :return: the sum of the vectors for each atom
+    :rtype: (natoms, 3) array of floats
+    """
+    flatindices = (3 * np.concatenate(indices)[:, np.newaxis] + np.arange(3)).ravel()
+    return np.bincount(flatindices, np.concatenate(vectors).ravel(), minlength=3 * natoms).reshape(natoms, 3)
+
+
+def repulsion_energies(distances: np.ndarray, contacts: np.ndarray, epsilon: float = 0.2) -> np.ndarray:
+    """The repulsive Lennard-Jones energies: the potential is cut at its minimum (the contact distance) and shifted up
+
+    :param distances: the interatomic distances, in A
+    :type distances: array of floats
+    :param contacts: the contact distances, in A
+    :type contacts: array of floats
+    :param epsilon: the depth of the Lennard-Jones potential, in kcal/mol
+    :type epsilon: float
+    :return: the energies, zero beyond the contact distance, in kcal/mol
+    :rtype: array of floats
+    """
+    x6 = (contacts / np.maximum(distances, 1e-3)) ** 6
+    return np.where(distances < contacts, epsilon * (x6 ** 2 - 2 * x6 + 1), 0.0)
+
+
+class ForceField:
+    """Bond, angle and repulsion terms of a molecule
+
+    The reference bond lengths and angles are those of the coordinates in `arrays`. Terms involving only fixed atoms
+    are left out, as they do not contribute to the forces on the movable ones.
+    """
+
+    def __init__(self, arrays: PeptideArrays, fixed: np.ndarray, kbond: float = 500.0, kangle: float = 100.0,
+                 epsilon: float = 0.2, overlap: float = 0.2, skin: float = 1.0):
+        """Set up the force field
+
+        :param arrays: the molecule, in the reference geometry
+        :type arrays: PeptideArrays
+        :param fixed: which atoms are kept in place
+        :type fixed: array of bools
+        :param kbond: the bond stretching force constant, in kcal/mol/A^2
+        :type kbond: float
+        :param kangle: the angle bending force constant, in kcal/mol/rad^2
+        :type kangle: float
+        :param epsilon: the depth of the Lennard-Jones potential, in kcal/mol
+        :type epsilon: float
+        :param overlap: the contact distance of two atoms is the sum of their van der Waals radii minus this, in A
+        :type overlap: float
+        :param skin: the neighbour list includes pairs up to this much farther than the contact distance, in A
+        :type skin: float
+        """
+        self.natoms = len(arrays)
+        self.fixed = np.asarray(fixed, dtype=bool)
+        self.kbond = kbond
+        self.kangle = kangle
+        self.epsilon = epsilon
+        self.skin = skin
+        coords = arrays.coords
+
+        self.bonds = arrays.bonds[~self.fixed[arrays.bonds].all(axis=1)]
+        self.bondlengths = self._bondLengths(coords)
+        self.angles = arrays.angles()
+        self.angles = self.angles[~self.fixed[self.angles].all(axis=1)]
+        self.anglevalues = self._angleValues(coords)[0]
+
+        self.radii = np.maximum(arrays.vdw.astype(float) - 0.5 * overlap, 0.1) if self.natoms else np.zeros(0)
+        self.polar, self.polarhydrogen = polar_atoms(arrays)
+        excluded = bonded_pairs(arrays, 3) if len(arrays.bonds) else np.zeros((0, 2), dtype=np.int64)
+        self.excluded = excluded[:, 0] * self.natoms + excluded[:, 1]  # sorted
+        self.pairs = np.zeros((0, 2), dtype=np.int64)
+        self.contacts = np.zeros(0)
+        self.listcoords = None
+
+    def _bondLengths(self, coords: np.ndarray) -> np.ndarray:
+        return np.linalg.norm(coords[self.bonds[:, 1]] - coords[self.bonds[:, 0]], axis=1)
+
+    def _angleValues(self, coords: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        u = coords[self.angles[:, 0]] - coords[self.angles[:, 1]]
+        v = coords[self.angles[:, 2]] - coords[self.angles[:, 1]]
+        lu = np.linalg.norm(u, axis=1)
+        lv = np.linalg.norm(v, axis=1)
+        cos = np.clip((u * v).sum(axis=1) / (lu * lv), -1.0, 1.0)
+        return np.arccos(cos), u, v
+
+    def contactDistances(self, pairs: np.ndarray) -> np.ndarray:
+        """Get the distances below which atom pairs repel each other
+
+        :param pairs: the atom pairs
+        :type pairs: (P, 2) array of ints
+        :return: the contact distances, in A
+        :rtype: array of P floats
+        """
+        hbonds = (self.polarhydrogen[pairs[:, 0]] & self.polar[pairs[:, 1]]) | \
+                 (self.polar[pairs[:, 0]] & self.polarhydrogen[pairs[:, 1]])
+        return self.radii[pairs].sum(axis=1) - HBOND_OVERLAP * hbonds
+
+    def isExcluded(self, pairs: np.ndarray) -> np.ndarray:
+        """Check if atom pairs are separated by at most three bonds
+
+        :param pairs: the atom pairs, the first index being smaller
+        :type pairs: (P, 2) array of ints
+        :return: which pairs are excluded from the repulsion
+        :rtype: array of P bools
+        """
+        keys = pairs[:, 0] * self.natoms + pairs[:, 1]
+        position = np.minimum(np.searchsorted(self.excluded, keys), max(len(self.excluded) - 1, 0))
+        return (self.excluded[position] == keys) if len(self.excluded) else np.zeros(len(keys), dtype=bool)
+
+    def updateNeighbourList(self, coords: np.ndarray, force: bool = False) -> bool:
+        """Rebuild the neighbour list if needed
+
+        :param coords: the current coordinates
+        :type coords: (N, 3) array of floats
+        :param force: rebuild even if no atom has moved farther than half of the skin
+        :type force: bool
+        :return: True if the list has been rebuilt
+        :rtype: bool
+        """
+        if (not force) and (self.listcoords is not None) and \
+                (((coords - self.listcoords) ** 2).sum(axis=1).max(initial=0) < (0.5 * self.skin) ** 2):
+            return False
+        if self.natoms < 2:
+            return False
+        pairs = neighbour_pairs(coords, 2 * self.radii.max() + self.skin)
+        pairs = pairs[~self.fixed[pairs].all(axis=1)]
+        pairs = pairs[~self.isExcluded(pairs)]
+        # keep only pairs which can come into contact before the next update
+        distances = np.linalg.norm(coords[pairs[:, 0]] - coords[pairs[:, 1]], axis=1)
+        contacts = self.contactDistances(pairs)
+        close = distances < contacts + self.skin
+        self.pairs, self.contacts = pairs[close], contacts[close]
+        self.listcoords = coords.copy()
+        return True
+
+    def energy(self, coords: np.ndarray) -> Tuple[float, np.ndarray]:
+        """Calculate the energy and its gradient
+
+        The neighbour list must be up to date, see :meth:`updateNeighbourList`.
+
+        :param coords: the coordinates
+        :type coords: (N, 3) array of floats
+        :return: the energy (kcal/mol) and its gradient (kcal/mol/A), zero for fixed atoms
+        :rtype: float and (N, 3) array of floats
+        """
+        # bond stretching
+        d = coords[self.bonds[:, 1]] - coords[self.bonds[:, 0]]
+        r = np.linalg.norm(d, axis=1)
+        dr = r - self.bondlengths
+        energy = self.kbond * (dr ** 2).sum()
+        g = (2 * self.kbond * dr / r)[:, np.newaxis] * d
+        indices, vectors = [self.bonds[:, 1], self.bonds[:, 0]], [g, -g]
+
+        # angle bending
+        theta, u, v = self._angleValues(coords)
+        dtheta = theta - self.anglevalues
+        energy += self.kangle * (dtheta ** 2).sum()
+        lu = np.linalg.norm(u, axis=1)[:, np.newaxis]
+        lv = np.linalg.norm(v, axis=1)[:, np.newaxis]
+        cos = np.cos(theta)[:, np.newaxis]
+        factor = (-2 * self.kangle * dtheta / np.maximum(np.sin(theta), 1e-8))[:, np.newaxis]
+        gu = factor * (v / (lu * lv) - cos * u / lu ** 2)
+        gv = factor * (u / (lu * lv) - cos * v / lv ** 2)
+        indices += [self.angles[:, 0], self.angles[:, 2], self.angles[:, 1]]
+        vectors += [gu, gv, -gu - gv]
+
+        # repulsion: Lennard-Jones, cut and shifted at its minimum
+        d = coords[self.pairs[:, 1]] - coords[self.pairs[:, 0]]
+        r = np.linalg.norm(d, axis=1)
+        close = r < self.contacts
+        d, r, x6 = d[close], r[close], (self.contacts[close] / r[close]) ** 6
+        energy += repulsion_energies(r, self.contacts[close], self.epsilon).sum()
+        g = (12 * self.epsilon * (x6 - x6 ** 2) / r ** 2)[:, np.newaxis] * d
+        indices += [self.pairs[close, 1], self.pairs[close, 0]]
+        vectors += [g, -g]
+
+        gradient = _accumulate(len(coords), indices, vectors)
+        gradient[self.fixed] = 0
+        return float(energy), gradient
+
+
+def _lbfgsDirection(gradient: np.ndarray, history: List[Tuple[np.ndarray, np.ndarray, float]]) -> np.ndarray:
+    """The L-BFGS search direction, by the two-loop recursion over the (s, y, 1 / y.s) pairs of the last steps"""
+    q = gradient.copy()
+    alphas = []
+    for s, y, rho in reversed(history):
+        alpha = rho * (s * q).sum()
+        q -= alpha * y
+        alphas.append(alpha)
+    if history:
+        s, y, rho = history[-1]
+        q /= rho * (y * y).sum()
+    for (s, y, rho), alpha in zip(history, reversed(alphas)):
+        q += (alpha - rho * (y * q).sum()) * s
+    return -q
+
+
+def minimize(arrays: PeptideArrays, fixed: np.ndarray, maxiter: int = 2000, gtol: float = 0.5,
+             maxstep: float = 0.3, memory: int = 10, **kwargs) -> Dict:
+    """Minimise the energy, updating the coordinates of `arrays` in place
+
+    :param arrays: the molecule
+    :type arrays: PeptideArrays
+    :param fixed: which atoms are kept in place
+    :type fixed: array of bools
+    :param maxiter: the maximum number of steps
+    :type maxiter: int
+    :param gtol: converged if no force component is larger than this, in kcal/mol/A
+    :type gtol: float
+    :param maxstep: the largest displacement of an atom in a single step, in A
+    :type maxstep: float
+    :param memory: the number of previous steps used for approximating the Hessian
+    :type memory: int
+    :param kwargs: parameters of the force field, see :class:`ForceField`
+    :return: the initial and final energies, the number of steps, the largest remaining force, whether the
+        minimisation has converged (no force component above `gtol`) and whether it stopped early because the line
+        search could not lower the energy even along the steepest descent
+    :rtype: dict with keys 'initial', 'energy', 'iterations', 'maxforce', 'converged' and 'stalled'
+    """
+    forcefield = ForceField(arrays, fixed, **kwargs)
+    coords = arrays.coords.copy()
+    forcefield.updateNeighbourList(coords, force=True)
+    energy, gradient = forcefield.energy(coords)
+    result = {'initial': energy, 'stalled': False}
+    history = []
+    iteration = 0
+    for iteration in range(1, maxiter + 1):
+        if np.abs(gradient).max(initial=0) < gtol:
+            break
+        direction = _lbfgsDirection(gradient, history)
+        slope = (direction * gradient).sum()
+        if slope >= 0:
+            # not a descent direction: start again from steepest descent
+            history = []
+            direction, slope = -gradient, -(gradient * gradient).sum()
+        # do not move any atom farther than maxstep, then backtrack until the energy decreases sufficiently
+        alpha = min(1.0, maxstep / np.sqrt((direction ** 2).sum(axis=1).max()))
+        while True:
+            trial = coords + alpha * direction
+            forcefield.updateNeighbourList(trial)
+            trialenergy, trialgradient = forcefield.energy(trial)
+            if trialenergy <= energy + 1e-4 * alpha * slope or alpha < 1e-8:
+                break
+            alpha *= 0.5
+        if trialenergy > energy:
+            if not history:
+                # no further progress possible: the forces are still above gtol, else the loop would have ended
+                result['stalled'] = True
+                break
+            # retry from steepest descent
+            history = []
+            continue
+        s, y = trial - coords, trialgradient - gradient
+        if (s * y).sum() > 1e-10:
+            history = (history + [(s, y, 1.0 / (s * y).sum())])[-memory:]
+        coords, energy, gradient = trial, trialenergy, trialgradient
+    arrays.coords = coords
+    result.update({'energy': energy, 'iterations': iteration, 'maxforce': float(np.abs(gradient).max(initial=0))})
+    # only the forces decide, also after the last step
+    result['converged'] = result['maxforce'] < gtol
+    logger.debug('Minimisation: {initial:.2f} -> {energy:.2f} kcal/mol in {iterations} steps, largest force '
+                 '{maxforce:.2f} kcal/mol/A'.format(**result))
+    return result
+
+
+def minimize_selection(selection: str, fixbackbone: bool = True, state: int = 1, maxiter: int = 2000,
+                       gtol: float = 0.5) -> Dict:
+    """Minimise the energy of a PyMOL selection
+
+    Atoms outside the selection are ignored, i.e. bonds to them are not considered and they are not in the way.
+
+    :param selection: the atoms to minimise
+    :type selection: str
+    :param fixbackbone: keep the backbone atoms in place
+    :type fixbackbone: bool
+    :param state: the state to minimise
+    :type state: int
+    :param maxiter: the maximum number of steps
+    :type maxiter: int
+    :param gtol: converged if no force component is larger than this, in kcal/mol/A
+    :type gtol: float
+    :return: the results, see :func:`minimize`
+    :rtype: dict
+    """
+    arrays = PeptideArrays.fromSelection(selection, state)
+    fixed = (arrays.flags & FIXED_FLAG) != 0
+    if fixbackbone:
+        fixed |= np.isin(arrays.name, BACKBONE_ATOMS)
+    result = minimize(arrays, fixed, maxiter, gtol)
+    arrays.loadCoords(selection, state)
+    return result
+
+
+def clean_bp(selection='all', fixbackbone=1, maxiter=2000, state=1, quiet=0, _self=None):
+    """
+    DESCRIPTION
+
+        Relieve steric clashes by a quick energy minimisation, keeping the
+        bond lengths and angles
+
+    USAGE
+
+        clean_bp [selection [, fixbackbone [, maxiter [, state [, quiet]]]]]
+
+    ARGUMENTS
+
+        selection = str: the atoms to minimise (default: all)
+
+        fixbackbone = 0 or 1: keep the backbone atoms (see select_bbb) in
+            place (default: 1)
+
+        maxiter = int: the maximum number of steps (default: 2000)
+
+        state = int: the state to minimise (default: 1)
+
+        quiet = 0 or 1: do not print the energies
+
+    NOTES
+
+        Unlike the clean command, this does not need the modelling
+        capabilities of PyMOL (freemol.mengine) and is not a proper force
+        field: the bond lengths and angles of the starting structure are
+        retained and only steric repulsion is considered. Atoms flagged as
+        fixed (see the flag command) are not moved.
+
+    SEE ALSO
+
+        clean, sculpt_iterate, check_clashes
+    """
+    result = minimize_selection(selection, bool(int(fixbackbone)), int(state), int(maxiter))
+    if not int(quiet):
+        if result['converged']:
+            status = ''
+        elif result['stalled']:
+            status = ' (not converged: the line search failed, largest force {maxforce:.2f} kcal/mol/A)'
+        else:
+            status = ' (not converged, largest force {maxforce:.2f} kcal/mol/A)'
+        print(('Energy: {initial:.2f} -> {energy:.2f} kcal/mol in {iterations} steps' + status).format(**result))
+    return result['energy']
+
+
+if cmd is not None:
+    cmd.extend('clean_bp', clean_bp)
@@ -0,0 +1,307 @@
+"""Assemble peptides from single-residue templates using internal coordinates
+
+Instead of fusing residues one by one in PyMOL, the whole peptide is built in a single pass. The internal coordinates
+(bond lengths, bond angles and dihedral angles) of each atom are taken from the single-residue templates and from the
+peptide bond mould, the backbone dihedrals are replaced by the requested ones, then Cartesian coordinates are
+generated by the Natural Extension Reference Frame (NeRF) method, vectorized over all atoms of the same depth in the
+spanning tree of the molecular graph.
+"""
+import collections
+import copy
+import logging
+import warnings
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import chempy
+    import chempy.models
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    chempy = None
+
+from .geometry import bond_lengths, bond_angles, dihedral_angles, nerf, kabsch
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Backbone torsions of the residue types, in the same order as in the secondary structure database. Each atom is given
+# as (name, residue offset), alternative names are separated by a '+' sign.
+ALPHA_TORSIONS = [
+    (('C', -1), ('N', 0), ('CA', 0), ('C', 0)),  # phi
+    (('N', 0), ('CA', 0), ('C', 0), ('N', 1)),  # psi
+]
+BETA_TORSIONS = [
+    (('C', -1), ('N', 0), ('CB+CB1', 0), ('CA', 0)),  # phi
+    (('N', 0), ('CB+CB1', 0), ('CA', 0), ('C', 0)),  # theta
+    (('CB+CB1', 0), ('CA', 0), ('C', 0), ('N', 1)),  # psi
+]
+
+
+class ResidueTemplate:
+    """Coordinates and topology of a single residue, extracted from a chempy model"""
+
+    def __init__(self, model: "chempy.models.Indexed"):
+        self.model = model
+        self.coords = np.array([a.coord for a in model.atom], dtype=float)
+        self.names = [a.name for a in model.atom]
+        self.bonds = [tuple(b.index) for b in model.bond]
+        self.neighbours = [[] for a in model.atom]
+        for i, j in self.bonds:
+            self.neighbours[i].append(j)
+            self.neighbours[j].append(i)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def find(self, names: str) -> Optional[int]:
+        """Find the index of an atom by name
+
+        :param names: atom name(s), alternatives separated by '+'
+        :type names: str
+        :return: the index of the first matching atom or None if not found
+        :rtype: int or None
+        """
+        for name in names.split('+'):
+            if name in self.names:
+                return self.names.index(name)
+        return None
+
+    def bonded(self, i: Optional[int], j: Optional[int]) -> bool:
+        """Check if two atoms are bonded"""
+        return (i is not None) and (j is not None) and (j in self.neighbours[i])
+
+    def inRing(self, i: int, j: int) -> bool:
+        """Check if the bond between atoms `i` and `j` is part of a ring"""
+        visited = {i}
+        queue = collections.deque([i])
+        while queue:
+            k = queue.popleft()
+            for l in self.neighbours[k]:
+                if (k, l) == (i, j):
+                    continue
+                if l == j:
+                    return True
+                if l not in visited:
+                    visited.add(l)
+                    queue.append(l)
+        return False
+
+    def torsions(self) -> Optional[List[Tuple[Tuple[str, int], ...]]]:
+        """Get the backbone torsion definitions according to the kind of this residue
+
+        :return: the torsion definitions (see ALPHA_TORSIONS and BETA_TORSIONS) or None if this is not an amino acid
+        :rtype: list or None
+        """
+        n, ca, c = self.find('N'), self.find('CA'), self.find('C')
+        cb = self.find('CB+CB1')
+        if not self.bonded(ca, c):
+            return None
+        elif self.bonded(n, ca):
+            return ALPHA_TORSIONS
+        elif self.bonded(n, cb) and self.bonded(cb, ca):
+            return BETA_TORSIONS
+        return None
+
+    def leftFitAtoms(self) -> List[int]:
+        """Atoms of the C-terminal end to be fitted on the Cprev, C and O atoms of the peptide bond mould"""
+        atoms = [self.find('CA+CH3'), self.find('C'), self.find('O')]
+        if any([a is None for a in atoms]):
+            raise ValueError('Residue {} cannot be extended at its C-terminus'.format(self.model.atom[0].resn))
+        return atoms
+
+    def rightFitAtoms(self) -> List[int]:
+        """Atoms of the N-terminal end to be fitted on the N, H and Cnext atoms of the peptide bond mould"""
+        n = self.find('N')
+        if n is None:
+            raise ValueError('Residue {} cannot be extended at its N-terminus'.format(self.model.atom[0].resn))
+        # in proline, the hydrogen is replaced by CD
+        h = self.find('H') if self.bonded(n, self.find('H')) else self.find('CD')
+        carbons = [i for i in self.neighbours[n] if
+                   self.model.atom[i].symbol == 'C' and self.names[i] != 'C' and i != h]
+        if h is None or not carbons:
+            raise ValueError('Residue {} cannot be extended at its N-terminus'.format(self.model.atom[0].resn))
+        return [n, h, carbons[0]]
+
+
+def _rootAtom(template: ResidueTemplate) -> int:
+    """Select the root of the spanning tree in the N-terminal residue"""
+    n = template.find('N')
+    if n is not None:
+        return n
+    # capping groups on the N-terminus: start from the carbon atom next to the carbonyl carbon
+    c = template.find('C')
+    for i in template.neighbours[c]:
+        if template.model.atom[i].symbol == 'C':
+            return i
+    return 0
+
+
+def assemble(templates: Sequence[ResidueTemplate], dihedrals: Sequence[Optional[Sequence[Optional[float]]]],
+             mould: ResidueTemplate) -> "chempy.models.Indexed":
+    """Build a peptide from residue templates in a single pass
+
+    :param templates: the residues, from the N- to the C-terminus
+    :type templates: sequence of ResidueTemplate instances
+    :param dihedrals: the requested backbone torsions for each residue (or None to keep the template conformation)
+    :type dihedrals: sequence of lists of floats or Nones
+    :param mould: the peptide bond (atoms Cprev, C, O, N, H and Cnext)
+    :type mould: ResidueTemplate
+    :return: the peptide
+    :rtype: chempy.models.Indexed
+    :raises ValueError: if the residues cannot be joined or folded
+    """
+    if not templates:
+        raise ValueError('At least one residue is needed')
+    # indices of the atoms of each residue in the final model
+    offsets = np.cumsum([0] + [len(t) for t in templates])
+    natoms = int(offsets[-1])
+    resindex = np.repeat(np.arange(len(templates)), [len(t) for t in templates])
+
+    # construct the molecular graph, including the peptide bonds
+    neighbours = [[] for i in range(natoms)]
+    peptidebonds = []
+    for ires, t in enumerate(templates):
+        for i, j in t.bonds:
+            neighbours[i + offsets[ires]].append(j + offsets[ires])
+            neighbours[j + offsets[ires]].append(i + offsets[ires])
+        if ires > 0:
+            c = templates[ires - 1].leftFitAtoms()[1] + offsets[ires - 1]
+            n = t.rightFitAtoms()[0] + offsets[ires]
+            neighbours[c].append(n)
+            neighbours[n].append(c)
+            peptidebonds.append((c, n))
+
+    # Coordinates of the atoms in three frames: in the frame of their template, fitted on the mould as the N-terminal
+    # (left) side of a peptide bond and fitted on the mould as the C-terminal (right) side.
+    local = np.concatenate([t.coords for t in templates])
+    leftfitted = local.copy()
+    rightfitted = local.copy()
+    mouldleft = mould.coords[[mould.find('Cprev'), mould.find('C'), mould.find('O')]]
+    mouldright = mould.coords[[mould.find('N'), mould.find('H'), mould.find('Cnext')]]
+    for ires, t in enumerate(templates):
+        sl = slice(offsets[ires], offsets[ires + 1])
+        if ires < len(templates) - 1:
+            rot, trans, rmsd = kabsch(t.coords[t.leftFitAtoms()], mouldleft)
+            leftfitted[sl] = t.coords @ rot.T + trans
+        if ires > 0:
+            rot, trans, rmsd = kabsch(t.coords[t.rightFitAtoms()], mouldright)
+            rightfitted[sl] = t.coords @ rot.T + trans
+
+    def framecoords(quads: np.ndarray) -> np.ndarray:
+        # Get coordinates for groups of atoms in a common frame. The atoms of a group span at most two consecutive
+        # residues: if they are in the same residue, the template frame is used, otherwise the mould frame.
+        res = resindex[quads]
+        first = res.min(axis=1, keepdims=True)
+        last = res.max(axis=1, keepdims=True)
+        if ((last - first) > 1).any():
+            raise ValueError('Reference atoms must be in consecutive residues')
+        return np.where(((first == last) & (res == first))[..., np.newaxis], local[quads],
+                        np.where((res == first)[..., np.newaxis], leftfitted[quads], rightfitted[quads]))
+
+    # spanning tree of the molecular graph, rooted in the first residue
+    root = _rootAtom(templates[0])
+    parent = np.full(natoms, -1, dtype=int)
+    depth = np.full(natoms, -1, dtype=int)
+    depth[root] = 0
+    order = [root]
+    queue = collections.deque([root])
+    while queue:
+        i = queue.popleft()
+        for j in neighbours[i]:
+            if depth[j] < 0:
+                depth[j] = depth[i] + 1
+                parent[j] = i
+                order.append(j)
+                queue.append(j)
+    if len(order) != natoms:
+        raise ValueError('The peptide is not connected')
+    # the first three atoms are placed directly from the template, the others from internal coordinates
+    seeds = order[:3]
+    if len(seeds) < 3 or depth[seeds[2]] != 1:
+        raise ValueError('The N-terminal residue is too small')
+    refs = np.zeros((natoms, 3), dtype=int)
+    for i in order[3:]:
+        a = parent[i]
+        if depth[i] == 1:
+            b, c = seeds[1], seeds[2]
+        elif depth[i] == 2:
+            b = parent[a]
+            c = seeds[1] if a != seeds[1] else seeds[2]
+        else:
+            b = parent[a]
+            c = parent[b]
+        refs[i] = a, b, c
+    placed = np.array(order[3:], dtype=int)
+    quads = framecoords(np.column_stack([placed, refs[placed]]))
+    zbond = np.zeros(natoms)
+    zangle = np.zeros(natoms)
+    zdihedral = np.zeros(natoms)
+    zbond[placed] = bond_lengths(quads[:, 0], quads[:, 1])
+    zangle[placed] = bond_angles(quads[:, 0], quads[:, 1], quads[:, 2])
+    zdihedral[placed] = dihedral_angles(quads[:, 0], quads[:, 1], quads[:, 2], quads[:, 3])
+
+    # now replace the backbone torsions
+    for ires, (t, dih) in enumerate(zip(templates, dihedrals)):
+        if dih is None:
+            continue
+        torsions = t.torsions()
+        if torsions is None:
+            raise ValueError('Residue {} is neither an alpha-, nor a beta-amino acid'.format(ires + 1))
+        if len(torsions) == 2 and len(dih) == 3:
+            # (phi, theta, psi) triplet given for an alpha-amino acid
+            dih = [dih[0], dih[2]]
+        dih = [d for d in dih if d is not None]
+        if len(dih) != len(torsions):
+            raise ValueError('Residue {} needs {} dihedral angles, got {}'.format(ires + 1, len(torsions), len(dih)))
+        for torsion, value in zip(torsions, dih):
+            if ires + torsion[0][1] < 0 or ires + torsion[-1][1] >= len(templates):
+                # the first or the last residue: this torsion is not defined
+                continue
+            atoms = [templates[ires + offset].find(name) for name, offset in torsion]
+            if any([a is None for a in atoms]):
+                continue
+            atoms = [a + offsets[ires + offset] for a, (name, offset) in zip(atoms, torsion)]
+            if templates[ires].inRing(atoms[1] - offsets[ires], atoms[2] - offsets[ires]):
+                # torsions around ring bonds cannot be changed
+                continue
+            if parent[atoms[2]] != atoms[1]:
+                raise ValueError('Unexpected topology around the backbone of residue {}'.format(ires + 1))
+            current = dihedral_angles(*framecoords(np.array([atoms]))[0])
+            # rotate everything around the bond between the middle two atoms
+            rotated = (refs[:, 0] == atoms[2]) & (refs[:, 1] == atoms[1])
+            zdihedral[rotated] += value - current
+    logger.debug('Internal coordinates of {} atoms determined'.format(natoms))
+
+    # build the Cartesian coordinates, level by level in the spanning tree
+    coords = np.zeros((natoms, 3))
+    coords[seeds] = local[seeds]
+    placed = np.zeros(natoms, dtype=bool)
+    placed[seeds] = True
+    for level in range(1, depth.max() + 1):
+        atoms = np.flatnonzero((depth == level) & ~placed)
+        coords[atoms] = nerf(coords[refs[atoms, 0]], coords[refs[atoms, 1]], coords[refs[atoms, 2]],
+                             zbond[atoms], zangle[atoms], zdihedral[atoms])
+        placed[atoms] = True
+
+    # finally, construct the chempy model
+    model = chempy.models.Indexed()
+    for ires, t in enumerate(templates):
+        for i, atom in enumerate(t.model.atom):
+            atom = copy.deepcopy(atom)
+            atom.resi_number = ires + 1
+            atom.resi = str(ires + 1)
+            atom.coord = [float(x) for x in coords[i + offsets[ires]]]
+            model.add_atom(atom)
+        for bond in t.model.bond:
+            bond = copy.deepcopy(bond)
+            bond.index = [int(bond.index[0] + offsets[ires]), int(bond.index[1] + offsets[ires])]
+            model.add_bond(bond)
+    for c, n in peptidebonds:
+        bond = chempy.Bond()
+        bond.index = [int(c), int(n)]
+        bond.order = 1
+        model.add_bond(bond)
+    return model
@@ -0,0 +1,252 @@
+"""A structure-of-arrays representation of peptides, without per-atom Python objects
+
+chempy models hold one :class:`chempy.Atom` object per atom and a list of bonds, thus finding an atom by name or the
+neighbours of an atom needs a linear scan (see e.g. :func:`pmlbeta.utils.getAtom` and
+:func:`pmlbeta.utils.getBondedNeighbours`). A :class:`PeptideArrays` instance keeps the same information in NumPy
+arrays:
+
+    - coordinates in an (N, 3) float array
+    - atom names, residue names, element symbols etc. in fixed-width string or numeric arrays
+    - the atoms grouped by residue, the residue boundaries given by an offset array
+    - bonds as an (M, 2) index array, and the bonded neighbours in compressed sparse row (CSR) form
+    - a hash table for looking up atoms by (residue number, atom name) in constant time
+"""
+import warnings
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+try:
+    from pymol import cmd
+    import chempy
+    import chempy.models
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    cmd = None
+    chempy = None
+
+from .residuelibrary import ATOM_FIELDS
+
+# per-atom properties, besides the coordinates and those stored in the residue library. String widths are taken from
+# the data.
+FIELDS = ATOM_FIELDS + [
+    ('resn', str),
+    ('resi', str),
+    ('resi_number', np.int32),
+    ('chain', str),
+    ('segi', str),
+    ('alt', str),
+    ('b', np.float32),
+    ('q', np.float32),
+]
+
+
+class PeptideArrays:
+    """Atoms, residues and bonds of a peptide in NumPy arrays
+
+    The atoms are ordered by residue number, keeping their original order within each residue. Per-atom properties
+    are accessed as attributes, e.g. `arrays.name` or `arrays.resi_number`, see :data:`FIELDS`.
+    """
+
+    def __init__(self, coords: np.ndarray, fields: Dict[str, np.ndarray], bonds: np.ndarray,
+                 bondorders: Optional[np.ndarray] = None):
+        """Create a new instance from arrays
+
+        :param coords: the Cartesian coordinates
+        :type coords: (N, 3) array of floats
+        :param fields: atom properties, at least 'name' and 'resi_number'
+        :type fields: dict of str -> array of length N
+        :param bonds: the bonded atom pairs
+        :type bonds: (M, 2) array of ints
+        :param bondorders: the bond orders, all 1 if not given
+        :type bondorders: array of ints of length M
+        """
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        natoms = len(self.coords)
+        resi = np.asarray(fields['resi_number'])
+        # group the atoms by residue, keeping the original order within each residue
+        order = np.argsort(resi, kind='stable')
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(natoms)
+        self.order = order  # the original index of each atom
+        self.coords = self.coords[order]
+        self.fields = {k: np.asarray(v)[order] for k, v in fields.items()}
+        self.bonds = inverse[np.asarray(bonds, dtype=np.int64).reshape(-1, 2)] if natoms else np.empty((0, 2), int)
+        self.bondorders = np.ones(len(self.bonds), dtype=np.int8) if bondorders is None else np.asarray(bondorders)
+
+        # residue boundaries: the atoms of residue self.residues[i] are offsets[i]:offsets[i+1]
+        self.residues, starts = np.unique(self.fields['resi_number'], return_index=True)
+        self.offsets = np.append(starts, natoms)
+
+        # bonded neighbours in CSR form: the neighbours of atom i are neighbourindices[neighbourptr[i]:neighbourptr[i+1]]
+        pairs = np.concatenate([self.bonds, self.bonds[:, ::-1]])
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        self.neighbourptr = np.searchsorted(pairs[:, 0], np.arange(natoms + 1))
+        self.neighbourindices = pairs[:, 1]
+        self._lookup = None
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def __getattr__(self, item: str) -> np.ndarray:
+        try:
+            return self.__dict__['fields'][item]
+        except KeyError:
+            raise AttributeError(item)
+
+    @classmethod
+    def fromModel(cls, model: "chempy.models.Indexed") -> "PeptideArrays":
+        """Convert a chempy model
+
+        :param model: the model
+        :type model: chempy.models.Indexed
+        :return: the new instance
+        :rtype: PeptideArrays
+        """
+        fields = {field: np.array([getattr(a, field) for a in model.atom], dtype=dtype if dtype is not str else None)
+                  for field, dtype in FIELDS}
+        for field, dtype in FIELDS:
+            if dtype is str:
+                # numpy makes float arrays from empty lists
+                fields[field] = fields[field].astype(str)
+        return cls([a.coord for a in model.atom], fields, [b.index for b in model.bond], [b.order for b in model.bond])
+
+    @classmethod
+    def fromSelection(cls, selection: str, state: int = 1) -> "PeptideArrays":
+        """Get the atoms of a PyMOL selection. Bonds to atoms outside the selection are not considered.
+
+        :param selection: the selection
+        :type selection: str
+        :param state: the state to take the coordinates from
+        :type state: int
+        :return: the new instance
+        :rtype: PeptideArrays
+        """
+        return cls.fromModel(cmd.get_model('({})'.format(selection), state=state))
+
+    def toModel(self) -> "chempy.models.Indexed":
+        """Convert to a chempy model
+
+        :return: the model
+        :rtype: chempy.models.Indexed
+        """
+        model = chempy.models.Indexed()
+        columns = [(field, self.fields[field].tolist()) for field, dtype in FIELDS if field in self.fields]
+        for i, xyz in enumerate(self.coords.tolist()):
+            atom = chempy.Atom()
+            for field, values in columns:
+                setattr(atom, field, values[i])
+            atom.coord = xyz
+            model.add_atom(atom)
+        for (i, j), order in zip(self.bonds.tolist(), self.bondorders.tolist()):
+            bond = chempy.Bond()
+            bond.index = [i, j]
+            bond.order = order
+            model.add_bond(bond)
+        return model
+
+    def find(self, resi: int, name: str) -> int:
+        """Find an atom by residue number and name in constant time
+
+        :param resi: the residue number
+        :type resi: int
+        :param name: the atom name, alternatives separated by '+' as in PyMOL selections
+        :type name: str
+        :return: the index of the (first) matching atom
+        :rtype: int
+        :raises KeyError: if no such atom exists
+        """
+        if self._lookup is None:
+            self._lookup = {}
+            for i, key in enumerate(zip(self.fields['resi_number'].tolist(), self.fields['name'].tolist())):
+                self._lookup.setdefault(key, i)
+        for n in name.split('+'):
+            try:
+                return self._lookup[(resi, n)]
+            except KeyError:
+                pass
+        raise KeyError('No atom {} in residue {}'.format(name, resi))
+
+    def residueSlice(self, resi: int) -> slice:
+        """Get the range of atom indices belonging to a residue
+
+        :param resi: the residue number
+        :type resi: int
+        :return: the atoms of the residue
+        :rtype: slice
+        :raises KeyError: if the residue does not exist
+        """
+        i = np.searchsorted(self.residues, resi)
+        if i >= len(self.residues) or self.residues[i] != resi:
+            raise KeyError('No residue {}'.format(resi))
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def neighbours(self, i: int) -> np.ndarray:
+        """Get the atoms bonded to an atom
+
+        :param i: the index of the atom
+        :type i: int
+        :return: the indices of the neighbours, in increasing order
+        :rtype: array of ints
+        """
+        return self.neighbourindices[self.neighbourptr[i]:self.neighbourptr[i + 1]]
+
+    def degrees(self) -> np.ndarray:
+        """Get the number of bonded neighbours of each atom
+
+        :return: the numbers of neighbours
+        :rtype: array of ints
+        """
+        return np.diff(self.neighbourptr)
+
+    def angles(self) -> np.ndarray:
+        """Get all bond angles
+
+        :return: the atom triples (i, j, k) where j is bonded to both i and k, each angle given once with i < k
+        :rtype: (A, 3) array of ints
+        """
+        first = np.concatenate([self.bonds[:, 0], self.bonds[:, 1]])
+        centre = np.concatenate([self.bonds[:, 1], self.bonds[:, 0]])
+        counts = self.degrees()[centre]
+        # the neighbours of each central atom, i.e. neighbourindices[neighbourptr[centre]:neighbourptr[centre+1]]
+        starts = np.repeat(self.neighbourptr[centre] - np.cumsum(counts) + counts, counts)
+        last = self.neighbourindices[starts + np.arange(counts.sum())]
+        first, centre = np.repeat(first, counts), np.repeat(centre, counts)
+        keep = first < last
+        return np.stack([first[keep], centre[keep], last[keep]], axis=1)
+
+    def residueIndex(self) -> np.ndarray:
+        """Get the position of the residue of each atom in :attr:`residues`
+
+        :return: the residue positions
+        :rtype: array of ints
+        """
+        return np.repeat(np.arange(len(self.residues)), np.diff(self.offsets))
+
+    def subset(self, atoms: Sequence[int]) -> "PeptideArrays":
+        """Get some atoms, with the bonds between them
+
+        :param atoms: the indices of the atoms, or a boolean mask
+        :type atoms: sequence of ints or bools
+        :return: the new instance
+        :rtype: PeptideArrays
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        mask[np.asarray(atoms)] = True
+        newindex = np.cumsum(mask) - 1
+        bondmask = mask[self.bonds].all(axis=1)
+        return PeptideArrays(self.coords[mask], {k: v[mask] for k, v in self.fields.items()},
+                             newindex[self.bonds[bondmask]], self.bondorders[bondmask])
+
+    def loadCoords(self, selection: str, state: int = 1):
+        """Put the coordinates back into PyMOL
+
+        :param selection: the selection these arrays were made from, the atoms are put back in their original order
+        :type selection: str
+        :param state: the state to update
+        :type state: int
+        """
+        coords = np.empty_like(self.coords)
+        coords[self.order] = self.coords
+        cmd.load_coords(coords, '({})'.format(selection), state=state)
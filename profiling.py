@@ -0,0 +1,256 @@
+"""Stage-level profiling of peptide builds
+
+While a :class:`BuildProfiler` is active, the main stages of the build engines (residue creation, side chain
+attachment, atom renaming, superposition, copying, joining, folding etc.) and all public functions of
+:mod:`pymol.cmd` are wrapped to record their wall time and number of calls. Times are given both inclusive and
+exclusive of nested stages. PyMOL commands issued from within other PyMOL commands are not counted. The build engines
+also report which residue is being built, see :func:`building_residue`, thus time and PyMOL commands are attributed to the
+residues as well.
+
+Usage::
+
+    with BuildProfiler() as profiler:
+        betafab2('peptide', 'ACE', '(S)B3hV{H14M}', '(S)B3hA{H14M}', 'NME')
+    print(profiler.table())
+    profiler.save('profile.json')
+
+or ``betafab2 peptide, ACE, (S)B3hV{H14M}, (S)B3hA{H14M}, NME, profile=1`` in PyMOL.
+"""
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+import warnings
+from typing import Dict, List
+
+try:
+    from pymol import cmd
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    cmd = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# the profiler currently recording, if any
+_active = None
+
+
+@contextlib.contextmanager
+def building_residue(index: int, residue: Dict[str, str]):
+    """Attribute the work done in the context to a residue, if a profiler is active
+
+    :param index: the residue number
+    :type index: int
+    :param residue: residue description, as returned by :meth:`BetaPeptide.parseBetaPeptideSequence`
+    :type residue: dict
+    """
+    if _active is None:
+        yield
+        return
+    from .betafab2 import BetaPeptide
+    _active._enterResidue(index, ':'.join(x for x in BetaPeptide.residueKey(residue) if x))
+    try:
+        yield
+    finally:
+        _active._exitResidue()
+
+
+class _Counter:
+    """Calls and times of a stage or a PyMOL command"""
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.exclusive = 0.0
+        self.cmdcalls = 0
+
+    def toDict(self) -> Dict:
+        return {'calls': self.calls, 'total': self.total, 'exclusive': self.exclusive, 'cmdcalls': self.cmdcalls}
+
+
+class BuildProfiler:
+    """Record wall time and call counts per build stage, per PyMOL command and per residue"""
+
+    def __init__(self):
+        self.stages = {}  # stage name -> _Counter
+        self.commands = {}  # PyMOL command name -> _Counter
+        self.residues = []  # dicts with keys 'index', 'label', 'time' and 'cmdcalls'
+        self.cmdcalls = 0
+        self.elapsed = 0.0
+        self._stack = []  # [stage counter, start time, time spent in nested stages]
+        self._cmddepth = 0
+        self._residue = None
+        self._patched = []
+        self._start = None
+        self._thread = None
+
+    @staticmethod
+    def _targets() -> List[tuple]:
+        """The functions to be instrumented: owner (class or module), attribute name, stage name"""
+        from . import betafab2
+        return [(betafab2.BetaPeptide, name, name) for name in [
+            'parseBetaPeptideSequence', 'fromResidue', 'initializeAlphaResidue', 'initializeBetaResidue',
+            'attachBetaSideChain', 'renameAtomsInResidue', 'safe_pairfit', 'copy', '__iadd__', 'fold', 'foldResidues',
+            'residueTemplate', 'buildResidue', 'loadBetaBackbone', 'loadPeptideBond', 'loadSideChainFragment',
+            'invertStereocentres']] + [
+                   (betafab2.PeptideBuilder, '_appendResidue', 'appendResidue'),
+                   (betafab2.PeptideBuilder, 'load', 'loadChain'),
+                   (betafab2, 'assemble', 'assemble'),
+                   (betafab2, 'pack_selection', 'pack'),
+                   (betafab2, 'report_clashes', 'clashcheck'),
+               ]
+
+    def _wrapStage(self, function, stage: str):
+        counter = self.stages.setdefault(stage, _Counter())
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            self._stack.append([counter, time.perf_counter(), 0.0])
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _, start, nested = self._stack.pop()
+                elapsed = time.perf_counter() - start
+                counter.calls += 1
+                counter.total += elapsed
+                counter.exclusive += elapsed - nested
+                if self._stack:
+                    self._stack[-1][2] += elapsed
+
+        return wrapper
+
+    def _wrapCommand(self, function, name: str):
+        counter = self.commands.setdefault(name, _Counter())
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if self._cmddepth or threading.get_ident() != self._thread:
+                # called by another PyMOL command, or by a different thread, e.g. the PyMOL main loop
+                return function(*args, **kwargs)
+            self._cmddepth += 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._cmddepth -= 1
+                elapsed = time.perf_counter() - start
+                counter.calls += 1
+                counter.total += elapsed
+                self.cmdcalls += 1
+                if self._stack:
+                    self._stack[-1][0].cmdcalls += 1
+                if self._residue is not None:
+                    self._residue['cmdcalls'] += 1
+
+        return wrapper
+
+    def _patch(self, owner, name: str, wrapper_factory, label: str):
+        original = inspect.getattr_static(owner, name)
+        if isinstance(original, (staticmethod, classmethod)):
+            wrapped = type(original)(wrapper_factory(original.__func__, label))
+        else:
+            wrapped = wrapper_factory(original, label)
+        self._patched.append((owner, name, original))
+        setattr(owner, name, wrapped)
+
+    def _enterResidue(self, index: int, label: str):
+        self._residue = {'index': index, 'label': label, 'time': 0.0, 'cmdcalls': 0, '_start': time.perf_counter()}
+
+    def _exitResidue(self):
+        self._residue['time'] = time.perf_counter() - self._residue.pop('_start')
+        self.residues.append(self._residue)
+        self._residue = None
+
+    def __enter__(self) -> "BuildProfiler":
+        global _active
+        if _active is not None:
+            raise RuntimeError('Another build profiler is already active')
+        for owner, name, stage in self._targets():
+            self._patch(owner, name, self._wrapStage, stage)
+        if cmd is not None:
+            for name in dir(cmd):
+                if not name.startswith('_') and inspect.isfunction(getattr(cmd, name)):
+                    self._patch(cmd, name, self._wrapCommand, name)
+        _active = self
+        self._thread = threading.get_ident()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _active
+        self.elapsed += time.perf_counter() - self._start
+        _active = None
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched = []
+
+    def toDict(self) -> Dict:
+        """Get the results in a JSON-serializable form
+
+        :return: the total wall time and number of PyMOL commands, and the results per stage, command and residue
+        :rtype: dict with keys 'elapsed', 'cmdcalls', 'stages', 'commands' and 'residues'
+        """
+        return {
+            'elapsed': self.elapsed,
+            'cmdcalls': self.cmdcalls,
+            'stages': {name: c.toDict() for name, c in self.stages.items() if c.calls},
+            'commands': {name: {'calls': c.calls, 'total': c.total} for name, c in self.commands.items() if c.calls},
+            'residues': self.residues,
+        }
+
+    def save(self, filename: str):
+        """Write the results to a JSON file
+
+        :param filename: the name of the file
+        :type filename: str
+        """
+        with open(filename, 'wt') as f:
+            json.dump(self.toDict(), f, indent=2)
+
+    def table(self, maxcommands: int = 10) -> str:
+        """Format the results as text tables
+
+        :param maxcommands: list only this many of the most time consuming PyMOL commands
+        :type maxcommands: int
+        :return: the tables
+        :rtype: str
+        """
+        lines = ['Total: {:.3f} s, {} PyMOL commands'.format(self.elapsed, self.cmdcalls), '',
+                 '{:<24s} {:>8s} {:>10s} {:>10s} {:>10s}'.format('stage', 'calls', 'total (s)', 'self (s)', 'commands')]
+        for name, c in sorted(self.stages.items(), key=lambda x: -x[1].total):
+            if c.calls:
+                lines.append('{:<24s} {:>8d} {:>10.3f} {:>10.3f} {:>10d}'.format(
+                    name, c.calls, c.total, c.exclusive, c.cmdcalls))
+        lines += ['', '{:<24s} {:>8s} {:>10s}'.format('PyMOL command', 'calls', 'total (s)')]
+        for name, c in sorted(self.commands.items(), key=lambda x: -x[1].total)[:maxcommands]:
+            if c.calls:
+                lines.append('{:<24s} {:>8d} {:>10.3f}'.format(name, c.calls, c.total))
+        if self.residues:
+            lines += ['', '{:>8s} {:<24s} {:>10s} {:>10s}'.format('residue', 'label', 'time (s)', 'commands')]
+            for r in self.residues:
+                lines.append('{index:>8d} {label:<24s} {time:>10.3f} {cmdcalls:>10d}'.format(**r))
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profiled(profile):
+    """Profile the work done in the context if requested, and report the results
+
+    :param profile: False for no profiling, True for printing the results, or the name of a JSON file to write the
+        results to (they are printed as well)
+    :type profile: bool or str
+    """
+    if not profile:
+        yield None
+        return
+    with BuildProfiler() as profiler:
+        yield profiler
+    print(profiler.table())
+    if isinstance(profile, str):
+        profiler.save(profile)
+        logger.info('Profile written to {}'.format(profile))
@@ -0,0 +1,215 @@
+"""A precompiled library of single residues, stored in a compact NumPy archive
+
+Building a residue from PyMOL fragments involves several fusions, fits and renaming passes. This module enumerates
+every residue understood by :meth:`pmlbeta.betafab2.BetaPeptide.parseBetaPeptideSequence`, builds them once and stores
+the coordinates, atom properties and bonds in a single versioned .npz file. The library is read lazily on first use.
+
+The library shipped in the resource directory can be regenerated by::
+
+    python -m pmlbeta.residuelibrary [filename]
+"""
+import logging
+import os
+import warnings
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+try:
+    import chempy
+    import chempy.models
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    chempy = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+LIBRARY_VERSION = 1
+DEFAULT_LIBRARY = os.path.join(os.path.split(__file__)[0], 'resource', 'residuelibrary.npz')
+
+# atom properties stored in the library, with their NumPy data types. Strings get their width from the data.
+ATOM_FIELDS = [
+    ('name', str),
+    ('symbol', str),
+    ('text_type', str),
+    ('ss', str),
+    ('formal_charge', np.int8),
+    ('partial_charge', np.float32),
+    ('numeric_type', np.int32),
+    ('vdw', np.float32),
+    ('hetatm', np.int8),
+    ('flags', np.int64),
+]
+
+
+def _encodeKey(key: Tuple[str, ...]) -> str:
+    return ':'.join(key)
+
+
+def enumerate_residues() -> Iterator[str]:
+    """Enumerate all residues which can be built
+
+    :return: residue designations, parseable by :meth:`pmlbeta.betafab2.BetaPeptide.parseBetaPeptideSequence`
+    :rtype: iterator of str
+    """
+    from .betafab2 import BetaPeptide
+    yield from ['ACE', 'BUT', 'NME', 'BA']
+    sidechains = sorted(BetaPeptide.SIDECHAINS)
+    for sc in sidechains:
+        for stereo in 'RSLD':
+            yield '({})A{}'.format(stereo, sc)
+    betasidechains = [sc for sc in sidechains if sc != 'P']  # beta-proline is not supported
+    for kind in ['2', '3']:
+        for sc in betasidechains:
+            for stereo in 'RS':
+                yield '({})B{}h{}'.format(stereo, kind, sc)
+    for sc2 in betasidechains:
+        for sc3 in betasidechains:
+            for stereo2 in 'RS':
+                for stereo3 in 'RS':
+                    yield '(2{}3{})B23h(2{}3{})'.format(stereo2, stereo3, sc2, sc3)
+    for cyclic in ['ACHC', 'ACPC']:
+        for stereo2 in 'RS':
+            for stereo3 in 'RS':
+                yield '(2{}3{}){}'.format(stereo2, stereo3, cyclic)
+
+
+def build_library(filename: str = DEFAULT_LIBRARY) -> int:
+    """Build all residues and store them in a library file. Needs PyMOL.
+
+    :param filename: the name of the output file
+    :type filename: str
+    :return: the number of residues in the library
+    :rtype: int
+    """
+    from pymol import cmd
+    from .betafab2 import BetaPeptide
+    from .utils import tempObjectName
+    keys = []
+    resnames = []
+    atomoffsets = [0]
+    bondoffsets = [0]
+    coords = []
+    bonds = []
+    bondorders = []
+    fields = {field: [] for field, dtype in ATOM_FIELDS}
+    default = chempy.Atom()
+    for designation in enumerate_residues():
+        residue = BetaPeptide.parseBetaPeptideSequence(designation)[0]
+        key = BetaPeptide.residueKey(residue)
+        if _encodeKey(key) in keys:
+            # e.g. BA and its equivalents
+            continue
+        try:
+            with tempObjectName() as name:
+                BetaPeptide.buildResidue(residue, name)
+                model = cmd.get_model('model {}'.format(name))
+        except Exception as exc:
+            warnings.warn('Cannot build residue {}: {}'.format(designation, exc))
+            continue
+        keys.append(_encodeKey(key))
+        resnames.append(model.atom[0].resn)
+        coords.extend([a.coord for a in model.atom])
+        for field, dtype in ATOM_FIELDS:
+            fields[field].extend([getattr(a, field, getattr(default, field, 0)) for a in model.atom])
+        bonds.extend([b.index for b in model.bond])
+        bondorders.extend([b.order for b in model.bond])
+        atomoffsets.append(atomoffsets[-1] + len(model.atom))
+        bondoffsets.append(bondoffsets[-1] + len(model.bond))
+        logger.debug('Built residue {} ({} atoms)'.format(designation, len(model.atom)))
+    arrays = {'field_' + field: np.array(fields[field], dtype=dtype) for field, dtype in ATOM_FIELDS}
+    np.savez_compressed(
+        filename,
+        version=np.array(LIBRARY_VERSION),
+        keys=np.array(keys),
+        resnames=np.array(resnames),
+        atomoffsets=np.array(atomoffsets, dtype=np.int32),
+        bondoffsets=np.array(bondoffsets, dtype=np.int32),
+        coords=np.array(coords, dtype=np.float32),
+        bonds=np.array(bonds, dtype=np.int16).reshape(-1, 2),
+        bondorders=np.array(bondorders, dtype=np.int8),
+        **arrays)
+    return len(keys)
+
+
+class ResidueLibrary:
+    """Read-only access to a residue library file
+
+    The file is only opened when a residue is first requested.
+    """
+    _default = None
+
+    def __init__(self, filename: str = DEFAULT_LIBRARY):
+        self.filename = filename
+        self._data = None
+        self._index = None
+
+    @classmethod
+    def default(cls) -> "ResidueLibrary":
+        """Get the library shipped with this plugin"""
+        if cls._default is None:
+            cls._default = cls(DEFAULT_LIBRARY)
+        return cls._default
+
+    def _load(self) -> Dict[str, int]:
+        if self._index is None:
+            self._index = {}
+            if not os.path.exists(self.filename):
+                warnings.warn('Residue library {} not found, residues will be built from fragments.'.format(
+                    self.filename))
+                return self._index
+            data = dict(np.load(self.filename))
+            if int(data['version']) != LIBRARY_VERSION:
+                warnings.warn('Residue library {} has version {} instead of {}, residues will be built from '
+                              'fragments.'.format(self.filename, int(data['version']), LIBRARY_VERSION))
+                return self._index
+            self._data = data
+            self._index = {key: i for i, key in enumerate(data['keys'])}
+            logger.debug('Loaded {} residues from {}'.format(len(self._index), self.filename))
+        return self._index
+
+    def __contains__(self, key: Tuple[str, ...]) -> bool:
+        return _encodeKey(key) in self._load()
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def model(self, key: Tuple[str, ...]) -> Optional["chempy.models.Indexed"]:
+        """Create a chempy model of a residue
+
+        :param key: the residue key, see :meth:`pmlbeta.betafab2.BetaPeptide.residueKey`
+        :type key: tuple of str
+        :return: the residue or None if it is not in the library
+        :rtype: chempy.models.Indexed or None
+        """
+        try:
+            i = self._load()[_encodeKey(key)]
+        except KeyError:
+            return None
+        d = self._data
+        first, last = d['atomoffsets'][i], d['atomoffsets'][i + 1]
+        model = chempy.models.Indexed()
+        for iatom in range(first, last):
+            atom = chempy.Atom()
+            for field, dtype in ATOM_FIELDS:
+                setattr(atom, field, d['field_' + field][iatom].item())
+            atom.coord = [float(x) for x in d['coords'][iatom]]
+            atom.resn = str(d['resnames'][i])
+            atom.resi_number = 1
+            atom.resi = '1'
+            atom.chain = 'A'
+            model.add_atom(atom)
+        for ibond in range(d['bondoffsets'][i], d['bondoffsets'][i + 1]):
+            bond = chempy.Bond()
+            bond.index = [int(x) for x in d['bonds'][ibond]]
+            bond.order = int(d['bondorders'][ibond])
+            model.add_bond(bond)
+        return model
+
+
+if __name__ == '__main__':
+    import sys
+
+    print('Built {} residues.'.format(build_library(*sys.argv[1:])))
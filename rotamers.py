@@ -0,0 +1,474 @@
+"""Side chain rotamer packing
+
+Folding sets the backbone dihedrals only, the side chains keep the conformations of the residue templates, which
+often clash in tight helices. The packer places the side chains of all residues in a small rotamer library and chooses
+the combination of the lowest steric energy:
+
+    - The side chain torsions are found from the bond graph: single bonds between heavy atoms, not in a ring and not
+      between two sp2 atoms, whose far side holds side chain heavy atoms but no main chain atom. Atom names are
+      not used, thus alpha-, beta2-, beta3- and beta2,3-residues are handled alike.
+    - Each side chain is packed as a position of its own, thus the two side chains of a beta2,3-residue are chosen
+      independently. Each torsion of an sp3-sp3 bond takes the staggered values (60, 180, -60 degrees), each torsion
+      involving an sp2 atom the values of :data:`SP2_ROTAMERS`. The current conformation is always kept as an
+      additional rotamer.
+    - The energy is the repulsion term of :class:`pmlbeta.minimize.ForceField`, split into self energies (a rotamer
+      with the backbone, the other fixed atoms and itself) and pair energies (two rotamers of different side chains).
+      The rotamers of a side chain are generated at once. Rotamers with much higher self energies than the best one
+      of their side chain are discarded, and at most :data:`MAX_ROTAMERS` are kept, before the pair energies are
+      calculated. Only side chains whose rotamers can come into contact are paired.
+    - Rotamers which cannot be part of the optimum are removed by dead-end elimination, and the remaining ones are
+      optimised side chain by side chain until no choice changes.
+"""
+import itertools
+import logging
+import warnings
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from pymol import cmd
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    cmd = None
+
+from .geometry import dihedral_angles, rotate_about_axis
+from .minimize import ForceField, repulsion_energies
+from .peptidearrays import PeptideArrays
+from .topology import CAPS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# torsion angles of the rotamer library, in degrees
+SP3_ROTAMERS = (60.0, 180.0, -60.0)
+SP2_ROTAMERS = (90.0, -90.0, 0.0, 180.0)
+# the number of rotamers of a side chain kept for the pair energies, this bounds the size of the pair energy tables
+MAX_ROTAMERS = 64
+
+
+class SidechainTorsion:
+    """A rotatable side chain bond b-c, the dihedral angle being measured as a-b-c-d
+
+    The atoms on the side of c (`moving`) are rotated, b is nearer to the main chain.
+    """
+
+    def __init__(self, a: int, b: int, c: int, d: int, moving: np.ndarray, sp2: bool):
+        self.a, self.b, self.c, self.d = a, b, c, d
+        self.moving = moving
+        self.sp2 = sp2
+
+    @property
+    def values(self) -> Tuple[float, ...]:
+        """The torsion angles in the rotamer library"""
+        return SP2_ROTAMERS if self.sp2 else SP3_ROTAMERS
+
+
+def _mainChain(arrays: PeptideArrays, atoms: range, heavy: np.ndarray, start: int, end: int) -> List[int]:
+    """The shortest path of heavy atoms between two atoms of a residue"""
+    parent = {start: None}
+    queue = [start]
+    for atom in queue:
+        if atom == end:
+            break
+        for n in arrays.neighbours(atom).tolist():
+            if n in atoms and heavy[n] and n not in parent:
+                parent[n] = atom
+                queue.append(n)
+    if end not in parent:
+        return []
+    path = [end]
+    while parent[path[-1]] is not None:
+        path.append(parent[path[-1]])
+    return path
+
+
+def _farSide(arrays: PeptideArrays, b: int, c: int) -> Optional[List[int]]:
+    """The atoms connected to c when the b-c bond is cut, None if b is among them (ring bond)"""
+    seen = {c}
+    queue = [c]
+    for atom in queue:
+        for n in arrays.neighbours(atom).tolist():
+            if atom == c and n == b:
+                continue
+            if n == b:
+                return None
+            if n not in seen:
+                seen.add(n)
+                queue.append(n)
+    return queue
+
+
+def sidechain_torsions(arrays: PeptideArrays) -> Dict[int, List[SidechainTorsion]]:
+    """Find the rotatable side chain bonds of each amino acid residue
+
+    :param arrays: the peptide
+    :type arrays: PeptideArrays
+    :return: residue number -> torsions, ordered from the main chain outwards. Residues without side chain
+        torsions (e.g. Gly, Ala, Pro or the capping groups) are not included.
+    :rtype: dict of int -> list of SidechainTorsion
+    """
+    heavy = arrays.symbol != 'H'
+    degrees = arrays.degrees()
+    sp2 = (arrays.symbol == 'C') & (degrees == 3)
+    # amide and guanidinium nitrogens are planar
+    sp2 |= (arrays.symbol == 'N') & (degrees == 3) & np.array(
+        [sp2[arrays.neighbours(i)].any() for i in range(len(arrays))], dtype=bool)
+    torsions = {}
+    for resi in arrays.residues.tolist():
+        sl = arrays.residueSlice(resi)
+        atoms = range(sl.start, sl.stop)
+        if arrays.resn[sl.start] in CAPS:
+            continue
+        try:
+            mainchain = _mainChain(arrays, atoms, heavy, arrays.find(resi, 'N'), arrays.find(resi, 'C'))
+        except KeyError:
+            continue
+        if not mainchain:
+            continue
+        # distance of the heavy atoms from the main chain, in bonds
+        depth = {atom: 0 for atom in mainchain}
+        queue = list(mainchain)
+        for atom in queue:
+            for n in arrays.neighbours(atom).tolist():
+                if n in atoms and heavy[n] and n not in depth:
+                    depth[n] = depth[atom] + 1
+                    queue.append(n)
+        found = []
+        for b, c in arrays.bonds[heavy[arrays.bonds].all(axis=1)].tolist():
+            if b not in depth or c not in depth or depth[b] == depth[c]:
+                continue
+            if depth[b] > depth[c]:
+                b, c = c, b
+            if sp2[b] and sp2[c]:
+                continue
+            moving = _farSide(arrays, b, c)
+            if (moving is None) or any(depth.get(m) == 0 for m in moving) or any(m not in atoms for m in moving) \
+                    or not heavy[moving[1:]].any():
+                # ring bond, main chain bond, cross-link or nothing but hydrogens to rotate
+                continue
+            a = min([n for n in arrays.neighbours(b).tolist() if n != c and n in depth], key=depth.get, default=None)
+            if a is None:
+                continue
+            d = min([n for n in arrays.neighbours(c).tolist() if n != b and heavy[n]])
+            found.append((depth[b], SidechainTorsion(a, b, c, d, np.array(sorted(moving)), bool(sp2[b] or sp2[c]))))
+        if found:
+            torsions[resi] = [t for dep, t in sorted(found, key=lambda x: (x[0], x[1].b, x[1].c))]
+    return torsions
+
+
+def sidechain_branches(torsions: List[SidechainTorsion]) -> List[List[SidechainTorsion]]:
+    """Split the torsions of a residue into its side chains, e.g. the two side chains of a beta2,3-residue
+
+    :param torsions: the torsions of the residue, ordered from the main chain outwards, see :func:`sidechain_torsions`
+    :type torsions: list of SidechainTorsion
+    :return: the torsions of each side chain, ordered from the main chain outwards
+    :rtype: list of lists of SidechainTorsion
+    """
+    branches = []
+    for t in torsions:
+        for branch in branches:
+            # the first torsion of a side chain moves all further ones
+            if t.b in branch[0].moving:
+                branch.append(t)
+                break
+        else:
+            branches.append([t])
+    return branches
+
+
+class RotamerPacker:
+    """Choose side chain rotamers of minimal steric energy
+
+    The positions of the packing are the side chains: a beta2,3-residue has two of them.
+    """
+
+    def __init__(self, arrays: PeptideArrays, residues: Optional[Sequence[int]] = None, prune: float = 30.0,
+                 maxrotamers: int = MAX_ROTAMERS, **kwargs):
+        """Set up the rotamers and their energies
+
+        :param arrays: the peptide
+        :type arrays: PeptideArrays
+        :param residues: the residue numbers to pack, all if None. The other side chains are kept fixed.
+        :type residues: sequence of ints or None
+        :param prune: discard rotamers whose self energy exceeds the best one of the side chain by more than this
+        :type prune: float
+        :param maxrotamers: keep at most this many rotamers of the lowest self energies for each side chain
+        :type maxrotamers: int
+        :param kwargs: parameters of the force field, see :class:`pmlbeta.minimize.ForceField`
+        """
+        self.arrays = arrays
+        self.forcefield = ForceField(arrays, np.zeros(len(arrays), dtype=bool), **kwargs)
+        torsions = sidechain_torsions(arrays)
+        # the residue number and the torsions of each side chain
+        self.residues = []
+        self.torsions = []
+        for r in torsions:
+            if residues is None or r in residues:
+                for branch in sidechain_branches(torsions[r]):
+                    self.residues.append(r)
+                    self.torsions.append(branch)
+        # the atoms moved by the packing of each side chain, and their coordinates in each rotamer
+        self.moving = [np.unique(np.concatenate([t.moving for t in ts])) for ts in self.torsions]
+        self.rotamers = [self._rotamerCoordinates(ts) for ts in self.torsions]
+        self.selfenergies = self._selfEnergies()
+        # rotamers clashing badly with the backbone are not considered further. The current conformation (the first
+        # rotamer) is kept for calculating the initial energy, dead-end elimination will remove it if necessary.
+        self.alive = []
+        for e in self.selfenergies:
+            alive = e <= e.min() + prune
+            alive[np.argsort(e, kind='stable')[maxrotamers:]] = False
+            alive[0] = True
+            self.alive.append(alive)
+        self.pairenergies = self._pairEnergies()
+
+    def _rotamerCoordinates(self, torsions: List[SidechainTorsion]) -> np.ndarray:
+        """The coordinates of the residue atoms in each rotamer, the first one being the current conformation"""
+        # work on the block of atoms spanned by the torsions, the atoms of a residue are contiguous
+        first = min(min(t.moving.min(), t.a, t.b, t.c, t.d) for t in torsions)
+        last = max(max(t.moving.max(), t.a, t.b, t.c, t.d) for t in torsions) + 1
+        values = np.array([[np.nan] * len(torsions)] + list(itertools.product(*[t.values for t in torsions])))
+        x = np.repeat(self.arrays.coords[np.newaxis, first:last], len(values), axis=0)
+        for j, t in enumerate(torsions):
+            a, b, c, d = t.a - first, t.b - first, t.c - first, t.d - first
+            delta = values[:, j] - dihedral_angles(x[:, a], x[:, b], x[:, c], x[:, d])
+            delta[0] = 0.0
+            moving = t.moving - first
+            x[:, moving] = rotate_about_axis(x[:, moving], x[:, b], x[:, c] - x[:, b], delta)
+        moving = np.unique(np.concatenate([t.moving for t in torsions]))
+        return x[:, moving - first]
+
+    def _repulsion(self, atompairs: np.ndarray, distances: np.ndarray) -> np.ndarray:
+        """The repulsion energies of atom pairs, zero for atoms separated by at most three bonds"""
+        atompairs = np.sort(atompairs, axis=1)
+        energies = repulsion_energies(distances, self.forcefield.contactDistances(atompairs), self.forcefield.epsilon)
+        energies[self.forcefield.isExcluded(atompairs)] = 0.0
+        return energies
+
+    def _closePairs(self, points: np.ndarray, others: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Find the pairs of points from two small sets within the interaction cutoff, from the full distance matrix
+
+        :return: the indices into `points` and `others`, and the distances
+        """
+        cutoff = 2 * self.forcefield.radii.max()
+        squared = (points ** 2).sum(axis=1)[:, np.newaxis] + (others ** 2).sum(axis=1) - 2 * points @ others.T
+        p, q = np.nonzero(squared < cutoff ** 2)
+        return p, q, np.linalg.norm(points[p] - others[q], axis=1)
+
+    def _envelopes(self, rotamers: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """The centres and radii of spheres enclosing all rotamers of each residue"""
+        centres = np.array([x.reshape(-1, 3).mean(axis=0) for x in rotamers])
+        radii = np.array([np.linalg.norm(x.reshape(-1, 3) - c, axis=1).max() for x, c in zip(rotamers, centres)])
+        return centres, radii
+
+    def _selfEnergies(self) -> List[np.ndarray]:
+        """The energies of the rotamers with the fixed atoms and within themselves"""
+        fixed = np.ones(len(self.arrays), dtype=bool)
+        for moving in self.moving:
+            fixed[moving] = False
+        fixedatoms = np.flatnonzero(fixed)
+        fixedcoords = self.arrays.coords[fixedatoms]
+        cutoff = 2 * self.forcefield.radii.max()
+        selfenergies = []
+        for moving, x, centre, radius in zip(self.moving, self.rotamers, *self._envelopes(self.rotamers)):
+            # with the fixed atoms near the residue
+            near = np.linalg.norm(fixedcoords - centre, axis=1) < radius + cutoff
+            p, q, distances = self._closePairs(x.reshape(-1, 3), fixedcoords[near])
+            energies = self._repulsion(np.stack([moving[p % len(moving)], fixedatoms[near][q]], axis=1), distances)
+            energy = np.bincount(p // len(moving), energies, minlength=len(x))
+            # within the rotamer
+            u, v = np.triu_indices(len(moving), 1)
+            atompairs = np.tile(np.stack([moving[u], moving[v]], axis=1), (len(x), 1))
+            energy += self._repulsion(atompairs, np.linalg.norm(x[:, u] - x[:, v], axis=2).ravel()).reshape(
+                len(x), -1).sum(axis=1)
+            selfenergies.append(energy)
+        return selfenergies
+
+    def _pairEnergies(self) -> Dict[Tuple[int, int], np.ndarray]:
+        """The energies between the rotamers of different side chains, only for the rotamers still alive"""
+        indices = [np.flatnonzero(alive) for alive in self.alive]
+        rotamers = [x[alive] for x, alive in zip(self.rotamers, self.alive)]
+        centres, radii = self._envelopes(rotamers)
+        cutoff = 2 * self.forcefield.radii.max()
+        points = [x.reshape(-1, 3) for x in rotamers]
+        pairenergies = {}
+        for i, j in zip(*np.triu_indices(len(rotamers), 1)):
+            if np.linalg.norm(centres[i] - centres[j]) >= radii[i] + radii[j] + cutoff:
+                continue
+            mi, mj = len(self.moving[i]), len(self.moving[j])
+            # only the atoms within reach of the other side chain can interact
+            neari = np.flatnonzero(np.linalg.norm(points[i] - centres[j], axis=1) < radii[j] + cutoff)
+            nearj = np.flatnonzero(np.linalg.norm(points[j] - centres[i], axis=1) < radii[i] + cutoff)
+            p, q, distances = self._closePairs(points[i][neari], points[j][nearj])
+            p, q = neari[p], nearj[q]
+            energies = self._repulsion(np.stack([self.moving[i][p % mi], self.moving[j][q % mj]], axis=1), distances)
+            if not (energies > 0).any():
+                continue
+            table = np.zeros((len(self.rotamers[i]), len(self.rotamers[j])))
+            np.add.at(table, (indices[i][p // mi], indices[j][q // mj]), energies)
+            pairenergies[(int(i), int(j))] = table
+        return pairenergies
+
+    def _pairTable(self, i: int, j: int) -> Optional[np.ndarray]:
+        """The pair energies with the rotamers of side chain i in rows and those of side chain j in columns"""
+        if (i, j) in self.pairenergies:
+            return self.pairenergies[(i, j)]
+        elif (j, i) in self.pairenergies:
+            return self.pairenergies[(j, i)].T
+        return None
+
+    def _partners(self) -> List[List[int]]:
+        partners = [[] for i in self.rotamers]
+        for i, j in self.pairenergies:
+            partners[i].append(j)
+            partners[j].append(i)
+        return partners
+
+    def deadEndElimination(self) -> int:
+        """Remove rotamers which cannot be part of the global minimum, by the criterion of Desmet et al.
+
+        Rotamer r of side chain i is eliminated if even its best case energy is higher than the worst case energy of
+        another rotamer t:  E(r) + sum_j min_s E(r, s) > E(t) + sum_j max_s E(t, s)
+
+        :return: the number of eliminated rotamers
+        :rtype: int
+        """
+        partners = self._partners()
+        eliminated = 0
+        changed = True
+        while changed:
+            changed = False
+            for i, energies in enumerate(self.selfenergies):
+                best = energies.copy()
+                worst = energies.copy()
+                for j in partners[i]:
+                    table = self._pairTable(i, j)[:, self.alive[j]]
+                    best += table.min(axis=1)
+                    worst += table.max(axis=1)
+                dead = self.alive[i] & (best > worst[self.alive[i]].min() + 1e-9)
+                if dead.any():
+                    self.alive[i] &= ~dead
+                    eliminated += int(dead.sum())
+                    changed = True
+        return eliminated
+
+    def energy(self, choice: Sequence[int]) -> float:
+        """The total energy of a rotamer combination
+
+        :param choice: the rotamer index of each side chain
+        :type choice: sequence of ints
+        :return: the energy, in kcal/mol
+        :rtype: float
+        """
+        return float(sum(e[c] for e, c in zip(self.selfenergies, choice)) +
+                     sum(table[choice[i], choice[j]] for (i, j), table in self.pairenergies.items()))
+
+    def optimize(self, maxsweeps: int = 50) -> List[int]:
+        """Optimize the rotamers side chain by side chain
+
+        Each side chain starts in its rotamer of the lowest energy with the most favourable rotamers of the others.
+
+        :param maxsweeps: the maximum number of passes over all side chains
+        :type maxsweeps: int
+        :return: the rotamer index of each side chain
+        :rtype: list of ints
+        """
+        partners = self._partners()
+        choice = []
+        for i, energies in enumerate(self.selfenergies):
+            total = energies.copy()
+            for j in partners[i]:
+                total += self._pairTable(i, j)[:, self.alive[j]].min(axis=1)
+            total[~self.alive[i]] = np.inf
+            choice.append(int(np.argmin(total)))
+        for sweep in range(maxsweeps):
+            changed = False
+            for i, energies in enumerate(self.selfenergies):
+                total = energies.copy()
+                for j in partners[i]:
+                    total += self._pairTable(i, j)[:, choice[j]]
+                total[~self.alive[i]] = np.inf
+                best = int(np.argmin(total))
+                if total[best] < total[choice[i]] - 1e-9:
+                    choice[i] = best
+                    changed = True
+            if not changed:
+                break
+        return choice
+
+    def pack(self) -> Dict:
+        """Choose the rotamers and update the coordinates of the peptide
+
+        :return: the numbers of packed residues and side chains, of rotamers, of eliminated rotamers and of changed side
+            chains, and the energies of the initial and the packed side chains
+        :rtype: dict with keys 'residues', 'sidechains', 'rotamers', 'eliminated', 'changed', 'initial' and 'energy'
+        """
+        result = {'residues': len(set(self.residues)), 'sidechains': len(self.residues),
+                  'rotamers': sum(len(x) for x in self.rotamers), 'initial': self.energy([0] * len(self.rotamers))}
+        result['eliminated'] = self.deadEndElimination()
+        choice = self.optimize()
+        result['energy'] = self.energy(choice)
+        result['changed'] = sum(c != 0 for c in choice)
+        for moving, x, c in zip(self.moving, self.rotamers, choice):
+            self.arrays.coords[moving] = x[c]
+        return result
+
+
+def pack_selection(selection: str, state: int = 1) -> Dict:
+    """Pack the side chains of a PyMOL selection
+
+    Atoms outside the selection are ignored.
+
+    :param selection: the peptide
+    :type selection: str
+    :param state: the state to work on
+    :type state: int
+    :return: the results, see :meth:`RotamerPacker.pack`
+    :rtype: dict
+    """
+    arrays = PeptideArrays.fromSelection(selection, state)
+    result = RotamerPacker(arrays).pack()
+    arrays.loadCoords(selection, state)
+    logger.debug('Packed {sidechains} side chains ({rotamers} rotamers, {eliminated} eliminated): '
+                 '{initial:.2f} -> {energy:.2f} kcal/mol'.format(**result))
+    return result
+
+
+def pack_sidechains(selection='all', state=1, quiet=0, _self=None):
+    """
+    DESCRIPTION
+
+        Place the side chains in the rotamers of least steric repulsion
+
+    USAGE
+
+        pack_sidechains [selection [, state [, quiet]]]
+
+    ARGUMENTS
+
+        selection = str: the peptide (default: all)
+
+        state = int: the state to work on (default: 1)
+
+        quiet = 0 or 1: do not print the results
+
+    NOTES
+
+        Side chain torsions are set to the staggered (sp3) or the
+        perpendicular and planar (sp2) positions. The backbone is not changed,
+        atoms outside the selection are not considered.
+
+    SEE ALSO
+
+        fold_bp, clean_bp, check_clashes
+    """
+    result = pack_selection(selection, int(state))
+    if not int(quiet):
+        print('Packed {sidechains} side chains, {changed} changed: {initial:.2f} -> {energy:.2f} kcal/mol'.format(
+            **result))
+    return result['energy']
+
+
+if cmd is not None:
+    cmd.extend('pack_sidechains', pack_sidechains)
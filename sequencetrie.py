@@ -0,0 +1,92 @@
+"""A prefix tree of sequences, for building many related peptides with shared work
+
+Peptides of a library often differ only in their last few residues. If the sequences are arranged in a prefix tree
+(trie) and the tree is walked depth-first, each shared prefix needs to be built only once: after finishing a branch
+the builder returns to the state at the branching point and continues from there.
+"""
+from typing import Any, Hashable, Iterator, List, Sequence, Tuple
+
+
+class _Node:
+    __slots__ = ['value', 'children', 'items']
+
+    def __init__(self, value: Any = None):
+        self.value = value
+        self.children = {}
+        self.items = []
+
+
+class SequenceTrie:
+    """A prefix tree of key sequences
+
+    Each element of a sequence is given by a hashable key, which decides on the sharing, and a value, which is stored
+    in the node when it is created (i.e. the value of the first inserted sequence wins). Items (e.g. object names) are
+    attached to the node where their sequence ends.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self.sequences = 0  # the number of inserted sequences
+        self.nodes = 0  # the number of nodes, excluding the root
+        self.elements = 0  # the total length of the inserted sequences
+
+    def __len__(self) -> int:
+        return self.sequences
+
+    def insert(self, keys: Sequence[Hashable], values: Sequence[Any], item: Any):
+        """Add a sequence
+
+        :param keys: the keys of the elements
+        :type keys: sequence of hashables
+        :param values: the values of the elements, as long as `keys`
+        :type values: sequence
+        :param item: the item to be attached to the last node
+        :type item: any
+        """
+        if len(keys) != len(values):
+            raise ValueError('The number of keys and values must be the same')
+        node = self._root
+        for key, value in zip(keys, values):
+            try:
+                node = node.children[key]
+            except KeyError:
+                node.children[key] = node = _Node(value)
+                self.nodes += 1
+        node.items.append(item)
+        self.sequences += 1
+        self.elements += len(keys)
+
+    def walk(self) -> Iterator[Tuple[int, List[Any], List[Any]]]:
+        """Walk the tree depth-first, visiting the nodes where sequences end
+
+        For each such node a tuple of three is yielded:
+
+            1) the number of leading elements shared with the previously visited sequence
+            2) the values of the remaining elements
+            3) the items attached to the node
+
+        Every node is contained in the second field exactly once, thus the total length of these lists equals
+        :attr:`nodes`.
+
+        :return: iterator over the visited nodes
+        :rtype: iterator of (int, list, list) tuples
+        """
+        if self._root.items:
+            yield 0, [], self._root.items
+        shared = 0  # the length of the prefix of the current path which has already been visited
+        path = []  # the values along the current path
+        stack = [iter(self._root.children.values())]
+        while stack:
+            try:
+                node = next(stack[-1])
+            except StopIteration:
+                stack.pop()
+                if path:
+                    path.pop()
+                    shared = min(shared, len(path))
+                continue
+            path.append(node.value)
+            stack.append(iter(node.children.values()))
+            if node.items:
+                yield shared, path[shared:], node.items
+                shared = len(path)
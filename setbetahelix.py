@@ -6,7 +6,10 @@ except ImportError:
     warnings.warn(
         'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
 import itertools
-from .utils import set_dihedral
+from .utils import set_dihedrals
+from .topology import Topology
+from .clashes import report_clashes
+from .rotamers import pack_selection
 from typing import Union, List, Tuple, Optional, Iterable
 from .secstructdb import SecondaryStructureDB
 import re
@@ -20,20 +23,7 @@ def is_amino_acid(selection: str) -> bool:
     :return: True or False
     :rtype: bool
     """
-    if not cmd.count_atoms('({}) and name N and symbol N'.format(selection)) == 1:
-        # either does not contain a nitrogen called "N" (no amino-acid), or
-        # contains more of them (not a single residue)
-        return False
-    elif not cmd.count_atoms('({}) and name C and symbol C'.format(selection)) == 1:
-        # either does not contain a carbon called "C" (no amino-acid),
-        # or contains more of them (not a single residue)
-        return False
-    elif not cmd.count_atoms(
-            '({}) and (neighbor (name C and symbol C)) and (name CA and symbol C)'.format(selection)) == 1:
-        # the "C" atom must have a "CA" neighbour
-        return False
-    else:
-        return True
+    return Topology.fromSelection(selection).isAminoAcid()
 
 
 def is_beta(selection: str) -> bool:
@@ -44,14 +34,7 @@ def is_beta(selection: str) -> bool:
     :return: True or False
     :rtype: bool
     """
-    if not is_amino_acid(selection):
-        return False
-    # see if "CA" has a neighbour which is also the neighbour of "N" and has the name "CB" or "CB1"
-    if cmd.count_atoms(
-            "(neighbor (({0}) and name N)) and (neighbor (({0}) and name CA)) and ({0}) and name CB+CB1".format(
-                selection)) == 1:
-        return True
-    return False
+    return Topology.fromSelection(selection).isBeta()
 
 
 def is_alpha(selection: str) -> bool:
@@ -62,15 +45,10 @@ def is_alpha(selection: str) -> bool:
     :return: True or False
     :rtype: bool
     """
-    if not is_amino_acid(selection):
-        return False
-    # see if "CA" and "N" are neighbours
-    if cmd.count_atoms("(neighbor (({0}) and name N)) and ({0}) and name CA".format(selection)) == 1:
-        return True
-    return False
+    return Topology.fromSelection(selection).isAlpha()
 
 
-def fold_bp(sstype: str, selection: str = '(all)'):
+def fold_bp(sstype: str, selection: str = '(all)', clashcheck: bool = False, pack: bool = False):
     """
     DESCRIPTION
 
@@ -79,7 +57,7 @@ def fold_bp(sstype: str, selection: str = '(all)'):
 
     USAGE
 
-    fold_bp sstype [, selection]
+    fold_bp sstype [, selection [, clashcheck [, pack]]]
 
     ARGUMENTS
 
@@ -97,6 +75,12 @@ def fold_bp(sstype: str, selection: str = '(all)'):
     selection = the selection to operate on. Must be a single peptide chain with
         unique and consecutive residue IDs (default: all)
 
+    clashcheck = 0 or 1: report the clashing residue pairs after folding (see check_clashes)
+
+    pack = 0 or 1: place the side chains in their best rotamers after folding
+        (see pack_sidechains, default: 0). This can take several seconds for
+        long peptides with many long side chains.
+
     EXAMPLES
 
         fold_bp H14M, model valxval
@@ -119,20 +103,26 @@ def fold_bp(sstype: str, selection: str = '(all)'):
         sstype = itertools.cycle([sstype])  # use this for all residues
     # otherwise try to use sstype as an iterable, producing tuples of floats or Nones
 
-    residues = list(sorted({a.resi_number for a in cmd.get_model(selection).atom}))
+    topology = Topology.fromSelection(selection)
+    residues = topology.residues
     r = None
+    torsions = []
     for r, angles in zip(residues, sstype):
         phi, theta, psi = angles
-        if is_beta('({}) and resi {}'.format(selection, r)):
-            set_dihedral(selection, ('C', r - 1), ('N', r), ('CB+CB1', r), ('CA', r), phi)
-            set_dihedral(selection, ('N', r), ('CB+CB1', r), ('CA', r), ('C', r), theta)
-            set_dihedral(selection, ('CB+CB1', r), ('CA', r), ('C', r), ('N', r + 1), psi)
-        elif is_alpha('({}) and resi {}'.format(selection, r)):
-            set_dihedral(selection, ('C', r - 1), ('N', r), ('CA', r), ('C', r), phi)
-            set_dihedral(selection, ('N', r), ('CA', r), ('C', r), ('N', r + 1), psi)
+        if topology.isBeta(r):
+            torsions.extend([
+                (('C', r - 1), ('N', r), ('CB+CB1', r), ('CA', r), phi),
+                (('N', r), ('CB+CB1', r), ('CA', r), ('C', r), theta),
+                (('CB+CB1', r), ('CA', r), ('C', r), ('N', r + 1), psi)])
+        elif topology.isAlpha(r):
+            torsions.extend([
+                (('C', r - 1), ('N', r), ('CA', r), ('C', r), phi),
+                (('N', r), ('CA', r), ('C', r), ('N', r + 1), psi)])
         else:
             # not an amino acid, do nothing with this.
             continue
+    # all dihedrals are set in one pass
+    set_dihedrals(selection, torsions)
     if not r == max(residues):
         # after the for loop, r must be the largest residue number. If this is not the case,
         # too few angle triplets were given. Do nothing at present, just warn the user
@@ -140,6 +130,14 @@ def fold_bp(sstype: str, selection: str = '(all)'):
 
     cmd.unpick()
     cmd.orient(selection)
+    if isinstance(pack, str):
+        pack = bool(int(pack))
+    if pack:
+        pack_selection(selection)
+    if isinstance(clashcheck, str):
+        clashcheck = bool(int(clashcheck))
+    if clashcheck:
+        report_clashes(selection)
 
 
 def parse_sstype(sstype: Union[
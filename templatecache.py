@@ -0,0 +1,88 @@
+"""A bounded, least-recently-used cache for residue templates"""
+import collections
+import logging
+from typing import Any, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class TemplateCache:
+    """A bounded mapping which evicts the least recently used entries
+
+    Values are created on demand by a factory function, see :meth:`get`. The numbers of hits, misses and evictions
+    are counted for diagnostic purposes.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        """Create a new cache
+
+        :param maxsize: the maximum number of entries
+        :type maxsize: int
+        """
+        if maxsize < 1:
+            raise ValueError('Cache size must be positive')
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Get an entry, creating it if needed
+
+        :param key: the key of the entry
+        :type key: hashable
+        :param factory: function without arguments, called to create the entry if it is not in the cache
+        :type factory: callable
+        :return: the cached entry
+        """
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            value = factory()
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                evicted, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                logger.debug('Evicted from the template cache: {}'.format(evicted))
+            return value
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def resize(self, maxsize: int):
+        """Change the maximum number of entries, evicting the least recently used ones if needed
+
+        :param maxsize: the new maximum size
+        :type maxsize: int
+        """
+        if maxsize < 1:
+            raise ValueError('Cache size must be positive')
+        self.maxsize = maxsize
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Get usage statistics
+
+        :return: the current and maximum size, and the numbers of hits, misses and evictions
+        :rtype: dict
+        """
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
@@ -0,0 +1,177 @@
+"""An index of the residues, atom names and bonds of a model, for answering structural queries without PyMOL selections
+
+Deciding whether a residue is an alpha- or a beta-amino acid, or whether a peptide is consistent, needs only the atom
+names, residue numbers and bonds. Counting atoms in PyMOL selections for this is slow, because each selection is
+evaluated on the whole object. A :class:`Topology` is built once from a single :func:`pymol.cmd.get_model` call and
+answers the same questions from dictionaries and adjacency lists.
+"""
+import warnings
+from typing import Iterable, List, Optional, Set
+
+try:
+    from pymol import cmd
+except ImportError:
+    warnings.warn(
+        'Cannot import PyMOL: functionality will suffer (you can ignore this if you are just building the documentation).')
+    cmd = None
+
+# residue names of the capping groups
+CAPS = ['ACE', 'NME', 'BUT']
+
+
+class Topology:
+    """Residue-wise atom name lookup, bond adjacency and residue classification of a model
+
+    The index reflects the model at the time of its construction: build a new one after the model has been changed.
+    """
+
+    def __init__(self, model: "chempy.models.Indexed", name: Optional[str] = None):
+        """Index a model
+
+        :param model: the model to index
+        :type model: chempy.models.Indexed
+        :param name: the selection the model was obtained from, for reference
+        :type name: str
+        """
+        self.name = name
+        self.natoms = len(model.atom)
+        self.resnames = {}  # residue number -> residue name of its first atom
+        self.allresnames = {}  # residue number -> set of residue names of its atoms
+        self.residueatoms = {}  # residue number -> atom name -> list of atom indices
+        self.nameatoms = {}  # atom name -> set of atom indices, over all residues
+        self.symbols = []
+        for i, atom in enumerate(model.atom):
+            self.resnames.setdefault(atom.resi_number, atom.resn)
+            self.allresnames.setdefault(atom.resi_number, set()).add(atom.resn)
+            self.residueatoms.setdefault(atom.resi_number, {}).setdefault(atom.name, []).append(i)
+            self.nameatoms.setdefault(atom.name, set()).add(i)
+            self.symbols.append(atom.symbol)
+        self.neighbours = [set() for i in range(self.natoms)]
+        for bond in model.bond:
+            i, j = bond.index
+            if i != j:
+                self.neighbours[i].add(j)
+                self.neighbours[j].add(i)
+        self._kinds = {}
+
+    @classmethod
+    def fromSelection(cls, selection: str) -> "Topology":
+        """Index the atoms of a PyMOL selection. Bonds to atoms outside the selection are not considered.
+
+        :param selection: the selection
+        :type selection: str
+        :return: the new index
+        :rtype: Topology
+        """
+        return cls(cmd.get_model('({})'.format(selection)), selection)
+
+    def __len__(self) -> int:
+        return self.natoms
+
+    @property
+    def residues(self) -> List[int]:
+        """The residue numbers in increasing order"""
+        return sorted(self.residueatoms)
+
+    def atoms(self, residue: Optional[int], names: str, symbol: Optional[str] = None) -> Set[int]:
+        """Find atoms by name
+
+        :param residue: the residue number, or None for all residues
+        :type residue: int or None
+        :param names: atom names, alternatives joined by '+' as in PyMOL selections
+        :type names: str
+        :param symbol: only atoms of this element are returned, if given
+        :type symbol: str
+        :return: the indices of the atoms
+        :rtype: set of int
+        """
+        found = set()
+        for name in names.split('+'):
+            if residue is None:
+                found.update(self.nameatoms.get(name, ()))
+            else:
+                found.update(self.residueatoms.get(residue, {}).get(name, ()))
+        if symbol is not None:
+            found = {i for i in found if self.symbols[i] == symbol}
+        return found
+
+    def bondedTo(self, atoms: Iterable[int]) -> Set[int]:
+        """Find the atoms bonded to any of the given ones (like the "neighbor" selection operator)
+
+        :param atoms: atom indices
+        :type atoms: iterable of int
+        :return: the indices of the neighbours
+        :rtype: set of int
+        """
+        found = set()
+        for i in atoms:
+            found.update(self.neighbours[i])
+        return found
+
+    def residueKind(self, residue: int) -> Optional[str]:
+        """Classify a residue
+
+        A residue is an amino acid if it has exactly one of each of the atoms N, H, C, CA and O, with the N-H and C-CA
+        bonds present. It is an alpha-amino acid if N and C share the neighbour CA and a beta-amino acid if N and CA
+        share the neighbour CB or CB1.
+
+        :param residue: the residue number
+        :type residue: int
+        :return: 'alpha', 'beta', 'cap' for capping groups or None if neither
+        :rtype: str or None
+        """
+        try:
+            return self._kinds[residue]
+        except KeyError:
+            pass
+        kind = None
+        n = self.atoms(residue, 'N')
+        c = self.atoms(residue, 'C')
+        ca = self.atoms(residue, 'CA')
+        if len(self.atoms(residue, 'N+C+H+CA+O')) == 5 and \
+                len(self.bondedTo(n) & self.atoms(residue, 'H')) == 1 and \
+                len(self.bondedTo(c) & ca) == 1:
+            if len(self.bondedTo(c) & self.bondedTo(n) & ca) == 1:
+                kind = 'alpha'
+            elif len(self.bondedTo(ca) & self.bondedTo(n) & self.atoms(residue, 'CB+CB1')) == 1:
+                kind = 'beta'
+        if kind is None and self.resnames.get(residue) in CAPS:
+            kind = 'cap'
+        self._kinds[residue] = kind
+        return kind
+
+    def isAminoAcid(self, residue: Optional[int] = None) -> bool:
+        """Decide if a residue (or the whole index) is a single amino acid: it has exactly one N and one C atom and
+        one CA carbon bonded to a C carbon.
+
+        :param residue: the residue number or None to consider all atoms
+        :type residue: int or None
+        :return: True or False
+        :rtype: bool
+        """
+        carbonylcarbons = self.atoms(None, 'C', 'C')
+        return len(self.atoms(residue, 'N', 'N')) == 1 and len(self.atoms(residue, 'C', 'C')) == 1 and \
+            len([i for i in self.atoms(residue, 'CA', 'C') if self.neighbours[i] & carbonylcarbons]) == 1
+
+    def isBeta(self, residue: Optional[int] = None) -> bool:
+        """Decide if a residue (or the whole index) is a beta-amino acid: N and CA share the neighbour CB or CB1
+
+        :param residue: the residue number or None to consider all atoms
+        :type residue: int or None
+        :return: True or False
+        :rtype: bool
+        """
+        return self.isAminoAcid(residue) and len(
+            self.bondedTo(self.atoms(residue, 'N')) & self.bondedTo(self.atoms(residue, 'CA')) &
+            self.atoms(residue, 'CB+CB1')) == 1
+
+    def isAlpha(self, residue: Optional[int] = None) -> bool:
+        """Decide if a residue (or the whole index) is an alpha-amino acid: N and CA are bonded
+
+        :param residue: the residue number or None to consider all atoms
+        :type residue: int or None
+        :return: True or False
+        :rtype: bool
+        """
+        return self.isAminoAcid(residue) and len(
+            self.bondedTo(self.atoms(residue, 'N')) & self.atoms(residue, 'CA')) == 1
@@ -11,10 +11,19 @@ except ImportError:
 import random
 import logging
 import time
+import weakref
+from typing import Optional
+
+import numpy as np
+
+from .geometry import set_dihedral_angles
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# backbone atoms of alpha- and beta-amino acid residues, as selected by select_bbb
+BACKBONE_ATOMS = ['CA', 'CB', 'CB1', 'CC', 'C', 'O', 'N', 'HN']
+
 
 class tempObjectName:
     """Create a temporary object in PyMOL and delete it after use.
@@ -26,38 +35,48 @@ class tempObjectName:
     ...     pass
     >>>
 
-    Name clashes with already existing objects are avoided.
+    Name clashes with already existing objects are avoided. Names handed out but not yet used for creating an object
+    are reserved separately for each PyMOL instance, and released when the context is left.
     """
-    tempobjnames = []
+    tempobjnames = weakref.WeakKeyDictionary()  # PyMOL instance -> set of reserved names
 
-    def __init__(self, prefix: str = '_temporary', nocreate: bool = True):
+    def __init__(self, prefix: str = '_temporary', nocreate: bool = True, _self=None):
         self._prefix = prefix
         self._objname = None
         self._nocreate = nocreate
+        self._cmd = cmd if _self is None else _self
+
+    @classmethod
+    def reserved(cls, _self=None) -> set:
+        """Get the names reserved in a PyMOL instance
+
+        :param _self: the PyMOL instance, the global one if None
+        :return: the reserved names
+        :rtype: set of str
+        """
+        return cls.tempobjnames.setdefault(cmd if _self is None else _self, set())
 
     def __enter__(self) -> str:
+        reserved = self.reserved(self._cmd)
         i = 0
         while True:
             objname = self._prefix + str(i) + str(time.monotonic())
-            if objname not in cmd.get_object_list() and objname not in type(self).tempobjnames:
+            if objname not in self._cmd.get_object_list() and objname not in reserved:
                 break
             i += 1
-        self._objname = objname
-        type(self).tempobjnames.append(self._objname)
-
         if not self._nocreate:
-            logger.debug('Creating model: {}'.format(self._objname))
-            cmd.create(self._objname, 'none')
-            logger.debug('Object list: {}'.format(cmd.get_object_list()))
+            logger.debug('Creating model: {}'.format(objname))
+            self._cmd.create(objname, 'none')
+            logger.debug('Object list: {}'.format(self._cmd.get_object_list()))
             logger.debug('Done.')
+        # reserve the name only now: if the creation failed, __exit__() would not be called to release it
+        reserved.add(objname)
+        self._objname = objname
         return self._objname
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        cmd.delete('model {}'.format(self._objname))
-        try:
-            type(self).tempobjnames.remove(self._objname)
-        except ValueError:
-            pass
+        self._cmd.delete('model {}'.format(self._objname))
+        self.reserved(self._cmd).discard(self._objname)
         self._objname = None
 
 
@@ -97,6 +116,104 @@ class fetchModel:
         self._model = None
 
 
+class cmdBatch:
+    """A proxy over :mod:`pymol.cmd`, coalescing the calls which change atom properties
+
+    This is a context manager, i.e.:
+
+    >>> with cmdBatch() as bcmd:
+    ...     bcmd.alter('model residue', 'resv=1')
+    ...     bcmd.alter('model residue', 'chain="A"')
+    ...     bcmd.remove('model residue and name HG')
+    >>>
+
+    Calls of `alter`, `alter_state`, `remove` and `delete` are queued and issued when the context is left, or before
+    any other PyMOL command called through the proxy, thus the order of the commands is kept. Runs of queued `alter`
+    (or `alter_state`) calls on the same selection are issued as a single call with the expressions joined, runs of
+    `remove` and `delete` calls as a single call on the union of their arguments. Because of this, selections are
+    evaluated when the queue is flushed, and an expression must not change the properties its own selection depends
+    on. Viewer updates are suspended while the context is active.
+
+    If an exception is raised in the context, the queued calls are discarded.
+    """
+
+    def __init__(self, _self=None):
+        self._cmd = cmd if _self is None else _self
+        # [command, selection or (state, selection), expressions or selections, namespace, default namespace needed]
+        self._queue = []
+        self._suspended = None
+
+    def __enter__(self) -> "cmdBatch":
+        # nested batches leave the setting to the outermost one
+        self._suspended = self._cmd.get_setting_boolean('suspend_updates')
+        if not self._suspended:
+            self._cmd.set('suspend_updates', 1)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._queue = []
+            if not self._suspended:
+                self._cmd.set('suspend_updates', 0)
+
+    def _enqueue(self, command: str, key, argument: str, space: Optional[dict] = None):
+        if self._queue:
+            lastcommand, lastkey, arguments, lastspace, default = self._queue[-1]
+            if (lastcommand == command) and (lastkey == key) and (
+                    space is None or all(lastspace.get(k, v) is v for k, v in space.items())):
+                arguments.append(argument)
+                lastspace.update(space or {})
+                self._queue[-1][4] = default or (space is None)
+                return
+        self._queue.append([command, key, [argument], dict(space or {}), space is None])
+
+    def _namespace(self, space: dict, default: bool) -> Optional[dict]:
+        if not space:
+            return None if default else space
+        elif default:
+            # variables of the namespace PyMOL uses by default, for the expressions given without one
+            return dict(self._cmd._pymol.__dict__, **space)
+        return space
+
+    def alter(self, selection: str, expression: str, quiet: int = 1, space: Optional[dict] = None):
+        """Queue an `alter` call, see :func:`pymol.cmd.alter`"""
+        self._enqueue('alter', selection, expression, space)
+
+    def alter_state(self, state: int, selection: str, expression: str, quiet: int = 1, space: Optional[dict] = None):
+        """Queue an `alter_state` call, see :func:`pymol.cmd.alter_state`"""
+        self._enqueue('alter_state', (int(state), selection), expression, space)
+
+    def remove(self, selection: str, quiet: int = 1):
+        """Queue a `remove` call, see :func:`pymol.cmd.remove`"""
+        self._enqueue('remove', None, selection)
+
+    def delete(self, name: str):
+        """Queue a `delete` call, see :func:`pymol.cmd.delete`"""
+        self._enqueue('delete', None, name)
+
+    def flush(self):
+        """Issue the queued calls"""
+        queue, self._queue = self._queue, []
+        for command, key, arguments, space, default in queue:
+            if command == 'alter':
+                self._cmd.alter(key, '; '.join(arguments), space=self._namespace(space, default))
+            elif command == 'alter_state':
+                self._cmd.alter_state(key[0], key[1], '; '.join(arguments), space=self._namespace(space, default))
+            elif command == 'remove':
+                self._cmd.remove(' or '.join('({})'.format(s) for s in arguments))
+            else:
+                assert command == 'delete'
+                self._cmd.delete(' '.join(arguments))
+
+    def __getattr__(self, item: str):
+        # any other PyMOL command: issue the queued calls first
+        self.flush()
+        return getattr(self._cmd, item)
+
+
 def getAtom(model, **kwargs):
     atoms = [a for a in model.atom if all([getattr(a, k) == v for k, v in kwargs.items()])]
     if len(atoms) > 1:
@@ -170,6 +287,50 @@ def set_dihedral(modelname, nameandresi1, nameandresi2, nameandresi3, nameandres
     return True
 
 
+def set_dihedrals(modelname, dihedrals):
+    """Set many dihedral angles at once, with the same result as successive calls to :func:`set_dihedral`
+
+    The coordinates and bonds of the affected objects are fetched once, all dihedrals are set by
+    :func:`pmlbeta.geometry.set_dihedral_angles` and the new coordinates are loaded back once.
+
+    :param modelname: the selection in which the atoms are looked up
+    :type modelname: str
+    :param dihedrals: four (name, resi) pairs and the desired value in degrees for each dihedral. Names can be
+        alternatives joined by '+', as in PyMOL selections. Dihedrals with None as the value are left untouched.
+    :type dihedrals: iterable of (tuple, tuple, tuple, tuple, float or None)
+    :return: for each dihedral, whether it was set (all four atoms must be unique in the selection)
+    :rtype: list of bool
+    """
+    dihedrals = list(dihedrals)
+    lookup = {}
+    for atom in cmd.get_model('({})'.format(modelname)).atom:
+        lookup.setdefault((atom.resi, atom.name), []).append((atom.model, atom.index - 1))
+
+    def findatom(name, resi):
+        found = [a for n in name.split('+') for a in lookup.get((str(resi), n), [])]
+        return found[0] if len(found) == 1 else None
+
+    torsions = {}  # object name -> list of (index in `dihedrals`, atom indices, value)
+    for i, dihedral in enumerate(dihedrals):
+        value = dihedral[4]
+        atoms = [findatom(*nr) for nr in dihedral[:4]]
+        if value is None or None in atoms or len({obj for obj, index in atoms}) > 1:
+            continue
+        torsions.setdefault(atoms[0][0], []).append((i, [index for obj, index in atoms], value))
+    success = [False] * len(dihedrals)
+    for obj, objtorsions in torsions.items():
+        model = cmd.get_model('model {}'.format(obj))
+        coords, applied = set_dihedral_angles(
+            cmd.get_coords('model {}'.format(obj)),
+            np.array([b.index for b in model.bond], dtype=int),
+            np.array([t[1] for t in objtorsions], dtype=int),
+            np.array([t[2] for t in objtorsions], dtype=float))
+        cmd.load_coords(coords, 'model {}'.format(obj))
+        for (i, indices, value), ok in zip(objtorsions, applied):
+            success[i] = bool(ok)
+    return success
+
+
 def get_dihedral(modelname, nameandresi1, nameandresi2, nameandresi3, nameandresi4):
     """A safer version of cmd.get_dihedral(): doesn't choke on non-singleton selections"""
     selections = [
@@ -269,7 +430,7 @@ def select_bbb(selectionname='bbone', originalselection='all'):
 
     originalselection = superset in which the backbone will be searched
     """
-    cmd.select(selectionname, '({}) and name CA+CB+CB1+CC+C+O+N+HN'.format(originalselection))
+    cmd.select(selectionname, '({}) and name {}'.format(originalselection, '+'.join(BACKBONE_ATOMS)))
 
 
 def label_chains(selection):